@@ -0,0 +1,256 @@
+"""Benchmark suite for geoconverter.
+
+Times statistics (min/max and stretch), directory discovery and end-to-end
+conversion on synthetic rasters, and writes the results as JSON so that runs
+can be compared across commits.
+
+Usage:
+
+```console
+python -m benchmarks.run --suite quick --out bench/quick.json
+python -m benchmarks.run --suite full --workdir /scratch/bench --out bench/full.json
+python -m benchmarks.run compare bench/base.json bench/quick.json --threshold 1.1
+```
+"""
+
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+from osgeo import gdal
+
+from benchmarks.synthetic import RasterSpec, make_raster, make_tree
+from geoconverter import gdal_convert
+from geoconverter.utils import get_extension, parse_files
+
+SUITES = {
+    "quick": {
+        "rasters": [
+            RasterSpec(1024, 1024, 1, dtype, tiled)
+            for dtype in ("Byte", "UInt16", "Float32")
+            for tiled in (True, False)
+        ]
+        + [
+            RasterSpec(1024, 1024, 3, "UInt16", True),
+            RasterSpec(1024, 1024, 1, "Float32", True, nodata_ratio=0.1),
+        ],
+        "tree": 2000,
+        "convert": RasterSpec(2048, 2048, 3, "UInt16", True),
+    },
+    "full": {
+        "rasters": [
+            RasterSpec(8192, 8192, bands, dtype, tiled, nodata_ratio=nodata)
+            for bands in (1, 4)
+            for dtype in ("Byte", "UInt16", "Int16", "Float32")
+            for tiled in (True, False)
+            for nodata in (0.0, 0.2)
+        ]
+        + [RasterSpec(16384, 16384, 3, "UInt16", True)],
+        "tree": 100000,
+        "convert": RasterSpec(8192, 8192, 4, "UInt16", True),
+    },
+    "huge": {
+        "rasters": [RasterSpec(40000, 40000, 3, "UInt16", True)],
+        "tree": 1000000,
+        "convert": RasterSpec(40000, 40000, 3, "UInt16", True),
+    },
+}  # type: Dict[str, Dict[str, Any]]
+
+FORMATS = ["COG", "GTiff", "JP2OpenJPEG", "HFA"]
+
+
+def timed(func: Callable[[], Any], repeats: int) -> List[float]:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def result(
+    name: str, times: List[float], nbytes: int = 0, **params: Any
+) -> Dict[str, Any]:
+    best = min(times)
+    entry = {
+        "name": name,
+        "params": params,
+        "seconds": times,
+        "min": best,
+        "median": statistics.median(times),
+    }
+    if nbytes:
+        entry["mb_per_s"] = nbytes / 2**20 / best
+    print(f"{name:<28}{best:>10.3f} s  {params}", file=sys.stderr)
+    return entry
+
+
+def bench_stats(workdir: Path, specs: List[RasterSpec], repeats: int) -> List[Any]:
+    results = []
+    for spec in specs:
+        path = make_raster(workdir / "rasters" / f"{spec.name}.tif", spec)
+        ds = gdal.Open(str(path))
+        cases = {
+            "stats/minmax": dict(stretch=False),
+            "stats/stretch": dict(stretch=True),
+            "stats/stretch-sample": dict(stretch=True, mode="sample"),
+        }  # type: Dict[str, Dict[str, Any]]
+        for name, kwargs in cases.items():
+            times = timed(
+                lambda: gdal_convert.getScaleParams(
+                    ds, [0.0, 255.0], lower=2.0, upper=98.0, **kwargs
+                ),
+                repeats,
+            )
+            results.append(result(name, times, spec.nbytes, raster=spec.name))
+        ds = None
+    return results
+
+
+def bench_discovery(workdir: Path, files: int, repeats: int) -> List[Any]:
+    root = make_tree(workdir / f"tree_{files}", files)
+    out = tempfile.mkdtemp(dir=str(workdir))
+    results = []
+    for use_scandir in (False, True):
+
+        def first() -> None:
+            next(iter(parse_files(str(root), out, "GTiff", use_scandir=use_scandir)))
+
+        def full() -> None:
+            for _ in parse_files(str(root), out, "GTiff", use_scandir=use_scandir):
+                pass
+
+        params = dict(files=files, scandir=use_scandir)
+        results.append(result("discovery/first", timed(first, repeats), **params))
+        results.append(result("discovery/all", timed(full, repeats), **params))
+    return results
+
+
+def bench_convert(workdir: Path, spec: RasterSpec, repeats: int) -> List[Any]:
+    path = make_raster(workdir / "rasters" / f"{spec.name}.tif", spec)
+    results = []
+    for fmt in FORMATS:
+        for stretch in (False, True):
+            for engine in gdal_convert.ENGINES:
+                out = workdir / "out" / f"{spec.name}.{get_extension(path, fmt)}"
+                out.parent.mkdir(parents=True, exist_ok=True)
+                argv = ["-i", str(path), "-o", str(out), "-of", fmt, "-ot", "Byte"]
+                argv += ["--engine", engine]
+                if stretch:
+                    argv += ["stretch", "-s", "2", "98"]
+                args = gdal_convert.get_args(argv)
+                times = timed(lambda: gdal_convert.main(args), repeats)
+                results.append(
+                    result(
+                        "convert",
+                        times,
+                        spec.nbytes,
+                        raster=spec.name,
+                        format=fmt,
+                        stretch=stretch,
+                        engine=engine,
+                    )
+                )
+    return results
+
+
+def metadata() -> Dict[str, Any]:
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=str(Path(__file__).parent), text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.time(),
+        "python": platform.python_version(),
+        "gdal": gdal.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+def compare(base: Path, new: Path, threshold: float) -> int:
+    """Print min-time ratios of matching benchmarks, flag regressions."""
+
+    def key(entry: Dict[str, Any]) -> str:
+        return str(entry["name"]) + json.dumps(entry["params"], sort_keys=True)
+
+    old = {key(e): e for e in json.loads(base.read_text())["results"]}
+    regressions = 0
+    for entry in json.loads(new.read_text())["results"]:
+        before = old.get(key(entry))
+        if before is None:
+            continue
+        ratio = entry["min"] / before["min"]
+        flag = "REGRESSION" if ratio > threshold else ""
+        regressions += bool(flag)
+        print(
+            f"{entry['name']:<24}{before['min']:>10.3f}{entry['min']:>10.3f}"
+            f"{ratio:>8.2f}x  {entry['params']} {flag}"
+        )
+    return 1 if regressions else 0
+
+
+def get_args() -> Namespace:
+    parser = ArgumentParser(description="geoconverter benchmarks")
+    subparsers = parser.add_subparsers(dest="command")
+    parser.add_argument("--suite", choices=SUITES, default="quick")
+    parser.add_argument("--workdir", default="bench_data", help="generated data")
+    parser.add_argument("--out", default="-", help="JSON results, - for stdout")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=("stats", "discovery", "convert"),
+        default=["stats", "discovery", "convert"],
+    )
+
+    compare_parser = subparsers.add_parser("compare", help="compare two runs")
+    compare_parser.add_argument("base", type=Path)
+    compare_parser.add_argument("new", type=Path)
+    compare_parser.add_argument(
+        "--threshold", type=float, default=1.1, help="slowdown ratio to flag"
+    )
+    return parser.parse_args()
+
+
+def main(args: Namespace) -> int:
+    if args.command == "compare":
+        return compare(args.base, args.new, args.threshold)
+
+    # Keep GDAL from reusing statistics saved in .aux.xml by earlier repeats
+    gdal.SetConfigOption("GDAL_PAM_ENABLED", "NO")
+    suite = SUITES[args.suite]
+    workdir = Path(args.workdir)
+    results = []  # type: List[Any]
+    if "stats" in args.only:
+        results += bench_stats(workdir, suite["rasters"], args.repeats)
+    if "discovery" in args.only:
+        results += bench_discovery(workdir, suite["tree"], args.repeats)
+    if "convert" in args.only:
+        results += bench_convert(workdir, suite["convert"], args.repeats)
+
+    report = json.dumps(
+        {"meta": {**metadata(), "suite": args.suite}, "results": results}, indent=2
+    )
+    if args.out == "-":
+        print(report)
+    else:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(get_args()))
@@ -0,0 +1,117 @@
+"""Cold-start benchmark for the geoconverter CLI.
+
+Times `python -m geoconverter --help` and argument parsing in fresh
+interpreters, net of bare interpreter startup, and checks that no heavy
+module (GDAL, NumPy, tkinter, ...) is imported before a conversion needs it.
+Exits non-zero if either guard fails, so it can run in CI.
+
+Usage:
+
+```console
+python -m benchmarks.startup --max-ms 150 --out bench/startup.json
+```
+"""
+
+import json
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Modules that must not be loaded just to parse arguments
+HEAVY_MODULES = ("osgeo", "numpy", "tkinter", "sqlite3", "multiprocessing")
+
+PARSE_ONLY = (
+    "import sys, json\n"
+    "from geoconverter.gdal_convert import get_args\n"
+    "get_args(['-i', 'in.tif', '-of', 'COG', 'stretch', '-s', '2', '98'])\n"
+    "print(json.dumps([m for m in {heavy!r} if m in sys.modules]))\n"
+)
+
+
+def run(cmd: List[str], repeats: int) -> List[float]:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(
+            cmd, cwd=str(ROOT), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def heavy_imports() -> List[str]:
+    """Heavy modules loaded by parsing arguments."""
+    code = PARSE_ONLY.format(heavy=HEAVY_MODULES)
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=str(ROOT))
+    return list(json.loads(out))
+
+
+def get_args() -> Namespace:
+    parser = ArgumentParser(description="geoconverter startup benchmark")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument(
+        "--max-ms",
+        type=float,
+        help="fail if --help takes longer than this beyond bare interpreter startup",
+    )
+    parser.add_argument("--out", default="-", help="JSON results, - for stdout")
+    return parser.parse_args()
+
+
+def main(args: Namespace) -> int:
+    cases = {
+        "startup/python": [sys.executable, "-c", "pass"],
+        "startup/help": [sys.executable, "-m", "geoconverter", "--help"],
+        "startup/parse": [sys.executable, "-c", PARSE_ONLY.format(heavy=HEAVY_MODULES)],
+    }
+    results: List[Dict[str, Any]] = []
+    for name, cmd in cases.items():
+        times = run(cmd, args.repeats)
+        results.append(
+            {
+                "name": name,
+                "params": {},
+                "seconds": times,
+                "min": min(times),
+                "median": statistics.median(times),
+            }
+        )
+
+    baseline = results[0]["median"]
+    overhead = (results[1]["median"] - baseline) * 1000
+    loaded = heavy_imports()
+    print(f"--help: {overhead:.1f} ms over bare interpreter startup", file=sys.stderr)
+
+    status = 0
+    if loaded:
+        print(f"Heavy modules loaded by argument parsing: {loaded}", file=sys.stderr)
+        status = 1
+    if args.max_ms is not None and overhead > args.max_ms:
+        print(f"Startup exceeds {args.max_ms:.0f} ms", file=sys.stderr)
+        status = 1
+
+    report = json.dumps(
+        {
+            "meta": {"python": sys.version.split()[0], "time": time.time()},
+            "results": results,
+            "overhead_ms": overhead,
+            "heavy_imports": loaded,
+        },
+        indent=2,
+    )
+    if args.out == "-":
+        print(report)
+    else:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(report)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(get_args()))
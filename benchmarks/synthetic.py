@@ -0,0 +1,195 @@
+"""Synthetic rasters for benchmarking geoconverter.
+
+Rasters are written a strip at a time, so multi-GB rasters can be generated
+without holding them in memory. Generation is deterministic for a given seed.
+
+Usage:
+
+```console
+python -m benchmarks.synthetic out.tif --size 8192 8192 --bands 3 --dtype UInt16 --tiled
+```
+"""
+
+import os
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional, Union
+
+import numpy as np
+from osgeo import gdal, osr
+
+NUMPY_TYPES: Dict[str, Any] = {
+    "Byte": np.uint8,
+    "UInt16": np.uint16,
+    "Int16": np.int16,
+    "UInt32": np.uint32,
+    "Int32": np.int32,
+    "Float32": np.float32,
+    "Float64": np.float64,
+}
+
+NODATA = {"Byte": 0, "UInt16": 0, "UInt32": 0}
+
+
+class RasterSpec(NamedTuple):
+    """Parameters of a synthetic raster."""
+
+    width: int = 1024
+    height: int = 1024
+    bands: int = 1
+    dtype: str = "Float32"
+    tiled: bool = True
+    block: int = 256
+    nodata_ratio: float = 0.0
+    seed: int = 0
+
+    @property
+    def name(self) -> str:
+        layout = f"tiled{self.block}" if self.tiled else "striped"
+        return (
+            f"{self.width}x{self.height}x{self.bands}_{self.dtype}_{layout}"
+            f"_nd{self.nodata_ratio:g}"
+        )
+
+    @property
+    def nbytes(self) -> int:
+        itemsize = np.dtype(NUMPY_TYPES[self.dtype]).itemsize
+        return int(self.width * self.height * self.bands * itemsize)
+
+
+def _strip(spec: RasterSpec, rng: np.random.RandomState, rows: int) -> np.ndarray:
+    """Smooth gradient plus noise, so compression and histograms are realistic."""
+    dtype = NUMPY_TYPES[spec.dtype]
+    shape = (rows, spec.width)
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        lo, hi = max(info.min, -30000), min(info.max, 60000)
+        base = np.linspace(lo, hi, spec.width)[None, :]
+        noise = rng.normal(0, (hi - lo) * 0.05, shape)
+        return np.clip(base + noise, info.min, info.max).astype(dtype)
+    base = np.linspace(0.0, 1.0, spec.width)[None, :]
+    return (base + rng.normal(0, 0.1, shape)).astype(dtype)
+
+
+def make_raster(
+    path: Union[Path, str], spec: RasterSpec, driver: str = "GTiff"
+) -> Path:
+    """Write a synthetic raster, reusing an existing file at `path`.
+
+    Args:
+        path (Union[Path, str]): Output path
+        spec (RasterSpec): Raster parameters
+        driver (str, optional): GDAL driver supporting Create. Defaults to "GTiff".
+
+    Returns:
+        Path: Path to raster
+    """
+    path = Path(path)
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    options = ["BIGTIFF=IF_SAFER"]
+    if spec.tiled:
+        options += ["TILED=YES", f"BLOCKXSIZE={spec.block}", f"BLOCKYSIZE={spec.block}"]
+    else:
+        options += ["TILED=NO", "BLOCKYSIZE=1"]
+    tmp = path.with_name(path.name + ".partial")
+    ds = gdal.GetDriverByName(driver).Create(
+        str(tmp),
+        spec.width,
+        spec.height,
+        spec.bands,
+        gdal.GetDataTypeByName(spec.dtype),
+        options=options if driver == "GTiff" else [],
+    )
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(3857)
+    ds.SetProjection(srs.ExportToWkt())
+    ds.SetGeoTransform([0, 10, 0, 0, 0, -10])
+
+    nodata = NODATA.get(spec.dtype, -9999)
+    rng = np.random.RandomState(spec.seed)
+    rows = max(1, min(spec.height, (64 * 2**20) // (spec.width * 8)))
+    for b in range(1, spec.bands + 1):
+        band = ds.GetRasterBand(b)
+        if spec.nodata_ratio > 0:
+            band.SetNoDataValue(nodata)
+        for yoff in range(0, spec.height, rows):
+            strip = _strip(spec, rng, min(rows, spec.height - yoff))
+            if spec.nodata_ratio > 0:
+                strip[rng.random_sample(strip.shape) < spec.nodata_ratio] = nodata
+            band.WriteArray(strip, 0, yoff)
+    ds = None
+    tmp.rename(path)
+    return path
+
+
+def make_tree(
+    root: Union[Path, str],
+    files: int,
+    fanout: int = 32,
+    sidecars: bool = True,
+    content: Optional[Path] = None,
+) -> Path:
+    """Create a directory tree of raster names (and sidecars) for discovery.
+
+    Args:
+        root (Union[Path, str]): Tree root
+        files (int): Number of rasters
+        fanout (int, optional): Files per directory. Defaults to 32.
+        sidecars (bool, optional): Add .aux.xml, .ovr and .tfw sidecars.
+        content (Optional[Path]): Raster hard-linked for every file. Empty
+            files are created if None, which suffices when the output format
+            is not Native.
+
+    Returns:
+        Path: Tree root
+    """
+    root = Path(root)
+    marker = root / f".complete-{files}"
+    if marker.exists():
+        return root
+    for i in range(files):
+        d = root / f"d{i // fanout // fanout:03d}" / f"d{i // fanout % fanout:03d}"
+        d.mkdir(parents=True, exist_ok=True)
+        f = d / f"scene_{i:07d}.tif"
+        if content is None:
+            f.touch()
+        elif not f.exists():
+            os.link(str(content), str(f))
+        if sidecars:
+            for suffix in (".tif.aux.xml", ".ovr", ".tfw"):
+                (d / f"scene_{i:07d}{suffix}").touch()
+    marker.touch()
+    return root
+
+
+def get_args() -> Namespace:
+    parser = ArgumentParser(description="Synthetic raster generator")
+    parser.add_argument("output", help="output raster")
+    parser.add_argument("--size", type=int, nargs=2, default=[1024, 1024])
+    parser.add_argument("--bands", type=int, default=1)
+    parser.add_argument("--dtype", default="Float32", choices=NUMPY_TYPES)
+    parser.add_argument("--tiled", action="store_true", help="tiled, else striped")
+    parser.add_argument("--block", type=int, default=256)
+    parser.add_argument("--nodata-ratio", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    make_raster(
+        args.output,
+        RasterSpec(
+            args.size[0],
+            args.size[1],
+            args.bands,
+            args.dtype,
+            args.tiled,
+            args.block,
+            args.nodata_ratio,
+            args.seed,
+        ),
+    )
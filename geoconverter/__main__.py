@@ -0,0 +1,6 @@
+"""Command line converter without the GUI: python -m geoconverter -i in.tif ..."""
+
+from geoconverter.gdal_convert import cli
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,288 @@
+"""In-memory conversion API for geoconverter.
+
+Converts paths, open datasets, in-memory buffers and NumPy arrays without
+going through the command line or writing to disk.
+
+Usage:
+
+```python
+from geoconverter.api import convert_to_bytes
+
+cog = convert_to_bytes(array, format="COG", dtype="Byte",
+                       geotransform=gt, projection=wkt, stretch=(2, 98))
+```
+"""
+
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from osgeo import gdal, gdal_array
+
+from geoconverter.defaults import DEFAULT_MAX_MEMORY, DEFAULT_SAMPLE_BLOCKS
+from geoconverter.gdal_convert import (
+    BITRANGE,
+    VSIMEM_PREFIX,
+    ProgressCallback,
+    setupOptions,
+)
+
+Source = Union[str, Path, gdal.Dataset, bytes, bytearray, memoryview, np.ndarray]
+
+
+def _vsimem_name(suffix: str = "") -> str:
+    return f"{VSIMEM_PREFIX}/{uuid.uuid4().hex}{suffix}"
+
+
+def unlink(path: str) -> None:
+    """Remove an in-memory file returned by `convert`, with its sidecars."""
+    for name in (path, f"{path}.aux.xml"):
+        if gdal.VSIStatL(name) is not None:
+            gdal.Unlink(name)
+
+
+def read_bytes(path: str) -> bytes:
+    """Read a file through GDAL's virtual file system, e.g. from /vsimem/."""
+    stat = gdal.VSIStatL(path)
+    if stat is None:
+        raise RuntimeError(f"Unable to stat {path}")
+    f = gdal.VSIFOpenL(path, "rb")
+    if f is None:
+        raise RuntimeError(f"Unable to open {path}")
+    try:
+        return bytes(gdal.VSIFReadL(1, stat.size, f))
+    finally:
+        gdal.VSIFCloseL(f)
+
+
+def from_array(
+    array: np.ndarray,
+    geotransform: Optional[Sequence[float]] = None,
+    projection: Optional[str] = None,
+    nodata: Optional[float] = None,
+) -> gdal.Dataset:
+    """Wrap a NumPy array in an in-memory dataset.
+
+    Args:
+        array (np.ndarray): Raster of shape (rows, cols) or (bands, rows, cols)
+        geotransform (Optional[Sequence[float]]): GDAL geotransform
+        projection (Optional[str]): Projection as WKT
+        nodata (Optional[float]): Nodata value of every band
+
+    Raises:
+        ValueError: if the array is not 2 or 3 dimensional or its dtype is not
+            supported by GDAL
+
+    Returns:
+        gdal.Dataset: MEM dataset holding a copy of `array`
+    """
+    if array.ndim == 2:
+        array = array[np.newaxis]
+    if array.ndim != 3:
+        raise ValueError(f"Expected a 2D or 3D array, got shape {array.shape}")
+    datatype = gdal_array.NumericTypeCodeToGDALTypeCode(array.dtype)
+    if datatype is None:
+        raise ValueError(f"Unsupported array dtype {array.dtype}")
+
+    count, rows, cols = array.shape
+    ds = gdal.GetDriverByName("MEM").Create("", cols, rows, count, datatype)
+    if geotransform is not None:
+        ds.SetGeoTransform(list(geotransform))
+    if projection is not None:
+        ds.SetProjection(projection)
+    for b in range(count):
+        band = ds.GetRasterBand(b + 1)
+        if nodata is not None:
+            band.SetNoDataValue(nodata)
+        band.WriteArray(array[b])
+    return ds
+
+
+@contextmanager
+def open_source(
+    source: Source,
+    geotransform: Optional[Sequence[float]] = None,
+    projection: Optional[str] = None,
+    nodata: Optional[float] = None,
+) -> Iterator[gdal.Dataset]:
+    """Open any supported source as a dataset for the duration of the context.
+
+    Buffers are exposed through /vsimem/ and removed afterwards.
+
+    Args:
+        source (Source): Path (incl. /vsimem/ and other virtual paths), open
+            dataset, encoded raster bytes or NumPy array
+        geotransform (Optional[Sequence[float]]): Geotransform of an array
+        projection (Optional[str]): Projection (WKT) of an array
+        nodata (Optional[float]): Nodata value of an array
+
+    Raises:
+        RuntimeError: if the source cannot be opened
+
+    Yields:
+        gdal.Dataset: Opened source
+    """
+    if isinstance(source, gdal.Dataset):
+        yield source
+        return
+    if isinstance(source, np.ndarray):
+        yield from_array(source, geotransform, projection, nodata)
+        return
+
+    buffer = None
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        buffer = _vsimem_name()
+        gdal.FileFromMemBuffer(buffer, bytes(source))
+        source = buffer
+    try:
+        ds = gdal.Open(str(source))
+        if ds is None:
+            raise RuntimeError(f"Unable to open {'buffer' if buffer else source}")
+        yield ds
+        ds = None
+    finally:
+        if buffer is not None:
+            unlink(buffer)
+
+
+def _convert(
+    ds: gdal.Dataset,
+    format: str,
+    dtype: str,
+    bands: Optional[List[int]],
+    output_range: Optional[Tuple[float, float]],
+    stretch: Optional[Tuple[float, float]],
+    destination: Optional[str],
+    stats_mode: str,
+    max_memory: int,
+    sample_blocks: int,
+    callback: Optional[ProgressCallback],
+) -> str:
+    if format.lower() == "native":
+        format = ds.GetDriver().ShortName
+        if format == "MEM":
+            raise ValueError("An explicit format is needed for arrays")
+    driver = gdal.GetDriverByName(format)
+    if driver is None:
+        raise ValueError(f"Invalid output format {format}")
+    if dtype.lower() == "native":
+        dtype = gdal.GetDataTypeName(ds.GetRasterBand(1).DataType)
+    if dtype not in BITRANGE:
+        raise ValueError(f"Unsupported output dtype {dtype}")
+    outputRange = list(output_range) if output_range else BITRANGE[dtype]
+
+    kwargs: Dict[str, Any] = {}
+    if stretch is not None:
+        kwargs = {"stretch": True, "lower": stretch[0], "upper": stretch[1]}
+    options = setupOptions(
+        ds,
+        format,
+        dtype,
+        outputRange,
+        bands,
+        max_memory=max_memory,
+        mode=stats_mode,
+        sample_blocks=sample_blocks,
+        callback=callback,
+        **kwargs,
+    )
+    if destination is None:
+        ext = driver.GetMetadataItem("DMD_EXTENSION")
+        destination = _vsimem_name(f".{ext}" if ext else "")
+    result = gdal.Translate(destName=destination, srcDS=ds, options=options)
+    if result is None:
+        raise RuntimeError(f"Failed to convert to {format}")
+    # Closing flushes the output
+    result = None
+    return destination
+
+
+def convert(
+    source: Source,
+    format: str = "COG",
+    dtype: str = "Native",
+    bands: Optional[List[int]] = None,
+    output_range: Optional[Tuple[float, float]] = None,
+    stretch: Optional[Tuple[float, float]] = None,
+    destination: Optional[str] = None,
+    geotransform: Optional[Sequence[float]] = None,
+    projection: Optional[str] = None,
+    nodata: Optional[float] = None,
+    stats_mode: str = "exact",
+    max_memory: int = DEFAULT_MAX_MEMORY,
+    sample_blocks: int = DEFAULT_SAMPLE_BLOCKS,
+    callback: Optional[ProgressCallback] = None,
+) -> str:
+    """Rescale and convert a raster, by default into an in-memory file.
+
+    Uses the same scale parameters as the command line, but never touches
+    the statistics cache or the disk unless `destination` is a local path.
+    Statistics are not saved next to the source (.aux.xml) either.
+
+    Args:
+        source (Source): Raster to convert, see `open_source`
+        format (str, optional): Output format. "Native" keeps the format of
+            the source. Defaults to "COG".
+        dtype (str, optional): Output dtype. Defaults to "Native".
+        bands (Optional[List[int]]): 1-based bands to export. Defaults to all.
+        output_range (Optional[Tuple[float, float]]): Output range. Defaults
+            to the full range of `dtype`.
+        stretch (Optional[Tuple[float, float]]): Lower and upper percentiles
+            to stretch to. Defaults to a min/max stretch.
+        destination (Optional[str]): Output path. Defaults to a new /vsimem/
+            file, which the caller removes with `unlink`.
+        geotransform (Optional[Sequence[float]]): Geotransform of an array
+        projection (Optional[str]): Projection (WKT) of an array
+        nodata (Optional[float]): Nodata value of an array
+        stats_mode (str, optional): "exact", "overview" or "sample"
+        max_memory (int, optional): Memory budget for statistics in bytes
+        sample_blocks (int, optional): Blocks read in sample mode
+        callback (Optional[ProgressCallback]): GDAL progress callback
+
+    Raises:
+        ValueError: if the format or dtype cannot be resolved
+        RuntimeError: if the source cannot be opened or the conversion fails
+
+    Returns:
+        str: Path to the output
+    """
+    pam = gdal.GetThreadLocalConfigOption("GDAL_PAM_ENABLED", None)
+    gdal.SetThreadLocalConfigOption("GDAL_PAM_ENABLED", "NO")
+    try:
+        with open_source(source, geotransform, projection, nodata) as ds:
+            destination = _convert(
+                ds,
+                format,
+                dtype,
+                bands,
+                output_range,
+                stretch,
+                destination,
+                stats_mode,
+                max_memory,
+                sample_blocks,
+                callback,
+            )
+    finally:
+        gdal.SetThreadLocalConfigOption("GDAL_PAM_ENABLED", pam)
+    return destination
+
+
+def convert_to_bytes(source: Source, format: str = "COG", **kwargs: Any) -> bytes:
+    """Like `convert`, but return the encoded output instead of a path.
+
+    Args:
+        source (Source): Raster to convert, see `open_source`
+        format (str, optional): Output format. Defaults to "COG".
+        **kwargs: Further arguments of `convert`, except `destination`
+
+    Returns:
+        bytes: Content of the output file
+    """
+    path = convert(source, format, **kwargs)
+    try:
+        return read_bytes(path)
+    finally:
+        unlink(path)
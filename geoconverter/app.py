@@ -1,15 +1,20 @@
 import abc
+import base64
 import os
-import subprocess
+import queue
 import sys
+import threading
 import tkinter as tk
 import traceback
 from tkinter import filedialog as fd
 from tkinter import ttk
 from tkinter.messagebox import showerror
-from typing import Any, Tuple, Union
+from typing import Any, Callable, List, Optional, Tuple, Union
 
 from geoconverter.gdal_convert import cli_entrypoint
+from geoconverter.preview import PreviewCache, preview
+from geoconverter.terrain import tile_dem
+from geoconverter.utils import discover_files
 
 if getattr(sys, "frozen", False):
     application_path = getattr(sys, "_MEIPASS", os.path.dirname(sys.executable))
@@ -28,7 +33,78 @@ FILETYPES = (
 # TODO: Do we really need this mapping?
 DRIVER_MAP = {"JPEG2000": "JP2OpenJPEG", "IMG": "HFA"}
 
-STATUS_COLORS = {"Idle": "light gray", "Processing": "light green", "ERROR": "red"}
+STATUS_COLORS = {
+    "Idle": "light gray",
+    "Queued": "light yellow",
+    "Processing": "light green",
+    "Cancelled": "orange",
+    "ERROR": "red",
+}
+
+# Interval (ms) at which tabs poll their conversion jobs
+POLL_INTERVAL = 100
+
+
+class Job:
+    """Conversion job run by a `Worker`.
+
+    Args:
+        func (Callable[["Job"], None]): Does the work. It should report
+            progress via `Job.report` and stop once `Job.cancelled` is set.
+    """
+
+    def __init__(self, func: Callable[["Job"], None]) -> None:
+        self.func = func
+        self.events: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+        self.cancel_event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    def report(self, fraction: float) -> None:
+        self.events.put(("progress", fraction))
+
+    def gdal_callback(self, complete: float, message: str, data: Any) -> int:
+        """GDAL progress callback, aborts the GDAL operation once cancelled."""
+        self.report(complete)
+        return 0 if self.cancelled else 1
+
+
+class Worker(threading.Thread):
+    """Background thread running conversion jobs one at a time.
+
+    Keeps the Tk main thread free. Jobs report back through their own event
+    queue, which the submitting tab polls with `after()`.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(daemon=True)
+        self.jobs: "queue.Queue[Job]" = queue.Queue()
+
+    def submit(self, job: Job) -> Job:
+        self.jobs.put(job)
+        return job
+
+    def run(self) -> None:
+        while True:
+            job = self.jobs.get()
+            if job.cancelled:
+                job.events.put(("cancelled", None))
+                continue
+            job.events.put(("started", None))
+            try:
+                job.func(job)
+            except Exception:
+                if job.cancelled:
+                    job.events.put(("cancelled", None))
+                else:
+                    job.events.put(("error", traceback.format_exc()))
+            else:
+                job.events.put(("cancelled" if job.cancelled else "done", None))
 
 
 def showtraceback(widget: "DefaultTab", msg: str) -> None:
@@ -52,7 +128,11 @@ def showtraceback(widget: "DefaultTab", msg: str) -> None:
 
 class DefaultTab(ttk.Frame):
     def __init__(
-        self, master: ttk.Notebook, io_callbacks: Tuple[Any, Any], **kwargs: Any
+        self,
+        master: ttk.Notebook,
+        io_callbacks: Tuple[Any, Any],
+        worker: Worker,
+        **kwargs: Any,
     ):
         if kwargs:
             super().__init__(master, **kwargs)
@@ -62,6 +142,9 @@ class DefaultTab(ttk.Frame):
         self.ipath = tk.StringVar(self)
         self.opath = tk.StringVar(self)
         self.status = tk.StringVar(self, value="Idle")
+        self.progress = tk.DoubleVar(self, value=0.0)
+        self.worker = worker
+        self.jobs: List[Job] = []
 
         assert len(io_callbacks) == 2
         self.input_callback: Any = io_callbacks[0]
@@ -89,7 +172,62 @@ class DefaultTab(ttk.Frame):
     def change_status(self, status_msg: str) -> None:
         self.status.set(status_msg)
         self.statusval.config(text=status_msg, bg=STATUS_COLORS[status_msg])
-        self.update()
+
+    def submit(self, func: Callable[[Job], None]) -> None:
+        """Queue a conversion on the worker and start polling it."""
+        job = self.worker.submit(Job(func))
+        self.jobs.append(job)
+        self.cancel_button.state(["!disabled"])
+        if len(self.jobs) == 1:
+            self.change_status("Queued")
+            self.after(POLL_INTERVAL, self.poll)
+
+    def cancel(self) -> None:
+        for job in self.jobs:
+            job.cancel()
+
+    def poll(self) -> None:
+        """Apply events from the current job, called through `after()`."""
+        job = self.jobs[0]
+        finished = None
+        while finished is None:
+            try:
+                event, value = job.events.get_nowait()
+            except queue.Empty:
+                break
+            if event == "started":
+                self.progress.set(0.0)
+                self.change_status("Processing")
+            elif event == "progress":
+                self.progress.set(100 * value)
+            else:
+                finished = event
+                self.on_finished(event, value)
+
+        if finished is not None:
+            self.jobs.pop(0)
+        if self.jobs:
+            self.after(POLL_INTERVAL, self.poll)
+        else:
+            self.cancel_button.state(["disabled"])
+
+    def on_finished(self, event: str, value: Any) -> None:
+        if event == "done":
+            self.progress.set(100.0)
+            self.change_status("Idle")
+            self.ipath.set("")
+            self.opath.set("")
+        elif event == "cancelled":
+            self.progress.set(0.0)
+            self.change_status("Cancelled")
+        else:
+            self.change_status("ERROR")
+            showerror(
+                title="Error",
+                message="An unexpected error occurred."
+                "Close window or press OK to view traceback",
+            )
+            showtraceback(self, msg=value)
 
     def create_widgets(self) -> None:
 
@@ -113,26 +251,54 @@ class DefaultTab(ttk.Frame):
         open_input_button = ttk.Button(self, text="Input", command=self.open_input)
         open_output_button = ttk.Button(self, text="Output", command=self.open_output)
         convert_button = ttk.Button(self, text="Convert", command=self.convert)
+        self.cancel_button = ttk.Button(self, text="Cancel", command=self.cancel)
+        self.cancel_button.state(["disabled"])
 
         open_input_button.pack(anchor="e", padx=20, pady=10)
         open_output_button.pack(anchor="e", padx=20, pady=10)
-        convert_button.place(relx=0.3, rely=0.7, anchor=tk.CENTER)
+        convert_button.place(relx=0.2, rely=0.7, anchor=tk.CENTER)
+        self.cancel_button.place(relx=0.45, rely=0.7, anchor=tk.CENTER)
+
+        progressbar = ttk.Progressbar(
+            self, orient="horizontal", mode="determinate", variable=self.progress
+        )
+        progressbar.place(relx=0.05, rely=0.9, relwidth=0.9, anchor="w")
 
     @abc.abstractmethod
     def convert(self) -> None:
         pass
 
 
+def showpreview(widget: "DefaultTab", title: str, png: bytes) -> None:
+    """Display a PNG preview in its own window.
+
+    Args:
+        widget (DefaultTab): current widget
+        title (str): window title
+        png (bytes): PNG image
+    """
+    root: Union[tk.Tk, tk.Toplevel] = widget.winfo_toplevel()
+    window = tk.Toplevel(root)
+    window.title(title)
+    image = tk.PhotoImage(master=window, data=base64.b64encode(png))
+    label = tk.Label(window, image=image)
+    # Tk only shows images that are still referenced
+    setattr(label, "image", image)
+    label.pack()
+
+
 class NotebookTab(DefaultTab):
     def __init__(
         self,
         master: ttk.Notebook,
         io_callbacks: Tuple[Any, Any],
+        worker: Worker,
         dtype: tk.StringVar,
         format: tk.StringVar,
         contrast: tk.IntVar,
         lower: tk.DoubleVar,
         upper: tk.DoubleVar,
+        previews: Optional[PreviewCache] = None,
         **kwargs: Any,
     ) -> None:
         self.dtype = dtype
@@ -140,10 +306,68 @@ class NotebookTab(DefaultTab):
         self.contrast = contrast
         self.low = lower
         self.high = upper
+        self.previews = previews if previews is not None else PreviewCache()
         if kwargs:
-            super().__init__(master, io_callbacks, **kwargs)
+            super().__init__(master, io_callbacks, worker, **kwargs)
+        else:
+            super().__init__(master, io_callbacks, worker)
+
+    def create_widgets(self) -> None:
+        super().create_widgets()
+        preview_button = ttk.Button(self, text="Preview", command=self.preview)
+        preview_button.place(relx=0.2, rely=0.45, anchor=tk.CENTER)
+
+    def preview(self) -> None:
+        """Render a preview of the input off the main thread and show it.
+
+        A directory is previewed by its first raster.
+        """
+        inpath = self.ipath.get()
+        if inpath and os.path.isdir(inpath):
+            first = next(discover_files(inpath, use_scandir=True), None)
+            if first is None:
+                showerror(title="Preview", message="No rasters found to preview.")
+                return
+            inpath = str(first)
+        if not os.path.isfile(inpath):
+            showerror(title="Preview", message="Select an input to preview.")
+            return
+        do_contrast = bool(self.contrast.get())
+        lower = self.low.get()
+        upper = self.high.get()
+        results: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+
+        def run() -> None:
+            try:
+                png = preview(
+                    inpath,
+                    stretch=do_contrast,
+                    lower=lower,
+                    upper=upper,
+                    cache=self.previews,
+                )
+            except Exception:
+                results.put(("error", traceback.format_exc()))
+            else:
+                results.put(("done", png))
+
+        # Previews are quick, so they do not queue behind conversions
+        threading.Thread(target=run, daemon=True).start()
+        self.after(POLL_INTERVAL, self.poll_preview, inpath, results)
+
+    def poll_preview(
+        self, inpath: str, results: "queue.Queue[Tuple[str, Any]]"
+    ) -> None:
+        try:
+            event, value = results.get_nowait()
+        except queue.Empty:
+            self.after(POLL_INTERVAL, self.poll_preview, inpath, results)
+            return
+        if event == "done":
+            showpreview(self, os.path.basename(inpath), value)
         else:
-            super().__init__(master, io_callbacks)
+            showerror(title="Error", message="Unable to render a preview.")
+            showtraceback(self, msg=value)
 
     def convert(self) -> None:
         inpath = self.ipath.get()
@@ -158,29 +382,30 @@ class NotebookTab(DefaultTab):
         if outfmt in DRIVER_MAP:
             outfmt = DRIVER_MAP[outfmt]
 
-        self.change_status("Processing")
-
-        try:
-            cli_entrypoint(inpath, outpath, outfmt, dtype, do_contrast, lower, upper)
-            self.change_status("Idle")
-            self.ipath.set("")
-            self.opath.set("")
-        except Exception:
-            self.change_status("ERROR")
-            showerror(
-                title="Error",
-                message="An unexpected error occurred."
-                "Close window or press OK to view traceback",
+        def run(job: Job) -> None:
+            cli_entrypoint(
+                inpath,
+                outpath,
+                outfmt,
+                dtype,
+                do_contrast,
+                lower,
+                upper,
+                callback=job.gdal_callback,
             )
-            showtraceback(self, msg=traceback.format_exc())
-            raise
+
+        self.submit(run)
 
 
 class DEMTab(DefaultTab):
     def __init__(
-        self, master: ttk.Notebook, io_callbacks: Tuple[Any, Any], format: tk.StringVar
+        self,
+        master: ttk.Notebook,
+        io_callbacks: Tuple[Any, Any],
+        worker: Worker,
+        format: tk.StringVar,
     ) -> None:
-        super().__init__(master, io_callbacks)
+        super().__init__(master, io_callbacks, worker)
         self.format = format
 
     def convert(self) -> None:
@@ -189,25 +414,18 @@ class DEMTab(DefaultTab):
         outfmt = self.format.get()
         if outfmt in DRIVER_MAP:
             outfmt = DRIVER_MAP[outfmt]
-        self.change_status("Processing")
 
-        try:
-            subprocess.call(["ctb-tile", "-C", "-f", outfmt, "-o", outpath, inpath])
-            subprocess.call(
-                ["ctb-tile", "-C", "-f", outfmt, "-l", "-o", outpath, inpath]
+        def run(job: Job) -> None:
+            tile_dem(
+                inpath,
+                outpath,
+                outfmt,
+                threads=os.cpu_count(),
+                progress=job.report,
+                cancelled=lambda: job.cancelled,
             )
-            self.change_status("Idle")
-            self.ipath.set("")
-            self.opath.set("")
-        except Exception:
-            self.change_status("ERROR")
-            showerror(
-                title="Error",
-                message="An unexpected error occurred."
-                "Close window or press OK to view traceback",
-            )
-            showtraceback(self, msg=traceback.format_exc())
-            raise
+
+        self.submit(run)
 
 
 class OptionsTab(ttk.Frame):
@@ -294,29 +512,41 @@ def main() -> None:
 
     tab_parent = ttk.Notebook(root)
 
+    # Conversions run off the main thread so the window stays responsive
+    worker = Worker()
+    worker.start()
+
     # Create tabs
     opt_tab = OptionsTab(root)
+    # Shared, so a file previewed in one tab is cached for the other
+    previews = PreviewCache()
 
     file_tab = NotebookTab(
         tab_parent,
         (fd.askopenfilename, fd.asksaveasfilename),
+        worker,
         opt_tab.dtype,
         opt_tab.format,
         opt_tab.contrast,
         opt_tab.low,
         opt_tab.upper,
+        previews,
     )
     dir_tab = NotebookTab(
         tab_parent,
         (fd.askdirectory, fd.askdirectory),
+        worker,
         opt_tab.dtype,
         opt_tab.format,
         opt_tab.contrast,
         opt_tab.low,
         opt_tab.upper,
+        previews,
     )
 
-    dem_tab = DEMTab(tab_parent, (fd.askopenfilename, fd.askdirectory), opt_tab.format)
+    dem_tab = DEMTab(
+        tab_parent, (fd.askopenfilename, fd.askdirectory), worker, opt_tab.format
+    )
 
     tab_parent.add(file_tab, text="File")
     tab_parent.add(dir_tab, text="Directory")
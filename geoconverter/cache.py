@@ -0,0 +1,178 @@
+"""Persistent band statistics cache for geoconverter"""
+
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from geoconverter.defaults import DEFAULT_CACHE_SIZE
+from geoconverter.stats import BandStats, Histogram
+from geoconverter.utils import file_identity
+
+CACHE_FILENAME = "stats.sqlite"
+
+# Approximate size of a row without its histogram and percentiles
+ROW_OVERHEAD = 128
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stats (
+    path TEXT NOT NULL,
+    band INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    min REAL,
+    max REAL,
+    mean REAL,
+    std REAL,
+    percentiles TEXT NOT NULL DEFAULT '{}',
+    histogram BLOB,
+    nbytes INTEGER NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (path, band)
+)
+"""
+
+
+class StatsCache:
+    """SQLite backed statistics cache keyed by file identity and band.
+
+    Rows are keyed by resolved path and band and carry the size and mtime of
+    the file they were computed from. A lookup against a file whose identity
+    has changed drops all of its rows. Once the cache grows past `max_bytes`,
+    the least recently used rows are evicted.
+
+    Args:
+        directory (Union[Path, str]): Directory holding the cache database
+        max_bytes (int, optional): Size limit of the cache in bytes.
+    """
+
+    def __init__(
+        self, directory: Union[Path, str], max_bytes: int = DEFAULT_CACHE_SIZE
+    ) -> None:
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        # Generous timeout as parallel workers share the database
+        self.conn = sqlite3.connect(str(Path(directory) / CACHE_FILENAME), timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(_SCHEMA)
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "StatsCache":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def load(self, input: Union[Path, str], bands: List[int]) -> Dict[int, BandStats]:
+        """Get cached statistics of `bands` that are still valid.
+
+        Args:
+            input (Union[Path, str]): Path to raster
+            bands (List[int]): 1-based band indices
+
+        Returns:
+            Dict[int, BandStats]: Statistics of the bands found in the cache
+        """
+        identity = file_identity(input)
+        if identity is None:
+            return {}
+        path, size, mtime = identity
+
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM stats WHERE path = ? AND (size != ? OR mtime != ?)",
+                (path, size, mtime),
+            )
+            rows = self.conn.execute(
+                "SELECT band, min, max, mean, std, percentiles, histogram "
+                "FROM stats WHERE path = ?",
+                (path,),
+            ).fetchall()
+            self.conn.execute(
+                "UPDATE stats SET accessed = ? WHERE path = ?", (time.time(), path)
+            )
+
+        found = {}
+        for band, vmin, vmax, vmean, vstd, percentiles, histogram in rows:
+            if band not in bands:
+                continue
+            found[band] = BandStats(
+                vmin,
+                vmax,
+                vmean,
+                vstd,
+                {float(q): v for q, v in json.loads(percentiles).items()},
+                Histogram.from_bytes(histogram) if histogram else None,
+            )
+        return found
+
+    def store(self, input: Union[Path, str], band: int, stats: BandStats) -> None:
+        """Merge `stats` into the cached statistics of a band.
+
+        Args:
+            input (Union[Path, str]): Path to raster
+            band (int): 1-based band index
+            stats (BandStats): Statistics to be cached
+        """
+        identity = file_identity(input)
+        if identity is None:
+            return
+        path, size, mtime = identity
+
+        old = self.load(input, [band]).get(band, BandStats())
+        new = BandStats(
+            min=old.min if stats.min is None else stats.min,
+            max=old.max if stats.max is None else stats.max,
+            mean=old.mean if stats.mean is None else stats.mean,
+            std=old.std if stats.std is None else stats.std,
+            percentiles={**old.percentiles, **stats.percentiles},
+            histogram=stats.histogram or old.histogram,
+        )
+        percentiles = json.dumps({repr(q): v for q, v in new.percentiles.items()})
+        histogram = new.histogram.to_bytes() if new.histogram else None
+        nbytes = ROW_OVERHEAD + len(percentiles) + len(histogram or b"")
+
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO stats VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+                (
+                    path,
+                    band,
+                    size,
+                    mtime,
+                    new.min,
+                    new.max,
+                    new.mean,
+                    new.std,
+                    percentiles,
+                    histogram,
+                    nbytes,
+                    time.time(),
+                ),
+            )
+        self.evict(keep=path)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Drop least recently used rows until the cache fits `max_bytes`."""
+        with self.conn:
+            (total,) = self.conn.execute(
+                "SELECT COALESCE(SUM(nbytes), 0) FROM stats"
+            ).fetchone()
+            if total <= self.max_bytes:
+                return
+            rows = self.conn.execute(
+                "SELECT path, band, nbytes FROM stats ORDER BY accessed"
+            ).fetchall()
+            for path, band, nbytes in rows:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                self.conn.execute(
+                    "DELETE FROM stats WHERE path = ? AND band = ?", (path, band)
+                )
+                total -= nbytes
@@ -0,0 +1,37 @@
+"""Default settings of geoconverter.
+
+Kept free of GDAL and NumPy, so the command line can be parsed without
+loading them.
+"""
+
+import os
+from pathlib import Path
+
+# Default memory budget (in bytes) for statistics computation
+DEFAULT_MAX_MEMORY = 256 * 1024 * 1024
+
+STATS_MODES = ("exact", "overview", "sample")
+
+# Default number of blocks read in sample mode
+DEFAULT_SAMPLE_BLOCKS = 256
+
+# Default size limit of the statistics cache in bytes
+DEFAULT_CACHE_SIZE = 512 * 1024 * 1024
+
+# Default longer side of previews in pixels
+DEFAULT_PREVIEW_SIZE = 512
+
+# Default size limit of the preview cache in bytes
+DEFAULT_PREVIEW_CACHE_SIZE = 64 * 1024 * 1024
+
+# Default seconds between polls of a watched directory
+DEFAULT_WATCH_INTERVAL = 2.0
+
+# Default seconds a new file must stay unchanged before it is converted
+DEFAULT_WATCH_SETTLE = 5.0
+
+
+def default_cache_dir() -> Path:
+    """Per-user cache directory, honouring XDG_CACHE_HOME."""
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.join("~", ".cache")
+    return Path(root).expanduser() / "geoconverter"
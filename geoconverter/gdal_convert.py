@@ -12,19 +12,86 @@ python geoconverter/gdal_convert.py -i ./data/in/a.tif
 python geoconverter/gdal_convert.py -i ./data/in/a.tif -o out/a_cog.tif -of COG
 python geoconverter/gdal_convert.py -i ./data/in/a.tif -of COG -or 0 255
 python geoconverter/gdal_convert.py -i ./data/in/ -o ./data/out/ -of JPEG -b 5,3,2
-python geoconverter/gdal_convert.py -i ./data/in/ -o ./data/out/ -of JPEG -b 5,3,2 stretch 2 98
+python geoconverter/gdal_convert.py -i ./data/in/ -o ./data/out/ stretch -s 2 98
+python geoconverter/gdal_convert.py -i ./data/in/ -o ./data/out/ -of COG -j 8
 ```
+
+More examples, e.g. watch folders, sharding and multiple outputs, are in
+docs/usage.md.
+
 Full disclosure: This can be done using gdal_translate but you will need to
 manually set the scale params
 """
 
-from argparse import ArgumentParser, Namespace
-from typing import Dict, List, Optional
+import logging
+import os
+import time
+import uuid
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
+from functools import partial
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from geoconverter.defaults import (
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_MAX_MEMORY,
+    DEFAULT_PREVIEW_SIZE,
+    DEFAULT_SAMPLE_BLOCKS,
+    DEFAULT_WATCH_INTERVAL,
+    DEFAULT_WATCH_SETTLE,
+    STATS_MODES,
+    default_cache_dir,
+)
+from geoconverter.profiles import (
+    PROFILES,
+    cache_max,
+    config_for,
+    creation_options_for,
+    encoding_settings,
+    gdal_config,
+    parse_option,
+    thread_share,
+)
+from geoconverter.report import (
+    FileRecord,
+    RunReport,
+    StageTimer,
+    failed_record,
+    skipped_record,
+)
+from geoconverter.shards import parse_shard
+from geoconverter.utils import (
+    archive_root,
+    output_path,
+    parse_files,
+    partial_path,
+    replace_output,
+)
 
-import numpy as np
-from osgeo import gdal
+# GDAL, NumPy and the modules using them are imported where needed, so that
+# parsing arguments (and --help) stays fast
+if TYPE_CHECKING:
+    from concurrent.futures import Future
 
-from geoconverter.utils import get_dtype, parse_files
+    from osgeo import gdal
+
+    from geoconverter.cache import StatsCache
+    from geoconverter.manifest import Manifest
+    from geoconverter.preview import PreviewCache
+    from geoconverter.stats import BracketBounds, BracketHistogram, Histogram
 
 BITRANGE = {
     "Byte": [0.0, 255.0],
@@ -37,48 +104,190 @@ BITRANGE = {
     "Float64": [0.0, 1.0],
 }  # type: Dict[str, List[float]]
 
+# GDAL data type names
 TYPE_DICT = {
-    "Byte": gdal.GDT_Byte,
-    "UInt8": gdal.GDT_Byte,
-    "UInt16": gdal.GDT_UInt16,
-    "UInt32": gdal.GDT_UInt32,
-    "Int16": gdal.GDT_Int16,
-    "Int32": gdal.GDT_Int32,
-    "Float32": gdal.GDT_Float32,
-    "Float64": gdal.GDT_Float64,
-}  # type: Dict[str, int]
+    "Byte": "Byte",
+    "UInt8": "Byte",
+    "UInt16": "UInt16",
+    "UInt32": "UInt32",
+    "Int16": "Int16",
+    "Int32": "Int32",
+    "Float32": "Float32",
+    "Float64": "Float64",
+}  # type: Dict[str, str]
+
+# GDAL progress callback: (fraction complete, message, user data) -> continue?
+ProgressCallback = Callable[[float, str, Any], int]
+
+# Files queued per worker process ahead of the one being converted
+MAX_INFLIGHT_PER_JOB = 4
+
+# Rescaling engines, see geoconverter.rescale
+ENGINES = ("gdal", "numpy")
+
+# In-memory filesystem prefix for intermediate VRTs
+VSIMEM_PREFIX = "/vsimem/geoconverter"
+
+logger = logging.getLogger(__name__)
+
+
+class OutputSpec(NamedTuple):
+    """An output of a fan-out conversion, as given to --emit.
+
+    Unset fields fall back to the corresponding command line options.
+    """
+
+    format: str
+    dtype: Optional[str] = None
+    bands: Optional[List[int]] = None
+    range: Optional[List[float]] = None
+    scale: float = 1.0
+    suffix: str = ""
+
+
+def parse_emit(text: str) -> OutputSpec:
+    """Parse an output spec such as `PNG:dtype=Byte:bands=3,2,1:scale=0.1`.
+
+    Args:
+        text (str): Format, followed by `:`-separated dtype, bands, range
+            (lower,upper), scale (output size relative to the input, at most
+            1) and suffix (appended to the output name) fields
+
+    Raises:
+        ArgumentTypeError: if the spec is malformed
+
+    Returns:
+        OutputSpec: Parsed spec
+    """
+    format, *fields = text.split(":")
+    values = {}  # type: Dict[str, Any]
+    for field in fields:
+        key, sep, value = field.partition("=")
+        if not sep:
+            raise ArgumentTypeError(f"Expected key=value, got {field!r}")
+        try:
+            if key in ("dtype", "suffix"):
+                values[key] = value
+            elif key == "bands":
+                values[key] = [int(b) for b in value.split(",")]
+            elif key == "range":
+                values[key] = [float(v) for v in value.split(",")]
+                if len(values[key]) != 2:
+                    raise ValueError("expected lower,upper")
+            elif key == "scale":
+                values[key] = float(value)
+                if not 0 < values[key] <= 1:
+                    raise ValueError("outputs can only be downscaled, 0 < scale <= 1")
+            else:
+                raise ArgumentTypeError(f"Unknown output field {key!r}")
+        except ValueError as exc:
+            raise ArgumentTypeError(f"Invalid {key} {value!r}: {exc}")
+    if not format:
+        raise ArgumentTypeError(f"No format in output spec {text!r}")
+    return OutputSpec(format, **values)
 
 
 def getScaleParams(
-    ds: gdal.Dataset,
+    ds: "gdal.Dataset",
     outputRange: List[float],
-    stretch: Optional[bool],
-    lower: float,
-    upper: float,
+    stretch: Optional[bool] = False,
+    lower: float = 0.0,
+    upper: float = 100.0,
+    bands: Optional[List[int]] = None,
+    max_memory: int = DEFAULT_MAX_MEMORY,
+    cache: Optional["StatsCache"] = None,
+    mode: str = "exact",
+    sample_blocks: int = DEFAULT_SAMPLE_BLOCKS,
+    bounds: Optional[Dict[int, List[float]]] = None,
+    ignore_nodata: bool = False,
 ) -> List[List[float]]:
+    from geoconverter.stats import (
+        BandStats,
+        approximate_bounds,
+        band_histograms,
+        band_percentiles,
+        open_source,
+    )
 
-    if stretch:
-        band_arr = ds.ReadAsArray()  # (B, H, W)
-        assert band_arr.ndim == 3
-        lower_percentile = np.percentile(band_arr, lower, axis=(1, 2))
-        upper_percentile = np.percentile(band_arr, upper, axis=(1, 2))
-        scaleParams = [
-            [lower, upper] for lower, upper in zip(lower_percentile, upper_percentile)
+    def stats_bounds(stats: BandStats) -> Optional[List[float]]:
+        if stretch:
+            lo, hi = stats.percentile(lower), stats.percentile(upper)
+        else:
+            lo, hi = stats.min, stats.max
+        return None if lo is None or hi is None else [lo, hi]
+
+    if not bands:
+        bands = list(range(1, ds.RasterCount + 1))
+    if bounds is not None:
+        # Shared by a whole batch, see global_scale_params
+        return [bounds[b] + outputRange for b in bands]
+    # Only the requested bands are read, each of them once
+    unique = sorted(set(bands))
+
+    if mode != "exact":
+        values, estimate = approximate_bounds(
+            ds,
+            unique,
+            stretch,
+            lower,
+            upper,
+            mode,
+            max_memory,
+            sample_blocks,
+            skip_nodata=ignore_nodata,
+        )
+        logger.info(
+            "%s: %s statistics from %.2f%% of pixels, estimated error %s",
+            ds.GetDescription(),
+            estimate.mode,
+            100 * estimate.fraction,
+            ", ".join(
+                f"band {b} +/-({lo:.4g}, {hi:.4g})"
+                for b, (lo, hi) in zip(unique, estimate.errors)
+            ),
+        )
+        approx = dict(zip(unique, values))
+        return [approx[b] + outputRange for b in bands]
+
+    path = ds.GetDescription()
+    lookup = {}  # type: Dict[int, List[float]]
+    if stretch and ignore_nodata:
+        # Cached histograms include nodata pixels
+        cache = None
+    if cache is not None:
+        for b, stats in cache.load(path, unique).items():
+            params = stats_bounds(stats)
+            if params is not None:
+                lookup[b] = params
+    todo = [b for b in unique if b not in lookup]
+
+    if todo and stretch:
+        # Streamed over block-aligned windows, bounded by max_memory
+        source = open_source(
+            ds, todo, max_memory=max_memory // 2, skip_nodata=ignore_nodata
+        )
+        hists = band_histograms(ds, source=source)
+        percentiles = band_percentiles(
+            ds, [lower, upper], max_memory=max_memory, histograms=hists, source=source
+        )
+        computed = [
+            BandStats(percentiles={lower: lo, upper: hi}, histogram=hist)
+            for (lo, hi), hist in zip(percentiles, hists)
         ]
     else:
-        stats = [
-            ds.GetRasterBand(i + 1).GetStatistics(True, True)
-            for i in range(ds.RasterCount)
+        computed = [
+            BandStats(*ds.GetRasterBand(b).GetStatistics(True, True)) for b in todo
         ]
-        vmin, vmax, vmean, vstd = zip(*stats)
-        scaleParams = list(zip(*[vmin, vmax]))
 
-    scaleParams = [list(s) for s in scaleParams]
-    return [s + outputRange for s in scaleParams]
+    for b, stats in zip(todo, computed):
+        if cache is not None:
+            cache.store(path, b, stats)
+        lookup[b] = stats_bounds(stats) or []
+    return [lookup[b] + outputRange for b in bands]
 
 
 def setupOptions(
-    ds: gdal.Dataset,
+    ds: "gdal.Dataset",
     outputFormat: str,
     outputType: str,
     outputRange: List[float],
@@ -86,21 +295,280 @@ def setupOptions(
     stretch: Optional[bool] = False,
     lower: float = 0.0,
     upper: float = 100.0,
-) -> gdal.GDALTranslateOptions:
+    max_memory: int = DEFAULT_MAX_MEMORY,
+    cache: Optional["StatsCache"] = None,
+    mode: str = "exact",
+    sample_blocks: int = DEFAULT_SAMPLE_BLOCKS,
+    callback: Optional[ProgressCallback] = None,
+    bounds: Optional[Dict[int, List[float]]] = None,
+    ignore_nodata: bool = False,
+    creationOptions: Optional[List[str]] = None,
+) -> "gdal.GDALTranslateOptions":
+    from osgeo import gdal
 
-    scaleParams = getScaleParams(ds, outputRange, stretch, lower, upper)
     if not bands:
         bands = list(range(1, ds.RasterCount + 1))
-    scaleParams = [scaleParams[i - 1] for i in bands]
+    scaleParams = getScaleParams(
+        ds,
+        outputRange,
+        stretch,
+        lower,
+        upper,
+        bands,
+        max_memory,
+        cache,
+        mode,
+        sample_blocks,
+        bounds,
+        ignore_nodata,
+    )
     return gdal.TranslateOptions(
         format=outputFormat,
-        outputType=TYPE_DICT[outputType],
+        outputType=gdal.GetDataTypeByName(TYPE_DICT[outputType]),
         bandList=bands,
         scaleParams=scaleParams,
+        creationOptions=creationOptions or [],
+        callback=callback,
+    )
+
+
+def translate_via_vrt(
+    destName: str,
+    ds: "gdal.Dataset",
+    options: "gdal.GDALTranslateOptions",
+    outputFormat: str,
+    callback: Optional[ProgressCallback] = None,
+    creationOptions: Optional[List[str]] = None,
+) -> Optional["gdal.Dataset"]:
+    """Translate through an in-memory VRT view instead of a scratch file.
+
+    The scaling, band selection and dtype in `options` are applied by a VRT
+    in /vsimem, which is then copied into `outputFormat`. No pixels are
+    written anywhere but the output.
+
+    Args:
+        destName (str): Path to output raster
+        ds (gdal.Dataset): Input dataset
+        options (gdal.GDALTranslateOptions): Options from `setupOptions` with
+            format VRT
+        outputFormat (str): Format of the output
+        callback (Optional[ProgressCallback]): GDAL progress callback for
+            writing the output
+        creationOptions (Optional[List[str]]): Creation options of the output
+
+    Returns:
+        Optional[gdal.Dataset]: Output dataset, None if the translation failed
+    """
+    from osgeo import gdal
+
+    viewName = f"{VSIMEM_PREFIX}/{uuid.uuid4().hex}.vrt"
+    view = gdal.Translate(destName=viewName, srcDS=ds, options=options)
+    if view is None:
+        return None
+    try:
+        return gdal.Translate(
+            destName=destName,
+            srcDS=view,
+            options=gdal.TranslateOptions(
+                format=outputFormat,
+                creationOptions=creationOptions or [],
+                callback=callback,
+            ),
+        )
+    finally:
+        view = None
+        gdal.Unlink(viewName)
+
+
+def _open_bands(entry: Path, bands: Iterable[int]) -> "gdal.Dataset":
+    """Open a file of a global stretch, checking it has the bands needed."""
+    from osgeo import gdal
+
+    ds = gdal.Open(str(entry))
+    if ds is None:
+        raise RuntimeError(f"Unable to open {entry}")
+    missing = [b for b in bands if not 1 <= b <= ds.RasterCount]
+    if missing:
+        raise RuntimeError(
+            f"{entry} has {ds.RasterCount} bands, band {missing[0]} is needed. "
+            "A global stretch needs the same bands in every file"
+        )
+    return ds
+
+
+def _file_ranges(
+    entry: Path,
+    bands: Optional[List[int]],
+    stretch: bool,
+    max_memory: int,
+    ignore_nodata: bool = False,
+) -> List[Tuple[int, str, float, float]]:
+    """Data type and value range of each band of a file (map phase 1)."""
+    from osgeo import gdal
+
+    from geoconverter.stats import value_range
+
+    ds = _open_bands(entry, bands or [])
+    result = []
+    for b in bands or range(1, ds.RasterCount + 1):
+        band = ds.GetRasterBand(b)
+        if stretch:
+            # Everything the histogram of the band has to cover
+            lo, hi = value_range(ds, b, max_memory, ignore_nodata)
+        else:
+            lo, hi = band.GetStatistics(True, True)[:2]
+        result.append((b, gdal.GetDataTypeName(band.DataType), lo, hi))
+    return result
+
+
+def _file_histograms(
+    entry: Path,
+    templates: Dict[int, "Histogram"],
+    max_memory: int,
+    ignore_nodata: bool = False,
+) -> Dict[int, "Histogram"]:
+    """Histograms of a file's bands over common bins (map phase 2)."""
+    from geoconverter.stats import band_histograms, open_source
+
+    bands = sorted(templates)
+    ds = _open_bands(entry, bands)
+    source = open_source(ds, bands, max_memory=max_memory, skip_nodata=ignore_nodata)
+    hists = band_histograms(ds, source=source, templates=[templates[b] for b in bands])
+    return dict(zip(bands, hists))
+
+
+def _file_brackets(
+    entry: Path,
+    brackets: Dict[int, List["BracketBounds"]],
+    max_memory: int,
+    ignore_nodata: bool = False,
+) -> Dict[int, List["BracketHistogram"]]:
+    """Histograms of a file's values within brackets (map phase 3)."""
+    from geoconverter.stats import bracket_histograms, open_source
+
+    bands = sorted(brackets)
+    ds = _open_bands(entry, bands)
+    source = open_source(ds, bands, max_memory=max_memory, skip_nodata=ignore_nodata)
+    found = bracket_histograms(source, [brackets[b] for b in bands])
+    return dict(zip(bands, found))
+
+
+def _unordered_map(
+    func: Callable[[Path], Any], items: Iterable[Path], jobs: int
+) -> Iterator[Any]:
+    """Map over worker processes, yielding results as they finish.
+
+    At most `MAX_INFLIGHT_PER_JOB` items per worker are in flight, so finished
+    results never pile up.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if jobs <= 1:
+        yield from map(func, items)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending: Set[Future[Any]] = set()
+        for item in items:
+            if len(pending) >= MAX_INFLIGHT_PER_JOB * jobs:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    yield future.result()
+            pending.add(executor.submit(func, item))
+        for future in as_completed(pending):
+            yield future.result()
+
+
+def global_scale_params(
+    entries: List[Path], args: Namespace, jobs: int = 1
+) -> Dict[int, List[float]]:
+    """Scale bounds of each band over a whole batch of files.
+
+    Map-reduce in phases, each spread over `jobs` processes: first the
+    value range of every band of every file is found and reduced to a global
+    range. Then every file is histogrammed over common bins derived from that
+    range, and the histograms are merged into global percentiles. Memory is
+    bounded by the size of the histograms. Without `stretch`, the global
+    min/max from the first phase is used.
+
+    Percentiles are exact for integer bands. For float bands, the bins holding
+    them are refined by further passes over the files, see
+    `merged_percentiles`.
+
+    Args:
+        entries (List[Path]): Input rasters
+        args (Namespace): Parsed CLI arguments
+        jobs (int, optional): Number of worker processes. Defaults to 1.
+
+    Returns:
+        Dict[int, List[float]]: Lower and upper bound of each band
+    """
+    from geoconverter.stats import (
+        common_histogram,
+        merge_bracket_histograms,
+        merged_percentiles,
     )
 
+    stretch = args.subcommands == "stretch"
+    bands = [int(b) for b in args.bands.split(",")] if args.bands else None
+    if getattr(args, "emit", None):
+        # Outputs may pick their own bands
+        bands = None
+    max_memory = args.stats_memory * 2**20 // max(jobs, 1)
+    ignore_nodata = getattr(args, "ignore_nodata", False)
 
-def get_args() -> Namespace:
+    ranges: Dict[int, Tuple[Set[str], float, float]] = {}
+    file_ranges = partial(
+        _file_ranges,
+        bands=bands,
+        stretch=stretch,
+        max_memory=max_memory,
+        ignore_nodata=ignore_nodata,
+    )
+    for result in _unordered_map(file_ranges, entries, jobs):
+        for b, name, lo, hi in result:
+            names, vmin, vmax = ranges.get(b, (set(), lo, hi))
+            names.add(name)
+            ranges[b] = (names, min(vmin, lo), max(vmax, hi))
+    if not stretch:
+        return {b: [vmin, vmax] for b, (_, vmin, vmax) in ranges.items()}
+
+    templates = {
+        b: common_histogram(sorted(names), vmin, vmax)
+        for b, (names, vmin, vmax) in ranges.items()
+    }
+    merged = {b: h.empty_like() for b, h in templates.items()}
+    file_histograms = partial(
+        _file_histograms,
+        templates=templates,
+        max_memory=max_memory,
+        ignore_nodata=ignore_nodata,
+    )
+    for hists in _unordered_map(file_histograms, entries, jobs):
+        for b, hist in hists.items():
+            merged[b] = merged[b].merge(hist)
+
+    # Phase 3, repeated: refine the bins holding the percentiles of float bands
+    def refine(brackets: List[List["BracketBounds"]]) -> List[List["BracketHistogram"]]:
+        wanted = {b: bs for b, bs in zip(merged, brackets) if bs}
+        found = {}  # type: Dict[int, List[BracketHistogram]]
+        file_brackets = partial(
+            _file_brackets,
+            brackets=wanted,
+            max_memory=max_memory,
+            ignore_nodata=ignore_nodata,
+        )
+        for result in _unordered_map(file_brackets, entries, jobs):
+            for b, hists in result.items():
+                if b in found:
+                    hists = list(map(merge_bracket_histograms, found[b], hists))
+                found[b] = hists
+        return [found.get(b, []) for b in merged]
+
+    values = merged_percentiles(list(merged.values()), args.stretch, refine)
+    return dict(zip(merged, values))
+
+
+def get_args(argv: Optional[List[str]] = None) -> Namespace:
     parser = ArgumentParser(description="Converter")
     parser.add_argument("-i", "--input", help="input image/directory")
     parser.add_argument("-b", "--bands", type=str, help="bands string delimited by ,")
@@ -108,6 +576,202 @@ def get_args() -> Namespace:
     parser.add_argument("-of", "--format", default="Native", help="output format")
     parser.add_argument("-ot", "--dtype", default="Native", help="output dtype")
     parser.add_argument("-or", "--range", type=float, nargs=2, help="output range")
+    parser.add_argument(
+        "--include",
+        action="append",
+        metavar="GLOB",
+        help="only convert files matching this pattern (repeatable)",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="GLOB",
+        help="skip files matching this pattern (repeatable)",
+    )
+    parser.add_argument(
+        "--scandir",
+        action="store_true",
+        help="walk input directories with os.scandir (faster on large trees)",
+    )
+    parser.add_argument(
+        "--stats-memory",
+        type=int,
+        default=DEFAULT_MAX_MEMORY // 2**20,
+        metavar="MB",
+        help="memory budget for computing statistics",
+    )
+    parser.add_argument(
+        "--stats-mode",
+        choices=STATS_MODES,
+        default="exact",
+        help="compute statistics from all pixels, an overview or sampled blocks",
+    )
+    parser.add_argument(
+        "--stats-sample",
+        type=int,
+        default=DEFAULT_SAMPLE_BLOCKS,
+        metavar="BLOCKS",
+        help="number of blocks read in sample mode",
+    )
+    parser.add_argument(
+        "--stats-cache", action="store_true", help="cache band statistics on disk"
+    )
+    parser.add_argument(
+        "--stats-cache-dir",
+        default=str(default_cache_dir()),
+        metavar="DIR",
+        help="directory of the statistics cache (defaults to the user cache dir)",
+    )
+    parser.add_argument(
+        "--stats-cache-size",
+        type=int,
+        default=DEFAULT_CACHE_SIZE // 2**20,
+        metavar="MB",
+        help="size limit of the statistics cache",
+    )
+    parser.add_argument(
+        "--ignore-nodata",
+        action="store_true",
+        help="leave nodata pixels out of stretch percentiles",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="gdal",
+        help="rescale with gdal.Translate or in NumPy, window by window "
+        "(keeps nodata pixels as nodata)",
+    )
+    parser.add_argument(
+        "--emit",
+        action="append",
+        type=parse_emit,
+        metavar="FORMAT[:KEY=VALUE...]",
+        help="write this output too (repeatable), e.g. "
+        "PNG:dtype=Byte:bands=3,2,1:range=0,255:scale=0.1:suffix=_preview. "
+        "All outputs are written from a single read with the numpy engine, "
+        "the first one to the output path and the others next to it",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=sorted(PROFILES),
+        default="default",
+        help="encoding profile: creation options and GDAL configuration, e.g. "
+        "threaded compression and tiling for COG and GTiff",
+    )
+    parser.add_argument(
+        "--co",
+        action="append",
+        type=parse_option,
+        metavar="NAME=VALUE",
+        help="creation option of the outputs (repeatable), overrides the "
+        "profile, e.g. NUM_THREADS=ALL_CPUS, PREDICTOR=YES, BLOCKSIZE=512 or "
+        "OVERVIEWS=FORCE_USE_EXISTING",
+    )
+    parser.add_argument(
+        "--config",
+        action="append",
+        type=parse_option,
+        metavar="KEY=VALUE",
+        help="GDAL configuration option for the run (repeatable), e.g. "
+        "GDAL_CACHEMAX=1024 or GDAL_NUM_THREADS=4",
+    )
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        help="only write a quick PNG preview of each conversion, rescaled to "
+        "Byte from a downsampled read",
+    )
+    parser.add_argument(
+        "--preview-size",
+        type=int,
+        default=DEFAULT_PREVIEW_SIZE,
+        metavar="PX",
+        help="longer side of previews",
+    )
+    parser.add_argument(
+        "--preview-cache", action="store_true", help="cache previews on disk"
+    )
+    parser.add_argument(
+        "--preview-cache-dir",
+        default=str(default_cache_dir() / "previews"),
+        metavar="DIR",
+        help="directory of the preview cache (defaults to the user cache dir)",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="JSONL",
+        help="write per-file stage timings and a run summary to this file",
+    )
+    parser.add_argument(
+        "--global-stretch",
+        action="store_true",
+        help="scale every file of a directory with the same parameters, "
+        "computed over all of them",
+    )
+    parser.add_argument(
+        "--vrt-chain",
+        action="store_true",
+        help="apply scaling and band selection through an in-memory VRT and "
+        "write the output from it (use -of VRT to only write the VRT)",
+    )
+    parser.add_argument(
+        "--manifest",
+        metavar="JSONL",
+        help="record converted files here and skip those already up to date",
+    )
+    parser.add_argument(
+        "--manifest-hash",
+        action="store_true",
+        help="also record content hashes, so touched but unchanged inputs "
+        "are not converted again",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="convert files even if the manifest has them up to date",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        metavar="I/N",
+        help="only convert the I-th of N pixel-balanced shards of the input "
+        "files, recording them in a per-shard manifest and report (merge "
+        "them with shards.py)",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep converting rasters as they are added to the input "
+        "directory, once completely written (stop with Ctrl+C)",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        default=DEFAULT_WATCH_INTERVAL,
+        metavar="SECONDS",
+        help="time between polls of the watched directory",
+    )
+    parser.add_argument(
+        "--watch-settle",
+        type=float,
+        default=DEFAULT_WATCH_SETTLE,
+        metavar="SECONDS",
+        help="time a new file must stay unchanged before it is converted",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        metavar="MB",
+        help="only run files in parallel while their estimated peak memory "
+        "fits in this budget, probing each file first",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of files converted in parallel (0 uses all cores)",
+    )
 
     subparsers = parser.add_subparsers(dest="subcommands", help="Subcommands")
 
@@ -124,7 +788,14 @@ def get_args() -> Namespace:
         help="stretch lower & upper percentiles",
     )
 
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.watch and (args.global_stretch or args.shard or args.preview):
+        parser.error(
+            "--watch cannot be combined with --global-stretch, --shard or --preview"
+        )
+    if args.watch and not os.path.isdir(args.input):
+        parser.error("--watch needs an input directory")
+    return args
 
 
 def cli_entrypoint(
@@ -135,8 +806,10 @@ def cli_entrypoint(
     docontrast: bool,
     lower: float,
     upper: float,
+    callback: Optional[ProgressCallback] = None,
 ) -> None:
-    args = get_args()
+    # Defaults only, the caller's command line is not ours to parse
+    args = get_args([])
     args.input = input
     args.output = output
     args.format = format
@@ -144,42 +817,542 @@ def cli_entrypoint(
     if docontrast:
         args.subcommands = "stretch"
         args.stretch = (lower, upper)
-    main(args)
+    main(args, callback)
 
 
-def main(args: Namespace) -> None:
-    files, outfiles = parse_files(args.input, args.output, args.format)
+def output_options(args: Namespace) -> Dict[str, Any]:
+    """CLI arguments that determine the content of an output."""
+    stretch = args.subcommands == "stretch"
+    return {
+        "format": args.format,
+        "dtype": args.dtype,
+        "range": args.range,
+        "bands": args.bands,
+        "stretch": list(args.stretch) if stretch else None,
+        "stats_mode": getattr(args, "stats_mode", "exact"),
+        "stats_sample": getattr(args, "stats_sample", None),
+        "scale_bounds": getattr(args, "scale_bounds", None),
+        "ignore_nodata": getattr(args, "ignore_nodata", False),
+        "engine": getattr(args, "engine", "gdal"),
+        "emit": getattr(args, "emit", None),
+        "profile": getattr(args, "profile", "default"),
+        "creation_options": getattr(args, "co", None),
+    }
 
-    bands_out = [int(b) for b in args.bands.split(",")] if args.bands else None
 
-    for entry, out in zip(files, outfiles):
+def _scale_kwargs(args: Namespace) -> Dict[str, Any]:
+    """Keyword arguments of `getScaleParams` given by the CLI arguments."""
+    if args.subcommands == "stretch":
+        kwargs = {"stretch": True, "lower": args.stretch[0], "upper": args.stretch[1]}
+    else:
+        kwargs = {}
+    kwargs["max_memory"] = args.stats_memory * 2**20
+    kwargs["mode"] = args.stats_mode
+    kwargs["sample_blocks"] = args.stats_sample
+    kwargs["bounds"] = getattr(args, "scale_bounds", None)
+    kwargs["ignore_nodata"] = getattr(args, "ignore_nodata", False)
+    return kwargs
+
+
+def convert_file(
+    entry: Path, out: Path, args: Namespace, callback: Optional[ProgressCallback] = None
+) -> FileRecord:
+    """Convert a single raster as specified by the CLI arguments.
+
+    Native format and dtype are resolved per file, `args` is left untouched.
+    The GDAL configuration of the run (--profile, --config) is applied to the
+    calling thread while converting.
+
+    Args:
+        entry (Path): Path to input raster
+        out (Path): Path to output raster
+        args (Namespace): Parsed CLI arguments
+        callback (Optional[ProgressCallback]): GDAL progress callback for the
+            translation. Returning 0 from it cancels the conversion.
+
+    Raises:
+        RuntimeError: if the input cannot be opened or the conversion fails
+
+    Returns:
+        FileRecord: Per-stage timings and I/O of the conversion
+    """
+    with gdal_config(config_for(args)):
+        if getattr(args, "emit", None):
+            return convert_fanout(entry, out, args, callback)
+        return _convert_single(entry, out, args, callback)
+
+
+def _convert_single(
+    entry: Path, out: Path, args: Namespace, callback: Optional[ProgressCallback] = None
+) -> FileRecord:
+    from osgeo import gdal
+
+    from geoconverter.cache import StatsCache
+    from geoconverter.utils import probe
+
+    timer = StageTimer()
+    with timer.stage("open"):
         ds = gdal.Open(str(entry))
-        if args.format.lower() == "native":
-            args.format = ds.GetDriver().GetDescription()
-        if args.dtype.lower() == "native":
-            args.dtype = get_dtype(entry)
-        if args.range:
-            # Custom range
-            outputRange = [float(i) for i in args.range]
-        else:
-            outputRange = BITRANGE[args.dtype]
-
-        if args.subcommands == "stretch":
-            kwargs = {
-                "stretch": True,
-                "lower": args.stretch[0],
-                "upper": args.stretch[1],
-            }
+        if ds is None:
+            raise RuntimeError(f"Unable to open {entry}")
+        # Reuses the metadata from parse_files or records it from this open
+        info = probe(entry, ds)
+    bands_out = [int(b) for b in args.bands.split(",")] if args.bands else None
+
+    outputFormat = args.format
+    if outputFormat.lower() == "native":
+        outputFormat = info.driver
+    outputType = args.dtype
+    if outputType.lower() == "native":
+        outputType = info.dtype
+    if args.range:
+        # Custom range
+        outputRange = [float(i) for i in args.range]
+    else:
+        outputRange = BITRANGE[outputType]
+
+    kwargs = _scale_kwargs(args)
+    creationOptions = creation_options_for(args, outputFormat, TYPE_DICT[outputType])
+
+    engine = getattr(args, "engine", "gdal")
+    if engine == "numpy" and outputFormat == "VRT":
+        raise RuntimeError("The numpy engine cannot write VRTs")
+    cache = None
+    if args.stats_cache:
+        cache = StatsCache(args.stats_cache_dir, args.stats_cache_size * 2**20)
+    # A VRT output is the scaled view itself, so there is nothing to chain
+    chain = getattr(args, "vrt_chain", False) and outputFormat != "VRT"
+    try:
+        with timer.stage("stats"):
+            if engine == "numpy":
+                scaleParams = getScaleParams(
+                    ds, outputRange, bands=bands_out, cache=cache, **kwargs
+                )
+            else:
+                options = setupOptions(
+                    ds,
+                    "VRT" if chain else outputFormat,
+                    outputType,
+                    outputRange,
+                    bands_out,
+                    cache=cache,
+                    callback=callback,
+                    creationOptions=None if chain else creationOptions,
+                    **kwargs,
+                )
+    finally:
+        if cache is not None:
+            cache.close()
+    with timer.stage("translate"):
+        # Written next to the output and renamed, so a crash never leaves a
+        # truncated output behind
+        partial = partial_path(out)
+        if engine == "numpy":
+            from geoconverter.rescale import rescale
+
+            result = rescale(
+                ds,
+                partial,
+                outputFormat,
+                TYPE_DICT[outputType],
+                bands_out or list(range(1, ds.RasterCount + 1)),
+                scaleParams,
+                kwargs["max_memory"],
+                callback,
+                creationOptions,
+            )
+        elif chain:
+            result = translate_via_vrt(
+                str(partial), ds, options, outputFormat, callback, creationOptions
+            )
         else:
-            kwargs = {}
+            result = gdal.Translate(destName=str(partial), srcDS=ds, options=options)
+        ds = None
+        if result is None:
+            raise RuntimeError(f"Failed to convert {entry}")
+        files = result.GetFileList() or []
+        # Closing flushes the output, which is part of the translation
+        result = None
+        replace_output(partial, out, files)
+    return timer.record(entry, out)
 
-        options = setupOptions(
-            ds, args.format, args.dtype, outputRange, bands_out, **kwargs
-        )
-        gdal.Translate(destName=str(out), srcDS=ds, options=options)
+
+def preview_file(
+    entry: Path, out: Path, args: Namespace, cache: Optional["PreviewCache"] = None
+) -> None:
+    """Write a PNG preview of converting a raster as specified by the CLI arguments.
+
+    Only the band selection and the scaling (stretch, global bounds, nodata
+    handling) apply, the preview is always Byte.
+
+    Args:
+        entry (Path): Path to input raster
+        out (Path): Path to output PNG
+        args (Namespace): Parsed CLI arguments
+        cache (Optional[PreviewCache]): Cache of previews
+
+    Raises:
+        RuntimeError: if the input cannot be opened or rendered
+    """
+    from geoconverter.preview import preview
+
+    kwargs = _scale_kwargs(args)
+    data = preview(
+        entry,
+        args.preview_size,
+        [int(b) for b in args.bands.split(",")] if args.bands else None,
+        kwargs.get("stretch", False),
+        kwargs.get("lower", 0.0),
+        kwargs.get("upper", 100.0),
+        kwargs["bounds"],
+        kwargs["ignore_nodata"],
+        cache,
+    )
+    partial = partial_path(out)
+    partial.write_bytes(data)
+    replace_output(partial, out)
+
+
+def convert_fanout(
+    entry: Path, out: Path, args: Namespace, callback: Optional[ProgressCallback] = None
+) -> FileRecord:
+    """Convert a single raster into every output given by `args.emit`.
+
+    The raster is opened once, its statistics are computed once for the bands
+    of all outputs and every window is read once and written to all outputs
+    by the numpy engine. The first output is written to `out`, the others
+    next to it, named after it plus their suffix.
+
+    Args:
+        entry (Path): Path to input raster
+        out (Path): Path to the first output
+        args (Namespace): Parsed CLI arguments
+        callback (Optional[ProgressCallback]): GDAL progress callback.
+            Returning 0 from it cancels the conversion.
+
+    Raises:
+        RuntimeError: if the input cannot be opened, outputs would overwrite
+            each other or the conversion fails
+
+    Returns:
+        FileRecord: Per-stage timings and I/O of the conversion, with the
+            bytes written to all outputs
+    """
+    from osgeo import gdal
+
+    from geoconverter.cache import StatsCache
+    from geoconverter.rescale import RescaleOutput, rescale_many
+    from geoconverter.utils import get_extension, probe
+
+    timer = StageTimer()
+    with timer.stage("open"):
+        ds = gdal.Open(str(entry))
+        if ds is None:
+            raise RuntimeError(f"Unable to open {entry}")
+        info = probe(entry, ds)
+    if args.bands:
+        default_bands = [int(b) for b in args.bands.split(",")]
+    else:
+        default_bands = list(range(1, ds.RasterCount + 1))
+
+    specs = []  # type: List[Tuple[OutputSpec, str, List[float], Path]]
+    for i, spec in enumerate(args.emit):
+        outputFormat = info.driver if spec.format.lower() == "native" else spec.format
+        outputType = spec.dtype or args.dtype
+        if outputType.lower() == "native":
+            outputType = info.dtype
+        outputRange = spec.range or args.range or BITRANGE[outputType]
+        path = out
+        if i > 0:
+            ext = get_extension(entry, outputFormat)
+            path = out.with_name(f"{out.stem}{spec.suffix}.{ext}")
+        spec = spec._replace(format=outputFormat, bands=spec.bands or default_bands)
+        specs.append((spec, outputType, [float(v) for v in outputRange], path))
+    paths = [path for _, _, _, path in specs]
+    if len(set(paths)) < len(paths):
+        raise RuntimeError("Outputs of --emit overwrite each other, add a suffix")
+
+    kwargs = _scale_kwargs(args)
+    bands = sorted({b for spec, _, _, _ in specs for b in spec.bands or []})
+    cache = None
+    if args.stats_cache:
+        cache = StatsCache(args.stats_cache_dir, args.stats_cache_size * 2**20)
+    try:
+        with timer.stage("stats"):
+            # Bounds only, each output appends its own range
+            params = getScaleParams(ds, [], bands=bands, cache=cache, **kwargs)
+    finally:
+        if cache is not None:
+            cache.close()
+    bounds = dict(zip(bands, params))
+
+    with timer.stage("translate"):
+        partials = [partial_path(path) for path in paths]
+        outputs = [
+            RescaleOutput(
+                str(written),
+                spec.format,
+                TYPE_DICT[outputType],
+                spec.bands or [],
+                [bounds[b] + outputRange for b in spec.bands or []],
+                spec.scale,
+                creation_options_for(args, spec.format, TYPE_DICT[outputType]),
+            )
+            for (spec, outputType, outputRange, _), written in zip(specs, partials)
+        ]
+        results = rescale_many(ds, outputs, kwargs["max_memory"], callback)
         ds = None
+        if any(result is None for result in results):
+            raise RuntimeError(f"Failed to convert {entry}")
+        files = [r.GetFileList() or [] for r in results if r is not None]
+        # Closing flushes the outputs, which is part of the translation
+        results = []
+        for written, path, fileList in zip(partials, paths, files):
+            replace_output(written, path, fileList)
+    record = timer.record(entry, out)
+    return record._replace(bytes_written=sum(os.path.getsize(str(p)) for p in paths))
+
+
+def convert_parallel(
+    pairs: Iterable[Tuple[Path, Path]],
+    args: Namespace,
+    jobs: int,
+    report: Optional[RunReport] = None,
+    manifest: Optional["Manifest"] = None,
+) -> Tuple[int, List[Path]]:
+    """Convert files across a pool of worker processes.
+
+    Files are submitted as they are discovered, with a bounded number in
+    flight, and results are reported as files finish. A failing file is
+    logged and does not stop the rest of the batch.
+
+    With `--memory-budget`, files are only submitted while the estimated
+    peak memory of those in flight fits in the budget (see
+    `geoconverter.scheduler`), so huge files run alone.
+
+    Args:
+        pairs (Iterable[Tuple[Path, Path]]): Input and output rasters
+        args (Namespace): Parsed CLI arguments
+        jobs (int): Number of worker processes
+        report (Optional[RunReport]): Report to add file records to
+        manifest (Optional[Manifest]): Manifest to record converted files in
+
+    Returns:
+        Tuple[int, List[Path]]: Number of files processed and the inputs
+            that failed to convert
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    from geoconverter.scheduler import MemoryBudget, estimate_memory
+    from geoconverter.utils import probe
+
+    # Estimates need every file probed, so only with a budget
+    limit = getattr(args, "memory_budget", None)
+    budget = MemoryBudget(limit * 2**20) if limit else None
+    # Block cache of each worker, as configured for the run
+    worker_cache = cache_max(config_for(args))
+
+    failed = []
+    done = 0
+    pending = {}  # type: Dict[Future[FileRecord], Tuple[Path, Path]]
+    reserved = {}  # type: Dict[Future[FileRecord], int]
+
+    def collect(futures: Iterable["Future[FileRecord]"]) -> None:
+        nonlocal done
+        for future in futures:
+            entry, out = pending.pop(future)
+            if budget is not None:
+                budget.release(reserved.pop(future))
+            done += 1
+            try:
+                record = future.result()
+            except Exception as exc:
+                failed.append(entry)
+                record = failed_record(entry, out, exc)
+                logger.error("[%d] %s failed: %s", done, entry, exc)
+            else:
+                logger.info("[%d] %s -> %s", done, entry, out)
+                if manifest is not None:
+                    manifest.record(entry, out)
+            if report is not None:
+                report.add(record)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for entry, out in pairs:
+            need = 0
+            if budget is not None:
+                try:
+                    need = estimate_memory(probe(entry), args, worker_cache)
+                except RuntimeError:
+                    # Unreadable, the worker reports the failure
+                    pass
+                if need > budget.limit:
+                    logger.info(
+                        "%s needs about %d MB, converting it alone",
+                        entry,
+                        need // 2**20,
+                    )
+            while pending and (
+                len(pending) >= MAX_INFLIGHT_PER_JOB * jobs
+                or (budget is not None and not budget.fits(need))
+            ):
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+            future = executor.submit(convert_file, entry, out, args)
+            pending[future] = (entry, out)
+            if budget is not None:
+                budget.acquire(need)
+                reserved[future] = need
+        collect(as_completed(list(pending)))
+    return done, failed
+
+
+def main(args: Namespace, callback: Optional[ProgressCallback] = None) -> None:
+    emit = getattr(args, "emit", None)
+    previews = getattr(args, "preview", False)
+    if previews:
+        format = "PNG"
+    else:
+        format = emit[0].format if emit else args.format
+    pairs = parse_files(
+        args.input,
+        args.output,
+        format,
+        output_stub="preview" if previews else "converted",
+        include=getattr(args, "include", None),
+        exclude=getattr(args, "exclude", None),
+        use_scandir=getattr(args, "scandir", False),
+    )
+
+    jobs = getattr(args, "jobs", 1) or os.cpu_count() or 1
+    if getattr(args, "global_stretch", False):
+        # Every file has to be known before the first one is converted
+        batch = list(pairs)
+        start = time.perf_counter()
+        bounds = global_scale_params([entry for entry, _ in batch], args, jobs)
+        logger.info(
+            "Global scale bounds %s from %d files in %.1f s",
+            bounds,
+            len(batch),
+            time.perf_counter() - start,
+        )
+        args = Namespace(**vars(args), scale_bounds=bounds)
+        pairs = iter(batch)
+
+    if previews:
+        from geoconverter.preview import PreviewCache
+
+        cache = PreviewCache(args.preview_cache_dir if args.preview_cache else None)
+        for entry, out in pairs:
+            preview_file(entry, out, args, cache)
+            logger.info("Preview of %s written to %s", entry, out)
+        return
+
+    # Encoder threads are shared out between files converted in parallel
+    many = Path(args.input).is_dir() or archive_root(args.input) is not None
+    parallel = jobs > 1 and many
+    args = Namespace(**{**vars(args), "threads": thread_share(jobs if parallel else 1)})
+    formats = [spec.format for spec in emit] if emit else [args.format]
+    run = {
+        "args": vars(args),
+        "encoding": encoding_settings(args, formats),
+    }  # type: Dict[str, Any]
+    shard = getattr(args, "shard", None)
+    if shard is not None:
+        from geoconverter.shards import (
+            DEFAULT_MANIFEST,
+            DEFAULT_REPORT,
+            select_shard,
+            shard_path,
+        )
+
+        # After a global stretch, whose bounds hold for all shards
+        batch = select_shard(pairs, *shard)
+        logger.info("Shard %d/%d: %d files", shard[0], shard[1], len(batch))
+        paths = {
+            "manifest": args.manifest or Path(args.output) / DEFAULT_MANIFEST,
+            "report": args.report or Path(args.output) / DEFAULT_REPORT,
+        }
+        args = Namespace(
+            **{**vars(args), **{k: shard_path(v, *shard) for k, v in paths.items()}}
+        )
+        run = {
+            "args": vars(args),
+            "encoding": run["encoding"],
+            "shard": {
+                "index": shard[0],
+                "count": shard[1],
+                "inputs": [str(Path(entry).resolve()) for entry, _ in batch],
+            },
+        }
+        pairs = iter(batch)
+
+    report = None
+    if getattr(args, "report", None):
+        report = RunReport(args.report, run)
+    manifest = None  # type: Optional[Manifest]
+    if getattr(args, "manifest", None):
+        from geoconverter.manifest import Manifest
+
+        manifest = Manifest(
+            args.manifest, output_options(args), getattr(args, "manifest_hash", False)
+        )
+
+    def outdated(pairs: Iterable[Tuple[Path, Path]]) -> Iterator[Tuple[Path, Path]]:
+        for entry, out in pairs:
+            current = manifest is not None and manifest.is_current(entry, out)
+            if current and not getattr(args, "force", False):
+                logger.debug("%s is up to date", out)
+                if report is not None:
+                    report.add(skipped_record(entry, out))
+                continue
+            yield entry, out
+
+    try:
+        if getattr(args, "watch", False):
+            from geoconverter.watch import watch_folder
+
+            target = partial(
+                output_path,
+                directory=Path(args.output),
+                format=format,
+                output_stub="converted",
+            )
+            watch_folder(args, target, jobs, report, manifest, outdated)
+            return
+
+        if parallel:
+            total, failed = convert_parallel(
+                outdated(pairs), args, jobs, report, manifest
+            )
+            if failed:
+                raise RuntimeError(f"{len(failed)} of {total} files failed to convert")
+            return
+
+        for entry, out in outdated(pairs):
+            try:
+                record = convert_file(entry, out, args, callback)
+            except Exception as exc:
+                if report is not None:
+                    report.add(failed_record(entry, out, exc))
+                raise
+            if manifest is not None:
+                manifest.record(entry, out)
+            if report is not None:
+                report.add(record)
+    finally:
+        if manifest is not None:
+            manifest.close()
+        if report is not None:
+            logger.info(report.format_summary())
+            report.close()
+
+
+def cli(argv: Optional[List[str]] = None) -> None:
+    """Command line entry point."""
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main(get_args(argv))
 
 
 if __name__ == "__main__":
-    args = get_args()
-    main(args)
+    cli()
@@ -0,0 +1,182 @@
+"""Run manifest for resumable batch conversions"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import IO, Any, Dict, Optional, Union
+
+from geoconverter.utils import file_identity
+
+# Chunk size used when hashing inputs
+HASH_CHUNK = 8 * 1024 * 1024
+
+# Rewrite the manifest on open once superseded lines outnumber current ones
+COMPACT_RATIO = 2
+
+
+def file_hash(input: Union[Path, str]) -> str:
+    """SHA-256 of a file's content, read in chunks.
+
+    Files on GDAL virtual filesystems (e.g. in archives) are read with GDAL.
+    """
+    digest = hashlib.sha256()
+    if str(input).startswith("/vsi"):
+        from osgeo import gdal
+
+        f = gdal.VSIFOpenL(str(input), "rb")
+        if f is None:
+            raise OSError(f"Unable to open {input}")
+        try:
+            for chunk in iter(lambda: gdal.VSIFReadL(1, HASH_CHUNK, f), b""):
+                digest.update(chunk)
+        finally:
+            gdal.VSIFCloseL(f)
+        return digest.hexdigest()
+    with open(str(input), "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _size(path: Union[Path, str]) -> Optional[int]:
+    try:
+        return os.path.getsize(str(path))
+    except OSError:
+        return None
+
+
+class Manifest:
+    """Append-only JSON Lines record of converted files.
+
+    Each line records an input's identity (size, mtime and optionally a
+    content hash), the options it was converted with and the resulting
+    output. The last line of an input wins, and a line cut short by a crash
+    is ignored, so the manifest never claims a conversion that did not finish.
+
+    Args:
+        path (Union[Path, str]): Manifest file, created if missing
+        options (Dict[str, Any]): Options that determine the output. Entries
+            recorded with other options are stale.
+        use_hash (bool, optional): Record content hashes, so inputs that were
+            touched or copied without changing are still up to date.
+    """
+
+    def __init__(
+        self, path: Union[Path, str], options: Dict[str, Any], use_hash: bool = False
+    ) -> None:
+        self.path = Path(path)
+        self.options = json.loads(json.dumps(options, default=str))
+        self.use_hash = use_hash
+        self.entries = {}  # type: Dict[str, Dict[str, Any]]
+        # Identities of inputs checked before their conversion
+        self._pending = {}  # type: Dict[str, Dict[str, Any]]
+
+        lines = 0
+        line = "\n"
+        if self.path.exists():
+            with open(str(self.path)) as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry["input"]] = entry
+        if lines > COMPACT_RATIO * max(len(self.entries), 1):
+            self._compact()
+            line = "\n"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file: Optional[IO[str]] = open(str(self.path), "a")
+        if not line.endswith("\n"):
+            # Terminate a line cut short by a crash before appending
+            self.file.write("\n")
+
+    def _compact(self) -> None:
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(str(tmp), "w") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(str(tmp), str(self.path))
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self) -> "Manifest":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def is_current(self, input: Union[Path, str], output: Union[Path, str]) -> bool:
+        """Check whether `output` is an up to date conversion of `input`.
+
+        The identity of `input` is remembered, so a following `record` refers
+        to the file as it was before the conversion.
+
+        Args:
+            input (Union[Path, str]): Path to input raster
+            output (Union[Path, str]): Path to output raster
+
+        Returns:
+            bool: True if the conversion can be skipped
+        """
+        identity = file_identity(input)
+        if identity is None:
+            return False
+        path, size, mtime = identity
+        output = str(Path(output).resolve())
+        current = {"size": size, "mtime": mtime}  # type: Dict[str, Any]
+        self._pending[path] = current
+
+        entry = self.entries.get(path)
+        if (
+            entry is None
+            or entry["options"] != self.options
+            or entry["output"] != str(output)
+            or entry["output_size"] != _size(output)
+            or entry["size"] != size
+        ):
+            if self.use_hash:
+                current["hash"] = file_hash(input)
+            return False
+        if entry["mtime"] == mtime:
+            return True
+        if self.use_hash and entry.get("hash"):
+            current["hash"] = file_hash(input)
+            if current["hash"] == entry["hash"]:
+                # Same content, refresh the identity so it is not hashed again
+                self.record(input, output)
+                return True
+        return False
+
+    def record(self, input: Union[Path, str], output: Union[Path, str]) -> None:
+        """Record a finished conversion of `input` to `output`.
+
+        Args:
+            input (Union[Path, str]): Path to input raster
+            output (Union[Path, str]): Path to output raster
+        """
+        path = str(Path(input).resolve())
+        identity = self._pending.pop(path, None)
+        if identity is None:
+            found = file_identity(input)
+            if found is None:
+                return
+            identity = {"size": found[1], "mtime": found[2]}
+            if self.use_hash:
+                identity["hash"] = file_hash(input)
+        entry = {
+            "input": path,
+            **identity,
+            "options": self.options,
+            "output": str(Path(output).resolve()),
+            "output_size": _size(output),
+        }
+        self.entries[path] = entry
+        if self.file is not None:
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
@@ -0,0 +1,259 @@
+"""Quick PNG previews of conversions for the GUI and the command line"""
+
+import hashlib
+import json
+import os
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from geoconverter.defaults import DEFAULT_PREVIEW_CACHE_SIZE, DEFAULT_PREVIEW_SIZE
+from geoconverter.gdal_convert import BITRANGE, VSIMEM_PREFIX, getScaleParams
+from geoconverter.utils import file_identity
+
+# Previews kept in memory by a cache, enough to toggle between settings
+MEMORY_PREVIEWS = 32
+
+
+def preview_bands(count: int, bands: Optional[List[int]] = None) -> List[int]:
+    """Bands shown by a preview: the selected ones, else RGB or the first."""
+    if bands:
+        return bands
+    return [1, 2, 3] if count >= 3 else [1]
+
+
+def preview_key(input: Union[Path, str], **options: Any) -> Optional[str]:
+    """Key of a preview by file identity and the options it was rendered with.
+
+    Returns:
+        Optional[str]: Hex digest, None if `input` cannot be identified
+    """
+    identity = file_identity(input)
+    if identity is None:
+        return None
+    blob = json.dumps([identity, options], sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+class PreviewCache:
+    """PNG previews keyed by `preview_key`.
+
+    The most recent previews are kept in memory. Given a directory, previews
+    are also stored there as PNG files, so later runs reuse them. Once the
+    directory grows past `max_bytes`, the least recently used files are
+    removed.
+
+    Args:
+        directory (Optional[Union[Path, str]]): Directory holding previews
+        max_bytes (int, optional): Size limit of the directory in bytes.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[Union[Path, str]] = None,
+        max_bytes: int = DEFAULT_PREVIEW_CACHE_SIZE,
+    ) -> None:
+        self.directory = Path(directory) if directory is not None else None
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()  # type: OrderedDict[str, bytes]
+
+    def _path(self, key: str) -> Path:
+        assert self.directory is not None
+        return self.directory / f"{key}.png"
+
+    def get(self, key: str) -> Optional[bytes]:
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        # Marks the file as recently used
+        os.utime(str(path))
+        self._remember(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        self._remember(key, data)
+        if self.directory is None:
+            return
+        path = self._path(key)
+        partial = path.with_name(f".{path.name}.partial")
+        partial.write_bytes(data)
+        os.replace(str(partial), str(path))
+        self.evict(keep=path)
+
+    def _remember(self, key: str, data: bytes) -> None:
+        self.memory[key] = data
+        self.memory.move_to_end(key)
+        if len(self.memory) > MEMORY_PREVIEWS:
+            self.memory.popitem(last=False)
+
+    def evict(self, keep: Optional[Path] = None) -> None:
+        """Remove least recently used previews until they fit `max_bytes`."""
+        if self.directory is None:
+            return
+        files = []
+        for path in self.directory.glob("*.png"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+
+
+def render_preview(
+    input: Union[Path, str],
+    size: int = DEFAULT_PREVIEW_SIZE,
+    bands: Optional[List[int]] = None,
+    stretch: bool = False,
+    lower: float = 0.0,
+    upper: float = 100.0,
+    bounds: Optional[Dict[int, List[float]]] = None,
+    ignore_nodata: bool = False,
+) -> bytes:
+    """Render a PNG preview of rescaling a raster to Byte.
+
+    The raster is read into a buffer of at most `size` pixels on its longer
+    side, which GDAL serves from overviews where the raster has them. Scale
+    parameters are computed by `getScaleParams` on that decimated view, so
+    a preview takes about as long for a huge raster as for a small one.
+
+    Args:
+        input (Union[Path, str]): Path to raster
+        size (int, optional): Longer side of the preview in pixels
+        bands (Optional[List[int]]): Bands to show. Defaults to the first
+            three, or the first if there are fewer.
+        stretch (bool, optional): Stretch between percentiles rather than
+            the band minimum and maximum
+        lower (float, optional): Lower stretch percentile
+        upper (float, optional): Upper stretch percentile
+        bounds (Optional[Dict[int, List[float]]]): Input range of each band,
+            e.g. from a global stretch, used instead of statistics
+        ignore_nodata (bool, optional): Leave nodata pixels out of stretch
+            percentiles
+
+    Raises:
+        RuntimeError: if the raster cannot be opened or rendered
+
+    Returns:
+        bytes: PNG image
+    """
+    from osgeo import gdal
+
+    ds = gdal.Open(str(input))
+    if ds is None:
+        raise RuntimeError(f"Unable to open {input}")
+    bands = preview_bands(ds.RasterCount, bands)
+    factor = min(1.0, size / max(ds.RasterXSize, ds.RasterYSize))
+    view = gdal.Translate(
+        "",
+        ds,
+        options=gdal.TranslateOptions(
+            format="MEM",
+            bandList=bands,
+            width=max(1, round(ds.RasterXSize * factor)),
+            height=max(1, round(ds.RasterYSize * factor)),
+        ),
+    )
+    ds = None
+    if view is None:
+        raise RuntimeError(f"Unable to read {input}")
+
+    # The view numbers the selected bands from 1
+    if bounds is not None:
+        bounds = {i: bounds[b] for i, b in enumerate(bands, 1)}
+    scaleParams = getScaleParams(
+        view,
+        BITRANGE["Byte"],
+        stretch,
+        lower,
+        upper,
+        bounds=bounds,
+        ignore_nodata=ignore_nodata,
+    )
+
+    pngName = f"{VSIMEM_PREFIX}/{uuid.uuid4().hex}.png"
+    png = gdal.Translate(
+        pngName,
+        view,
+        options=gdal.TranslateOptions(
+            format="PNG", outputType=gdal.GDT_Byte, scaleParams=scaleParams
+        ),
+    )
+    view = None
+    if png is None:
+        raise RuntimeError(f"Unable to render a preview of {input}")
+    files = png.GetFileList() or [pngName]
+    png = None
+    try:
+        stat = gdal.VSIStatL(pngName)
+        f = gdal.VSIFOpenL(pngName, "rb")
+        try:
+            data = bytes(gdal.VSIFReadL(1, stat.size, f))
+        finally:
+            gdal.VSIFCloseL(f)
+    finally:
+        for name in files:
+            gdal.Unlink(name)
+    return data
+
+
+def preview(
+    input: Union[Path, str],
+    size: int = DEFAULT_PREVIEW_SIZE,
+    bands: Optional[List[int]] = None,
+    stretch: bool = False,
+    lower: float = 0.0,
+    upper: float = 100.0,
+    bounds: Optional[Dict[int, List[float]]] = None,
+    ignore_nodata: bool = False,
+    cache: Optional[PreviewCache] = None,
+) -> bytes:
+    """Render a PNG preview as `render_preview`, reusing cached ones.
+
+    Previews are cached by file identity and every option, so switching
+    back to settings previewed before costs nothing.
+
+    Args:
+        cache (Optional[PreviewCache]): Cache of previews
+
+    Returns:
+        bytes: PNG image
+    """
+    options = {
+        "size": size,
+        "bands": bands,
+        "stretch": [lower, upper] if stretch else None,
+        "bounds": bounds,
+        "ignore_nodata": ignore_nodata,
+    }  # type: Dict[str, Any]
+    key = preview_key(input, **options) if cache is not None else None
+    if cache is not None and key is not None:
+        data = cache.get(key)
+        if data is not None:
+            return data
+    data = render_preview(
+        input, size, bands, stretch, lower, upper, bounds, ignore_nodata
+    )
+    if cache is not None and key is not None:
+        cache.put(key, data)
+    return data
@@ -0,0 +1,225 @@
+"""Encoding profiles: creation options and GDAL configuration of a run"""
+
+import os
+from argparse import ArgumentTypeError, Namespace
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Creation options of each profile by output format. ALL_CPUS thread counts
+# are shared out between parallel jobs, see `thread_share`.
+PROFILES = {
+    # GDAL's defaults: single-threaded, driver default tiling
+    "default": {},
+    # Threaded, cheap compression and overviews, for quick turnaround
+    "fast": {
+        "COG": {
+            "NUM_THREADS": "ALL_CPUS",
+            "COMPRESS": "LZW",
+            "BLOCKSIZE": "512",
+            "OVERVIEWS": "AUTO",
+            "OVERVIEW_RESAMPLING": "NEAREST",
+        },
+        "GTiff": {
+            "NUM_THREADS": "ALL_CPUS",
+            "TILED": "YES",
+            "BLOCKXSIZE": "512",
+            "BLOCKYSIZE": "512",
+            "COMPRESS": "LZW",
+        },
+    },
+    # Threaded, strong compression with a predictor, for delivery
+    "compact": {
+        "COG": {
+            "NUM_THREADS": "ALL_CPUS",
+            "COMPRESS": "DEFLATE",
+            "LEVEL": "9",
+            "PREDICTOR": "YES",
+            "BLOCKSIZE": "512",
+            "OVERVIEWS": "AUTO",
+            "OVERVIEW_RESAMPLING": "AVERAGE",
+        },
+        "GTiff": {
+            "NUM_THREADS": "ALL_CPUS",
+            "TILED": "YES",
+            "BLOCKXSIZE": "512",
+            "BLOCKYSIZE": "512",
+            "COMPRESS": "DEFLATE",
+            "ZLEVEL": "9",
+            "PREDICTOR": "YES",
+        },
+    },
+}  # type: Dict[str, Dict[str, Dict[str, str]]]
+
+# GDAL configuration of each profile. GDAL_NUM_THREADS covers the drivers
+# without a NUM_THREADS creation option, e.g. JP2OpenJPEG.
+PROFILE_CONFIG = {
+    "default": {},
+    "fast": {"GDAL_NUM_THREADS": "ALL_CPUS"},
+    "compact": {"GDAL_NUM_THREADS": "ALL_CPUS"},
+}  # type: Dict[str, Dict[str, str]]
+
+# Options whose ALL_CPUS value is shared out between parallel jobs
+THREAD_OPTIONS = ("NUM_THREADS", "GDAL_NUM_THREADS")
+
+FLOAT_TYPES = ("Float32", "Float64")
+
+
+def parse_option(text: str) -> Tuple[str, str]:
+    """Parse a creation or configuration option given as `KEY=VALUE`.
+
+    Raises:
+        ArgumentTypeError: if the option is malformed
+    """
+    key, sep, value = text.partition("=")
+    if not sep or not key:
+        raise ArgumentTypeError(f"Expected KEY=VALUE, got {text!r}")
+    return key.strip().upper(), value.strip()
+
+
+def thread_share(jobs: int) -> str:
+    """Threads of each of `jobs` parallel conversions, ALL_CPUS for one."""
+    if jobs <= 1:
+        return "ALL_CPUS"
+    return str(max(1, (os.cpu_count() or 1) // jobs))
+
+
+def _threads(options: Dict[str, str], threads: str) -> Dict[str, str]:
+    return {
+        k: threads if k in THREAD_OPTIONS and v.upper() == "ALL_CPUS" else v
+        for k, v in options.items()
+    }
+
+
+def creation_options(
+    format: str,
+    outputType: Optional[str] = None,
+    profile: str = "default",
+    extra: Sequence[Tuple[str, str]] = (),
+    threads: str = "ALL_CPUS",
+) -> List[str]:
+    """Creation options of an output.
+
+    Args:
+        format (str): GDAL driver of the output
+        outputType (Optional[str]): GDAL data type name of the output, picks
+            the GTiff predictor
+        profile (str, optional): Name of a profile in `PROFILES`
+        extra (Sequence[Tuple[str, str]]): Options given explicitly, these
+            take precedence over the profile
+        threads (str, optional): Threads per conversion, see `thread_share`
+
+    Returns:
+        List[str]: Options as `KEY=VALUE`
+    """
+    options = {**PROFILES[profile].get(format, {}), **dict(extra)}
+    if format == "GTiff" and options.get("PREDICTOR", "").upper() == "YES":
+        # Unlike COG, GTiff needs the predictor spelled out
+        if outputType is not None:
+            options["PREDICTOR"] = "3" if outputType in FLOAT_TYPES else "2"
+    return [f"{k}={v}" for k, v in _threads(options, threads).items()]
+
+
+def config_options(
+    profile: str = "default",
+    extra: Sequence[Tuple[str, str]] = (),
+    threads: str = "ALL_CPUS",
+) -> Dict[str, str]:
+    """GDAL configuration of a run, the profile's overridden by `extra`."""
+    return _threads({**PROFILE_CONFIG[profile], **dict(extra)}, threads)
+
+
+def creation_options_for(
+    args: Namespace, format: str, outputType: Optional[str]
+) -> List[str]:
+    """Creation options of an output given by the CLI arguments."""
+    return creation_options(
+        format,
+        outputType,
+        getattr(args, "profile", "default"),
+        getattr(args, "co", None) or [],
+        getattr(args, "threads", "ALL_CPUS"),
+    )
+
+
+def config_for(args: Namespace) -> Dict[str, str]:
+    """GDAL configuration given by the CLI arguments."""
+    return config_options(
+        getattr(args, "profile", "default"),
+        getattr(args, "config", None) or [],
+        getattr(args, "threads", "ALL_CPUS"),
+    )
+
+
+def encoding_settings(args: Namespace, formats: Sequence[str]) -> Dict[str, Any]:
+    """Profile, creation options and GDAL configuration of a run, for reports.
+
+    Args:
+        args (Namespace): Parsed CLI arguments
+        formats (Sequence[str]): Output formats of the run. Native outputs
+            only get the explicit creation options.
+
+    Returns:
+        Dict[str, Any]: Settings of the run
+    """
+    dtype = getattr(args, "dtype", "Native")
+    outputType = None if dtype.lower() == "native" else dtype
+    return {
+        "profile": getattr(args, "profile", "default"),
+        "threads": getattr(args, "threads", "ALL_CPUS"),
+        "creation_options": {
+            f: creation_options_for(args, f, outputType) for f in formats
+        },
+        "config": config_for(args),
+    }
+
+
+def _cache_bytes(value: str) -> int:
+    """GDAL_CACHEMAX in bytes: N%, NMB, NGB or N (MB below 100000)."""
+    from geoconverter.scheduler import physical_memory
+
+    text = value.strip().upper()
+    if text.endswith("%"):
+        return int((physical_memory() or 0) * float(text[:-1]) / 100)
+    for suffix, unit in (("GB", 2**30), ("MB", 2**20), ("KB", 2**10)):
+        if text.endswith(suffix):
+            return int(float(text[: -len(suffix)]) * unit)
+    number = int(text)
+    return number * 2**20 if number < 100000 else number
+
+
+def cache_max(options: Dict[str, str]) -> int:
+    """GDAL block cache size in bytes under configuration `options`."""
+    from osgeo import gdal
+
+    if "GDAL_CACHEMAX" in options:
+        return _cache_bytes(options["GDAL_CACHEMAX"])
+    return int(gdal.GetCacheMax())
+
+
+@contextmanager
+def gdal_config(options: Dict[str, str]) -> Iterator[None]:
+    """Apply GDAL configuration options, restoring the previous ones on exit.
+
+    Options are set for the calling thread only, so conversions running on
+    other threads (e.g. GUI previews) are not affected. GDAL_CACHEMAX is
+    applied with `gdal.SetCacheMax` instead, as the block cache is shared and
+    only sized from the configuration when first used.
+
+    Args:
+        options (Dict[str, str]): Configuration options
+    """
+    from osgeo import gdal
+
+    previous = {k: gdal.GetThreadLocalConfigOption(k, None) for k in options}
+    cache = gdal.GetCacheMax() if "GDAL_CACHEMAX" in options else None
+    try:
+        for key, value in options.items():
+            gdal.SetThreadLocalConfigOption(key, value)
+        if cache is not None:
+            gdal.SetCacheMax(cache_max(options))
+        yield
+    finally:
+        for key, old in previous.items():
+            gdal.SetThreadLocalConfigOption(key, old)
+        if cache is not None:
+            gdal.SetCacheMax(cache)
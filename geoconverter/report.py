@@ -0,0 +1,236 @@
+"""Per-stage timing and throughput reports for geoconverter runs"""
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Any, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore
+
+from geoconverter.utils import file_identity
+
+STAGES = ("open", "stats", "translate")
+
+
+class FileRecord(NamedTuple):
+    """Timings and I/O of converting a single file."""
+
+    input: str
+    output: str
+    status: str
+    stages: Dict[str, float]
+    input_bytes: int
+    bytes_written: int
+    peak_rss: Optional[int]
+    error: Optional[str] = None
+
+
+def peak_rss() -> Optional[int]:
+    """Peak resident set size of the current process in bytes, if known."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return int(rss) if sys.platform == "darwin" else int(rss) * 1024
+
+
+def _size(path: Union[Path, str]) -> int:
+    if str(path).startswith("/vsi"):
+        # e.g. a raster read from an archive
+        identity = file_identity(path)
+        return identity[1] if identity else 0
+    try:
+        return os.path.getsize(str(path))
+    except OSError:
+        return 0
+
+
+class StageTimer:
+    """Times the stages of a single conversion."""
+
+    def __init__(self) -> None:
+        self.stages = {}  # type: Dict[str, float]
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (
+                time.perf_counter() - start
+            )
+
+    def record(self, input: Union[Path, str], output: Union[Path, str]) -> FileRecord:
+        return FileRecord(
+            input=str(input),
+            output=str(output),
+            status="ok",
+            stages=dict(self.stages),
+            input_bytes=_size(input),
+            bytes_written=_size(output),
+            peak_rss=peak_rss(),
+        )
+
+
+def failed_record(
+    input: Union[Path, str], output: Union[Path, str], error: BaseException
+) -> FileRecord:
+    return FileRecord(
+        str(input), str(output), "failed", {}, 0, 0, peak_rss(), str(error)
+    )
+
+
+def skipped_record(input: Union[Path, str], output: Union[Path, str]) -> FileRecord:
+    return FileRecord(str(input), str(output), "skipped", {}, 0, 0, peak_rss())
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    k = int(position)
+    if k + 1 >= len(values):
+        return values[-1]
+    return values[k] + (values[k + 1] - values[k]) * (position - k)
+
+
+def summarize(records: List[FileRecord], wall: float) -> Dict[str, Any]:
+    """Per-stage p50/p95 and overall throughput of file records.
+
+    Args:
+        records (List[FileRecord]): Records of a run
+        wall (float): Wall time of the run in seconds
+
+    Returns:
+        Dict[str, Any]: Summary of the run
+    """
+    ok = [r for r in records if r.status == "ok"]
+    input_bytes = sum(r.input_bytes for r in ok)
+    stages = {}
+    for stage in STAGES:
+        times = [r.stages[stage] for r in ok if stage in r.stages]
+        stages[stage] = {
+            "p50": percentile(times, 50),
+            "p95": percentile(times, 95),
+            "total": sum(times),
+        }
+    rss = [r.peak_rss for r in records if r.peak_rss is not None]
+    return {
+        "files": len(ok),
+        "failed": sum(r.status == "failed" for r in records),
+        "skipped": sum(r.status == "skipped" for r in records),
+        "wall": wall,
+        "input_bytes": input_bytes,
+        "bytes_written": sum(r.bytes_written for r in ok),
+        "mb_per_s": input_bytes / 2**20 / wall if wall > 0 else 0.0,
+        "peak_rss": max(rss) if rss else None,
+        "stages": stages,
+    }
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    """Summary from `summarize` as a plain text table."""
+    lines = [f"{'stage':<10}{'p50 (s)':>10}{'p95 (s)':>10}{'total (s)':>12}"]
+    for stage, t in summary["stages"].items():
+        if t["p50"] is None:
+            continue
+        lines.append(
+            f"{stage:<10}{t['p50']:>10.3f}{t['p95']:>10.3f}{t['total']:>12.2f}"
+        )
+    lines.append(
+        f"{summary['files']} files ok, {summary['failed']} failed, "
+        f"{summary['skipped']} up to date: "
+        f"input {summary['input_bytes'] / 2**20:.1f} MB, "
+        f"wrote {summary['bytes_written'] / 2**20:.1f} MB "
+        f"in {summary['wall']:.1f} s ({summary['mb_per_s']:.1f} MB/s)"
+    )
+    if summary["peak_rss"] is not None:
+        lines.append(f"peak RSS {summary['peak_rss'] / 2**20:.0f} MB")
+    return "\n".join(lines)
+
+
+def read_report(
+    path: Union[Path, str]
+) -> Tuple[Dict[str, Any], List[FileRecord], Optional[Dict[str, Any]]]:
+    """Read a report written by `RunReport`.
+
+    Args:
+        path (Union[Path, str]): JSON Lines report
+
+    Returns:
+        Tuple[Dict[str, Any], List[FileRecord], Optional[Dict[str, Any]]]:
+            The run line, the file records and the summary line, which is
+            None if the run did not finish
+    """
+    run = {}  # type: Dict[str, Any]
+    records = []
+    summary = None
+    with open(str(path)) as f:
+        for line in f:
+            entry = json.loads(line)
+            kind = entry.pop("type")
+            if kind == "run":
+                run = entry
+            elif kind == "file":
+                records.append(FileRecord(**entry))
+            elif kind == "summary":
+                summary = entry
+    return run, records, summary
+
+
+class RunReport:
+    """Collects file records of a run and writes them as JSON Lines.
+
+    The report starts with a `run` line describing the run, has one `file`
+    line per converted file (written as soon as the file is done) and ends
+    with a `summary` line.
+
+    Args:
+        path (Optional[Union[Path, str]]): JSON Lines file to write. If None,
+            records are only kept in memory.
+        run (Optional[Dict[str, Any]]): Description of the run, e.g. options
+    """
+
+    def __init__(
+        self,
+        path: Optional[Union[Path, str]] = None,
+        run: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.records = []  # type: List[FileRecord]
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.file: Optional[IO[str]] = None
+        if path is not None:
+            self.file = open(str(path), "w")
+            self._write({"type": "run", "started": self.started, **(run or {})})
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        if self.file is not None:
+            self.file.write(json.dumps(entry, default=str) + "\n")
+            self.file.flush()
+
+    def add(self, record: FileRecord) -> None:
+        self.records.append(record)
+        self._write({"type": "file", **record._asdict()})
+
+    def summary(self) -> Dict[str, Any]:
+        """Per-stage p50/p95 and overall throughput of the run."""
+        return summarize(self.records, time.perf_counter() - self._start)
+
+    def format_summary(self) -> str:
+        """Summary as a plain text table."""
+        return format_summary(self.summary())
+
+    def close(self) -> None:
+        if self.file is not None:
+            self._write({"type": "summary", **self.summary()})
+            self.file.close()
+            self.file = None
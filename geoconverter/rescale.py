@@ -0,0 +1,463 @@
+"""Chunked NumPy rescaling engine for geoconverter
+
+An alternative to `gdal.Translate` with `scaleParams`. Block-aligned windows
+are read into preallocated buffers, scaled, clipped and cast in place and
+written straight to the outputs, so memory stays constant whatever the size of
+the raster and a single read feeds any number of outputs. The arithmetic
+follows GDAL's (scaling in single precision unless a 32/64-bit type is
+involved, clamping and rounding half away from zero), so both engines write
+the same pixels. The one difference is that nodata pixels keep the nodata
+value instead of being scaled like any other value.
+"""
+
+from functools import partial
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+from osgeo import gdal, gdal_array
+
+from geoconverter.defaults import DEFAULT_MAX_MEMORY
+from geoconverter.stats import iter_windows
+
+# Types for which GDAL scales in double instead of single precision
+FLOAT64_WORKING_TYPES = {"Int32", "UInt32", "Int64", "UInt64", "Float64"}
+
+# Bytes per pixel of the float64 and working buffers and the nodata mask
+BUFFER_BYTES = 8 + 4 + 1
+
+# Creation options of the scratch file for formats that cannot be written
+# block by block
+SCRATCH_OPTIONS = ["TILED=YES", "BIGTIFF=IF_SAFER"]
+
+# Share of the progress taken by writing the scratch file
+SCRATCH_SHARE = 0.5
+
+
+def scale_ratio(params: Sequence[float]) -> Tuple[float, float]:
+    """Ratio and offset of a linear scaling, as computed by gdal_translate.
+
+    Args:
+        params (Sequence[float]): Source min, source max, output min and
+            output max
+
+    Returns:
+        Tuple[float, float]: Ratio and offset
+    """
+    src_min, src_max, dst_min, dst_max = params
+    if src_max == src_min:
+        src_max += 0.1
+    if dst_max == dst_min:
+        dst_max += 0.1
+    ratio = (dst_max - dst_min) / (src_max - src_min)
+    return ratio, -1 * src_min * ratio + dst_min
+
+
+def numpy_dtype(name: str) -> np.dtype:
+    """NumPy dtype of a GDAL data type name."""
+    code = gdal_array.GDALTypeCodeToNumericTypeCode(gdal.GetDataTypeByName(name))
+    dtype = np.dtype(code)  # type: np.dtype
+    return dtype
+
+
+def output_nodata(nodata: float, outputType: str) -> float:
+    """Nodata value of the output, clamped and rounded to its data type."""
+    dtype = numpy_dtype(outputType)
+    if dtype.kind in "iu":
+        info = np.iinfo(dtype)
+        value = np.floor(np.nan_to_num(nodata) + 0.5)
+        return float(np.clip(value, info.min, info.max))
+    return float(dtype.type(nodata))
+
+
+class BandScaler:
+    """Scales windows of a band into buffers allocated once.
+
+    Args:
+        params (Sequence[float]): Source min, source max, output min and
+            output max
+        inputType (str): GDAL data type name of the band
+        outputType (str): GDAL data type name of the output
+        max_pixels (int): Size of the largest window in pixels
+        nodata (Optional[float]): Nodata value of the band. Its pixels are
+            written as `out_nodata`.
+        out_nodata (Optional[float]): Nodata value of the output
+    """
+
+    def __init__(
+        self,
+        params: Sequence[float],
+        inputType: str,
+        outputType: str,
+        max_pixels: int,
+        nodata: Optional[float] = None,
+        out_nodata: Optional[float] = None,
+    ) -> None:
+        self.ratio, self.offset = scale_ratio(params)
+        self.nodata = nodata
+        self.out_nodata = out_nodata
+        wide = bool(FLOAT64_WORKING_TYPES & {inputType, outputType})
+        self.dtype = numpy_dtype(outputType)
+        # The scaling itself is always done in double, as by GDAL, then
+        # rounded to the working precision
+        self._scaled = np.empty(max_pixels, dtype=np.float64)
+        self._work = self._scaled if wide else np.empty(max_pixels, dtype=np.float32)
+        self._out = np.empty(max_pixels, dtype=self.dtype)
+        self._mask = np.empty(max_pixels, dtype=bool)
+        if self.dtype.kind in "iu":
+            info = np.iinfo(self.dtype)  # type: Any
+        else:
+            info = np.finfo(self.dtype)
+        self.limits = (float(info.min), float(info.max))
+
+    def _view(self, buffer: np.ndarray, shape: Tuple[int, ...]) -> np.ndarray:
+        return buffer[: int(np.prod(shape))].reshape(shape)
+
+    def __call__(self, arr: np.ndarray) -> np.ndarray:
+        """Scale a window, returning a view of the output buffer."""
+        scaled = self._view(self._scaled, arr.shape)
+        np.multiply(arr, self.ratio, out=scaled, dtype=np.float64)
+        np.add(scaled, self.offset, out=scaled)
+        work = self._view(self._work, arr.shape)
+        if work is not scaled:
+            np.copyto(work, scaled, casting="same_kind")
+        out = self._view(self._out, arr.shape)
+        mask = self._view(self._mask, arr.shape)
+
+        if self.dtype.kind in "iu":
+            np.nan_to_num(work, copy=False)
+            np.clip(work, *self.limits, out=work)
+            # Round half away from zero, as GDALCopyWords does
+            np.greater_equal(work, 0, out=mask)
+            np.add(work, 0.5, out=work, where=mask)
+            np.invert(mask, out=mask)
+            np.subtract(work, 0.5, out=work, where=mask)
+        elif work.dtype.itemsize > self.dtype.itemsize:
+            np.clip(work, *self.limits, out=work)
+        np.copyto(out, work, casting="unsafe")
+
+        if self.nodata is not None and self.out_nodata is not None:
+            if np.isnan(self.nodata):
+                np.isnan(arr, out=mask)
+            else:
+                np.equal(arr, self.nodata, out=mask)
+            np.copyto(out, self.out_nodata, where=mask, casting="unsafe")
+        return out
+
+
+def _copy_metadata(
+    ds: gdal.Dataset,
+    out: gdal.Dataset,
+    bands: Sequence[int],
+    outputType: str,
+    factor: Tuple[float, float] = (1.0, 1.0),
+) -> List[Optional[float]]:
+    """Copy georeferencing and metadata like gdal_translate does.
+
+    Args:
+        ds (gdal.Dataset): Input dataset
+        out (gdal.Dataset): Output dataset
+        bands (Sequence[int]): 1-based input band of each output band
+        outputType (str): GDAL data type name of the output
+        factor (Tuple[float, float], optional): Input pixels per output pixel
+            along x and y
+
+    Returns:
+        List[Optional[float]]: Nodata value of each output band
+    """
+    fx, fy = factor
+    gt = ds.GetGeoTransform(can_return_null=True)
+    if gt is not None:
+        out.SetGeoTransform(
+            [gt[0], gt[1] * fx, gt[2] * fy, gt[3], gt[4] * fx, gt[5] * fy]
+        )
+    if ds.GetProjectionRef():
+        out.SetProjection(ds.GetProjectionRef())
+    if ds.GetGCPCount():
+        gcps = ds.GetGCPs()
+        for gcp in gcps:
+            gcp.GCPPixel /= fx
+            gcp.GCPLine /= fy
+        out.SetGCPs(gcps, ds.GetGCPProjection())
+    out.SetMetadata(ds.GetMetadata())
+
+    nodata = []
+    for i, b in enumerate(bands):
+        src, dst = ds.GetRasterBand(b), out.GetRasterBand(i + 1)
+        dst.SetColorInterpretation(src.GetColorInterpretation())
+        dst.SetDescription(src.GetDescription())
+        # Statistics of the input do not hold for the rescaled output
+        metadata = {
+            k: v
+            for k, v in src.GetMetadata().items()
+            if not k.startswith("STATISTICS_")
+        }
+        dst.SetMetadata(metadata)
+        value = src.GetNoDataValue()
+        if value is not None:
+            value = output_nodata(value, outputType)
+            dst.SetNoDataValue(value)
+        nodata.append(value)
+    return nodata
+
+
+def _nearest(size: int, out_size: int) -> np.ndarray:
+    """Input pixel sampled by each output pixel, as by GDAL's nearest."""
+    index = np.floor((np.arange(out_size) + 0.5) * (size / out_size))
+    nearest = np.minimum(index.astype(np.int64), size - 1)  # type: np.ndarray
+    return nearest
+
+
+class RescaleOutput(NamedTuple):
+    """An output of `rescale_many`.
+
+    `factor` resizes the output (nearest neighbour), e.g. 0.1 for a preview
+    a tenth of the size of the input. `creationOptions` are given to the
+    output's driver as `KEY=VALUE`.
+    """
+
+    destName: str
+    format: str
+    outputType: str
+    bands: List[int]
+    scaleParams: List[List[float]]
+    factor: float = 1.0
+    creationOptions: Sequence[str] = ()
+
+
+class _Target:
+    """Output being written window by window."""
+
+    def __init__(self, ds: gdal.Dataset, output: RescaleOutput, max_pixels: int):
+        driver = gdal.GetDriverByName(output.format)
+        if driver is None:
+            raise ValueError(f"Invalid output format {output.format}")
+        self.output = output
+        self.direct = driver.GetMetadataItem(gdal.DCAP_CREATE) == "YES"
+        self.path = output.destName if self.direct else f"{output.destName}.scratch.tif"
+        self.writer = driver if self.direct else gdal.GetDriverByName("GTiff")
+
+        width, height = ds.RasterXSize, ds.RasterYSize
+        xsize = max(int(round(width * output.factor)), 1)
+        ysize = max(int(round(height * output.factor)), 1)
+        self.cols = _nearest(width, xsize)
+        self.rows = _nearest(height, ysize)
+        self.ds = self.writer.Create(
+            self.path,
+            xsize,
+            ysize,
+            len(output.bands),
+            gdal.GetDataTypeByName(output.outputType),
+            options=list(output.creationOptions) if self.direct else SCRATCH_OPTIONS,
+        )
+        if self.ds is None:
+            raise RuntimeError(f"Unable to create {output.destName}")
+        nodata = _copy_metadata(
+            ds,
+            self.ds,
+            output.bands,
+            output.outputType,
+            (width / xsize, height / ysize),
+        )
+        self.scalers = [
+            BandScaler(
+                params,
+                gdal.GetDataTypeName(ds.GetRasterBand(b).DataType),
+                output.outputType,
+                max_pixels,
+                ds.GetRasterBand(b).GetNoDataValue(),
+                value,
+            )
+            for b, params, value in zip(output.bands, output.scaleParams, nodata)
+        ]
+
+    def write(
+        self, window: Tuple[int, int, int, int], arrays: Dict[int, np.ndarray]
+    ) -> None:
+        xoff, yoff, xsize, ysize = window
+        if self.output.factor == 1:
+            index = None  # type: Optional[Tuple[np.ndarray, ...]]
+            i0, j0 = yoff, xoff
+        else:
+            # Output pixels whose nearest input pixel lies in the window
+            i0, i1 = np.searchsorted(self.rows, [yoff, yoff + ysize])
+            j0, j1 = np.searchsorted(self.cols, [xoff, xoff + xsize])
+            if i0 == i1 or j0 == j1:
+                return
+            index = np.ix_(self.rows[i0:i1] - yoff, self.cols[j0:j1] - xoff)
+        for i, (b, scaler) in enumerate(zip(self.output.bands, self.scalers)):
+            arr = arrays[b] if index is None else arrays[b][index]
+            self.ds.GetRasterBand(i + 1).WriteArray(scaler(arr), int(j0), int(i0))
+
+    def finish(
+        self, callback: Optional[Callable[[float, str, Any], int]] = None
+    ) -> Optional[gdal.Dataset]:
+        if self.direct:
+            return self.ds
+        try:
+            return gdal.Translate(
+                destName=self.output.destName,
+                srcDS=self.ds,
+                options=gdal.TranslateOptions(
+                    format=self.output.format,
+                    creationOptions=list(self.output.creationOptions),
+                    callback=callback,
+                ),
+            )
+        finally:
+            self.discard()
+
+    def discard(self) -> None:
+        self.ds = None
+        if gdal.VSIStatL(self.path) is not None:
+            self.writer.Delete(self.path)
+
+
+def rescale_many(
+    ds: gdal.Dataset,
+    outputs: Sequence[RescaleOutput],
+    max_memory: int = DEFAULT_MAX_MEMORY,
+    callback: Optional[Callable[[float, str, Any], int]] = None,
+) -> List[Optional[gdal.Dataset]]:
+    """Rescale a raster into several outputs from a single read.
+
+    Every window of the bands used by any output is read once and handed to
+    all outputs, so the input is read once whatever the number of outputs.
+    Formats that cannot be written block by block (e.g. COG, PNG, JPEG) are
+    written to a tiled GTiff scratch file next to their destination first,
+    which is then copied into the format and removed.
+
+    Args:
+        ds (gdal.Dataset): Input dataset
+        outputs (Sequence[RescaleOutput]): Outputs to write
+        max_memory (int, optional): Memory budget for the buffers in bytes
+        callback (Optional[Callable[[float, str, Any], int]]): GDAL progress
+            callback. Returning 0 from it cancels the conversion.
+
+    Raises:
+        ValueError: if the format of an output is not a GDAL driver
+        RuntimeError: if an output cannot be created
+
+    Returns:
+        List[Optional[gdal.Dataset]]: Output datasets, all None if the
+            conversion was cancelled
+    """
+    bands = sorted({b for o in outputs for b in o.bands})
+    src_bands = {b: ds.GetRasterBand(b) for b in bands}
+    in_dtypes = {
+        b: numpy_dtype(gdal.GetDataTypeName(rb.DataType)) for b, rb in src_bands.items()
+    }
+    in_bytes = sum(d.itemsize for d in in_dtypes.values())
+    # Bytes held per pixel of a window: the input buffers and, for each output
+    # band, the buffers of its scaler
+    pixel_bytes = in_bytes + sum(
+        len(o.bands) * (numpy_dtype(o.outputType).itemsize + BUFFER_BYTES)
+        for o in outputs
+    )
+    # iter_windows budgets a window by the size of the input buffers only
+    windows = list(iter_windows(ds, bands, max_memory * in_bytes // pixel_bytes))
+    max_pixels = max(xsize * ysize for _, _, xsize, ysize in windows)
+    inputs = {b: np.empty(max_pixels, dtype=d) for b, d in in_dtypes.items()}
+
+    targets = []  # type: List[_Target]
+    try:
+        for output in outputs:
+            targets.append(_Target(ds, output, max_pixels))
+    except Exception:
+        for target in targets:
+            target.discard()
+        raise
+
+    copies = [t for t in targets if not t.direct]
+    share = SCRATCH_SHARE if copies else 1.0
+    for n, (xoff, yoff, xsize, ysize) in enumerate(windows):
+        arrays = {}
+        for b, rb in src_bands.items():
+            arr = inputs[b][: xsize * ysize].reshape(ysize, xsize)
+            arrays[b] = rb.ReadAsArray(xoff, yoff, xsize, ysize, buf_obj=arr)
+        for target in targets:
+            target.write((xoff, yoff, xsize, ysize), arrays)
+        if callback is not None and not callback(
+            share * (n + 1) / len(windows), "", None
+        ):
+            for target in targets:
+                target.discard()
+            return [None] * len(targets)
+
+    results = []
+    for target in targets:
+        progress = None
+        if callback is not None and not target.direct:
+            k = copies.index(target)
+            start = share + (1 - share) * k / len(copies)
+            progress = partial(
+                _sub_progress, callback, start, (1 - share) / len(copies)
+            )
+        results.append(target.finish(progress))
+    return results
+
+
+def _sub_progress(
+    callback: Callable[[float, str, Any], int],
+    start: float,
+    span: float,
+    fraction: float,
+    message: str,
+    data: Any,
+) -> int:
+    return callback(start + span * fraction, message, data)
+
+
+def rescale(
+    ds: gdal.Dataset,
+    destName: Union[Path, str],
+    outputFormat: str,
+    outputType: str,
+    bands: Sequence[int],
+    scaleParams: Sequence[Sequence[float]],
+    max_memory: int = DEFAULT_MAX_MEMORY,
+    callback: Optional[Callable[[float, str, Any], int]] = None,
+    creationOptions: Sequence[str] = (),
+) -> Optional[gdal.Dataset]:
+    """Rescale bands of a raster into a new raster, window by window.
+
+    Args:
+        ds (gdal.Dataset): Input dataset
+        destName (Union[Path, str]): Path to output raster
+        outputFormat (str): GDAL driver of the output
+        outputType (str): GDAL data type name of the output
+        bands (Sequence[int]): 1-based bands to export
+        scaleParams (Sequence[Sequence[float]]): Source min, source max,
+            output min and output max of each band, as for `gdal.Translate`
+        max_memory (int, optional): Memory budget for the buffers in bytes
+        callback (Optional[Callable[[float, str, Any], int]]): GDAL progress
+            callback. Returning 0 from it cancels the conversion.
+        creationOptions (Sequence[str]): Creation options of the output
+
+    Raises:
+        ValueError: if `outputFormat` is not a GDAL driver
+        RuntimeError: if the output cannot be created
+
+    Returns:
+        Optional[gdal.Dataset]: Output dataset, None if the conversion was
+            cancelled
+    """
+    output = RescaleOutput(
+        str(destName),
+        outputFormat,
+        outputType,
+        list(bands),
+        [list(p) for p in scaleParams],
+        creationOptions=creationOptions,
+    )
+    return rescale_many(ds, [output], max_memory, callback)[0]
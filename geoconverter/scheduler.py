@@ -0,0 +1,100 @@
+"""Memory-aware admission of concurrent conversions"""
+
+import os
+from argparse import Namespace
+from typing import Dict, Optional
+
+from geoconverter.stats import FLOAT_BINS, MAX_EXACT_BINS
+from geoconverter.utils import RasterInfo
+
+# Bytes per pixel of GDAL data types
+TYPE_SIZES: Dict[str, int] = {
+    "Byte": 1,
+    "Int8": 1,
+    "UInt16": 2,
+    "Int16": 2,
+    "UInt32": 4,
+    "Int32": 4,
+    "Float32": 4,
+    "UInt64": 8,
+    "Int64": 8,
+    "Float64": 8,
+    "CInt16": 4,
+    "CInt32": 8,
+    "CFloat32": 8,
+    "CFloat64": 16,
+}
+
+# Resident memory of a worker process with GDAL and NumPy loaded
+WORKER_OVERHEAD = 128 * 2**20
+
+
+def physical_memory() -> Optional[int]:
+    """Physical memory of the machine in bytes, if known."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def estimate_memory(info: RasterInfo, args: Namespace, cache_max: int) -> int:
+    """Estimate the peak memory of converting a raster from its metadata.
+
+    Adds up the worker process itself, the GDAL block cache, the windows
+    read for statistics or by the numpy engine (both bounded by
+    --stats-memory) and the histograms of a stretch. Each part is capped by
+    the size of the raster, so small files are cheap.
+
+    Args:
+        info (RasterInfo): Metadata of the raster
+        args (Namespace): Parsed CLI arguments
+        cache_max (int): GDAL block cache size of a worker in bytes
+
+    Returns:
+        int: Estimated peak memory in bytes
+    """
+    itemsize = TYPE_SIZES.get(info.dtype, 8)
+    raw = info.xsize * info.ysize * info.band_count * itemsize
+    need = WORKER_OVERHEAD + min(cache_max, raw)
+
+    stretch = args.subcommands == "stretch"
+    if stretch or getattr(args, "engine", "gdal") == "numpy":
+        # Windows hold every band read within the budget
+        need += min(args.stats_memory * 2**20, raw)
+    if stretch:
+        if info.dtype in ("Byte", "Int8", "UInt16", "Int16"):
+            bins = 2 ** (8 * itemsize)
+        elif info.dtype.startswith(("Int", "UInt")):
+            bins = MAX_EXACT_BINS
+        else:
+            bins = FLOAT_BINS
+        need += info.band_count * bins * 8
+    return need
+
+
+class MemoryBudget:
+    """Admits jobs while their estimated peak memory fits in a budget.
+
+    A job that does not fit next to the running ones waits for them to
+    finish. One that does not fit at all is admitted once nothing else is
+    running, so huge files run alone and small ones are packed together.
+
+    Args:
+        limit (int): Budget in bytes
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.used = 0
+        self.jobs = 0
+
+    def fits(self, need: int) -> bool:
+        return self.jobs == 0 or self.used + need <= self.limit
+
+    def acquire(self, need: int) -> None:
+        self.used += need
+        self.jobs += 1
+
+    def release(self, need: int) -> None:
+        self.used -= need
+        self.jobs -= 1
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+
+"""
+Local conversion service with a warm worker pool.
+
+Jobs are submitted as JSON over HTTP and converted by worker processes that
+have already imported GDAL, registered its drivers and loaded the PROJ
+database, so each job only pays for its own conversion.
+
+Usage:
+
+```console
+python geoconverter/service.py --port 8765 -j 8
+curl -X POST localhost:8765/jobs \\
+    -d '{"input": "a.tif", "format": "COG", "dtype": "Byte"}'
+curl localhost:8765/jobs/1
+curl localhost:8765/metrics
+```
+
+Job schema (all fields but `input` are optional):
+
+```json
+{
+    "input": "/data/in/a.tif",
+    "output": "/data/out/a.tif",
+    "format": "COG",
+    "dtype": "Byte",
+    "bands": [3, 2, 1],
+    "range": [0, 255],
+    "stretch": [2, 98],
+    "stats_mode": "exact",
+    "profile": "fast",
+    "priority": 0
+}
+```
+
+Without an `output`, a job writes next to its input, e.g. `/data/in/a_converted.tif`.
+
+Jobs with a higher priority run first, jobs of equal priority in order of
+submission.
+"""
+
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from argparse import ArgumentParser, Namespace
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from queue import Empty, PriorityQueue
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.request import Request, urlopen
+
+from osgeo import gdal, osr
+
+from geoconverter.gdal_convert import convert_file, get_args
+from geoconverter.profiles import thread_share
+from geoconverter.report import FileRecord, percentile
+from geoconverter.utils import archive_root, output_path, parse_files
+
+DEFAULT_PORT = 8765
+
+# Queued jobs beyond which submissions are refused
+DEFAULT_MAX_QUEUE = 10000
+
+# Finished jobs whose status can still be queried
+JOB_HISTORY = 10000
+
+# Finished jobs the throughput and latency metrics are computed over
+METRICS_WINDOW = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up() -> None:
+    """Worker initializer: register drivers and load the PROJ database."""
+    gdal.AllRegister()
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+
+
+def job_argv(job: Dict[str, Any], defaults: List[str]) -> List[str]:
+    """Translate a JSON job into `gdal_convert` command line arguments.
+
+    Args:
+        job (Dict[str, Any]): Job as submitted
+        defaults (List[str]): Arguments applied to every job, e.g. the
+            statistics cache of the service
+
+    Raises:
+        ValueError: if the job is malformed or its input is not a single file
+
+    Returns:
+        List[str]: Arguments for `get_args`
+    """
+    if not isinstance(job.get("input"), str):
+        raise ValueError("input is required")
+    if os.path.isdir(job["input"]) or archive_root(job["input"]) is not None:
+        # A job converts a single file, batches go through the CLI
+        raise ValueError("input must be a single raster, not a directory or archive")
+    argv = list(defaults) + ["-i", job["input"]]
+    if job.get("output"):
+        argv += ["-o", str(job["output"])]
+    for key, flag in (("format", "-of"), ("dtype", "-ot")):
+        if job.get(key):
+            argv += [flag, str(job[key])]
+    if job.get("stats_mode"):
+        argv += ["--stats-mode", str(job["stats_mode"])]
+    if job.get("engine"):
+        argv += ["--engine", str(job["engine"])]
+    if job.get("profile"):
+        argv += ["--profile", str(job["profile"])]
+    if job.get("bands"):
+        argv += ["-b", ",".join(str(int(b)) for b in job["bands"])]
+    if job.get("range"):
+        argv += ["-or"] + [str(float(v)) for v in job["range"]]
+    if job.get("stretch"):
+        argv += ["stretch", "-s"] + [str(float(v)) for v in job["stretch"]]
+    return argv
+
+
+def run_job(argv: List[str], threads: str = "ALL_CPUS") -> FileRecord:
+    """Convert the file of a job. Runs in a worker process.
+
+    Args:
+        argv (List[str]): Arguments of the job, from `job_argv`
+        threads (str, optional): Encoder threads of the job, see `thread_share`
+
+    Raises:
+        RuntimeError: if the conversion fails
+    """
+    args = Namespace(**{**vars(get_args(argv)), "threads": threads})
+    output = args.output
+    if not output:
+        # Named after the input, so jobs in one directory do not collide
+        inpath = Path(args.input)
+        output = str(output_path(inpath, inpath.parent, args.format))
+    entry, out = next(parse_files(args.input, output, args.format))
+    return convert_file(entry, out, args)
+
+
+class Job:
+    """A submitted conversion and its outcome."""
+
+    def __init__(self, id: int, argv: List[str], priority: int) -> None:
+        self.id = id
+        self.argv = argv
+        self.priority = priority
+        self.status = "queued"
+        self.submitted = time.time()
+        self.started = None  # type: Optional[float]
+        self.finished = None  # type: Optional[float]
+        self.record = None  # type: Optional[FileRecord]
+        self.error = None  # type: Optional[str]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "record": self.record._asdict() if self.record else None,
+            "error": self.error,
+        }
+
+
+class Service:
+    """Priority job queue feeding a warm pool of worker processes.
+
+    Args:
+        workers (int): Number of worker processes
+        max_running (int): Jobs converted at once, at most `workers`
+        max_queue (int, optional): Queued jobs beyond which submissions fail
+        defaults (Optional[List[str]]): CLI arguments applied to every job
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_running: int,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        defaults: Optional[List[str]] = None,
+    ) -> None:
+        self.defaults = defaults or []
+        self.max_queue = max_queue
+        self.queue: PriorityQueue[Tuple[int, int, Job]] = PriorityQueue()
+        self.jobs = OrderedDict()  # type: OrderedDict[int, Job]
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.slots = threading.Semaphore(min(max_running, workers))
+        # Encoder threads are shared out between the jobs running at once
+        self.threads = thread_share(min(max_running, workers))
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.recent: Deque[Job] = deque(maxlen=METRICS_WINDOW)
+        self.started = time.time()
+        self.stopping = threading.Event()
+
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=warm_up)
+        # Start every worker now rather than on the first jobs
+        for future in [self.pool.submit(time.sleep, 0.1) for _ in range(workers)]:
+            future.result()
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, job: Dict[str, Any]) -> Job:
+        """Queue a JSON job.
+
+        Raises:
+            ValueError: if the job is malformed
+            OverflowError: if the queue is full
+        """
+        argv = job_argv(job, self.defaults)
+        try:
+            get_args(argv)
+        except SystemExit:
+            raise ValueError(f"Invalid job options: {' '.join(argv)}")
+        if self.queue.qsize() >= self.max_queue:
+            raise OverflowError("Queue is full")
+        with self.lock:
+            queued = Job(next(self.ids), argv, int(job.get("priority", 0)))
+            self.jobs[queued.id] = queued
+            self._forget()
+        self.queue.put((-queued.priority, queued.id, queued))
+        return queued
+
+    def cancel(self, id: int) -> bool:
+        """Cancel a job that has not started yet."""
+        with self.lock:
+            job = self.jobs.get(id)
+            if job is None or job.status != "queued":
+                return False
+            job.status = "cancelled"
+            job.finished = time.time()
+        return True
+
+    def _forget(self) -> None:
+        # Drop the oldest finished jobs, queued and running ones are kept
+        excess = len(self.jobs) - JOB_HISTORY
+        if excess <= 0:
+            return
+        for id in [i for i, j in self.jobs.items() if j.finished][:excess]:
+            del self.jobs[id]
+
+    def _dispatch(self) -> None:
+        while not self.stopping.is_set():
+            if not self.slots.acquire(timeout=0.5):
+                continue
+            try:
+                _, _, job = self.queue.get(timeout=0.5)
+            except Empty:
+                self.slots.release()
+                continue
+            with self.lock:
+                if job.status != "queued":
+                    self.slots.release()
+                    continue
+                job.status = "running"
+                job.started = time.time()
+                self.running += 1
+            future = self.pool.submit(run_job, job.argv, self.threads)
+            future.add_done_callback(partial(self._finish, job))
+
+    def _finish(self, job: Job, future: "Future[FileRecord]") -> None:
+        with self.lock:
+            try:
+                job.record = future.result()
+                job.status = "done"
+                self.completed += 1
+            except Exception as exc:
+                job.error = str(exc)
+                job.status = "failed"
+                self.failed += 1
+                logger.error("Job %d failed: %s", job.id, exc)
+            job.finished = time.time()
+            self.running -= 1
+            self.recent.append(job)
+        self.slots.release()
+
+    def status(self, id: int) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            job = self.jobs.get(id)
+            return job.to_dict() if job else None
+
+    def metrics(self) -> Dict[str, Any]:
+        """Queue depth, counts, latencies and throughput of recent jobs."""
+        with self.lock:
+            recent = [j for j in self.recent if j.record is not None]
+            queued = [j for j in self.jobs.values() if j.status == "queued"]
+            by_priority = {}  # type: Dict[int, int]
+            for job in queued:
+                by_priority[job.priority] = by_priority.get(job.priority, 0) + 1
+            running, completed, failed = self.running, self.completed, self.failed
+
+        now = time.time()
+        span = now - min((j.started or now for j in recent), default=now)
+        input_bytes = sum(j.record.input_bytes for j in recent if j.record)
+        waits = [(j.started or 0) - j.submitted for j in recent]
+        latencies = [(j.finished or 0) - j.submitted for j in recent]
+        return {
+            "uptime": now - self.started,
+            "queued": len(queued),
+            "queued_by_priority": by_priority,
+            "running": running,
+            "completed": completed,
+            "failed": failed,
+            "recent": {
+                "jobs": len(recent),
+                "files_per_s": len(recent) / span if span > 0 else 0.0,
+                "mb_per_s": input_bytes / 2**20 / span if span > 0 else 0.0,
+                "wait_p50": percentile(waits, 50),
+                "wait_p95": percentile(waits, 95),
+                "latency_p50": percentile(latencies, 50),
+                "latency_p95": percentile(latencies, 95),
+            },
+        }
+
+    def shutdown(self) -> None:
+        self.stopping.set()
+        self.dispatcher.join()
+        self.pool.shutdown(wait=True)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """JSON API of a `Service`."""
+
+    service: Service
+
+    def _send(self, code: int, body: Any) -> None:
+        data = json.dumps(body, default=str).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _job_id(self) -> Optional[int]:
+        parts = self.path.rstrip("/").split("/")
+        if len(parts) == 3 and parts[1] == "jobs" and parts[2].isdigit():
+            return int(parts[2])
+        return None
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") == "/metrics":
+            self._send(200, self.service.metrics())
+            return
+        id = self._job_id()
+        status = self.service.status(id) if id is not None else None
+        if status is None:
+            self._send(404, {"error": "Not found"})
+        else:
+            self._send(200, status)
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") != "/jobs":
+            self._send(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = self.service.submit(json.loads(self.rfile.read(length)))
+        except OverflowError as exc:
+            self._send(503, {"error": str(exc)})
+        except (ValueError, TypeError, AttributeError) as exc:
+            self._send(400, {"error": str(exc)})
+        else:
+            self._send(202, job.to_dict())
+
+    def do_DELETE(self) -> None:
+        id = self._job_id()
+        if id is not None and self.service.cancel(id):
+            self._send(200, {"id": id, "status": "cancelled"})
+        else:
+            self._send(409, {"error": "Job is not queued"})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(format, *args)
+
+
+def submit(job: Dict[str, Any], url: str = f"http://127.0.0.1:{DEFAULT_PORT}") -> int:
+    """Submit a job to a running service.
+
+    Args:
+        job (Dict[str, Any]): Job, see the module docstring for the schema
+        url (str, optional): Service address
+
+    Returns:
+        int: Job id
+    """
+    request = Request(
+        f"{url}/jobs",
+        data=json.dumps(job).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urlopen(request) as response:
+        return int(json.loads(response.read())["id"])
+
+
+def get_service_args() -> Namespace:
+    parser = ArgumentParser(description="Conversion service")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=0,
+        help="number of worker processes (0 uses all cores)",
+    )
+    parser.add_argument(
+        "--max-running",
+        type=int,
+        help="jobs converted at once (defaults to the number of workers)",
+    )
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=DEFAULT_MAX_QUEUE,
+        help="queued jobs beyond which submissions are refused",
+    )
+    parser.add_argument(
+        "--stats-cache", metavar="DIR", help="statistics cache shared by all jobs"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    args = get_service_args()
+    workers = args.jobs or os.cpu_count() or 1
+    defaults = []
+    if args.stats_cache:
+        defaults = ["--stats-cache", "--stats-cache-dir", args.stats_cache]
+    Handler.service = Service(
+        workers, args.max_running or workers, args.max_queue, defaults
+    )
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    logger.info("Serving on %s:%d with %d workers", args.host, args.port, workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        Handler.service.shutdown()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+"""
+Splits batch conversions across machines and merges their results.
+
+Every machine discovers the same files and deterministically assigns them to
+shards, balancing the number of pixels rather than the number of files. Run
+`gdal_convert.py` with `--shard I/N` on each machine, then merge the per-shard
+manifests and reports.
+
+Usage:
+
+```console
+python geoconverter/gdal_convert.py -i /shared/in/ -o /shared/out/ -of COG --shard 1/4
+python geoconverter/gdal_convert.py -i /shared/in/ -o /shared/out/ -of COG --shard 2/4
+...
+python geoconverter/shards.py -o /shared/out/ --shards 4
+```
+"""
+
+import heapq
+import json
+import logging
+import sys
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from geoconverter.report import format_summary, read_report, summarize
+from geoconverter.utils import probe
+
+# Manifest and report written by a shard unless given explicitly
+DEFAULT_MANIFEST = "manifest.jsonl"
+DEFAULT_REPORT = "report.jsonl"
+
+logger = logging.getLogger(__name__)
+
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """Parse a shard given as `I/N`, with I counted from 1.
+
+    Raises:
+        ArgumentTypeError: if the shard is malformed
+    """
+    index, sep, count = text.partition("/")
+    try:
+        shard = int(index), int(count)
+    except ValueError:
+        shard = (0, 0)
+    if not sep or not 1 <= shard[0] <= shard[1]:
+        raise ArgumentTypeError(f"Expected I/N with 1 <= I <= N, got {text!r}")
+    return shard
+
+
+def shard_path(path: Union[Path, str], index: int, count: int) -> Path:
+    """Per-shard variant of a manifest or report path.
+
+    Args:
+        path (Union[Path, str]): Path shared by all shards
+        index (int): 1-based shard index
+        count (int): Number of shards
+
+    Returns:
+        Path: e.g. `manifest.shard-2-of-4.jsonl` for `manifest.jsonl`
+    """
+    path = Path(path)
+    return path.with_name(f"{path.stem}.shard-{index}-of-{count}{path.suffix}")
+
+
+def assign_shards(weights: Sequence[int], count: int) -> List[int]:
+    """Balance weighted items over shards, heaviest first.
+
+    Each item goes to the shard with the least weight so far (ties go to the
+    lowest shard), so the result only depends on the weights and their order.
+
+    Args:
+        weights (Sequence[int]): Weight of each item
+        count (int): Number of shards
+
+    Returns:
+        List[int]: 0-based shard of each item
+    """
+    loads = [(0, s) for s in range(count)]
+    shards = [0] * len(weights)
+    for i in sorted(range(len(weights)), key=lambda i: (-weights[i], i)):
+        load, s = heapq.heappop(loads)
+        shards[i] = s
+        heapq.heappush(loads, (load + weights[i], s))
+    return shards
+
+
+def pixel_count(input: Path) -> int:
+    """Number of samples in a raster, 0 if it cannot be opened."""
+    try:
+        info = probe(input)
+    except RuntimeError:
+        return 0
+    return info.xsize * info.ysize * info.band_count
+
+
+def select_shard(
+    pairs: Iterable[Tuple[Path, Path]], index: int, count: int
+) -> List[Tuple[Path, Path]]:
+    """Input and output pairs of a shard.
+
+    Pairs are sorted by input path first, so every machine computes the same
+    shards whatever order its filesystem lists them in.
+
+    Args:
+        pairs (Iterable[Tuple[Path, Path]]): All input and output rasters
+        index (int): 1-based shard index
+        count (int): Number of shards
+
+    Returns:
+        List[Tuple[Path, Path]]: Pairs of the shard
+    """
+    ordered = sorted(pairs, key=lambda pair: str(pair[0]))
+    shards = assign_shards([pixel_count(entry) for entry, _ in ordered], count)
+    return [pair for pair, s in zip(ordered, shards) if s == index - 1]
+
+
+def _manifest_entries(path: Path) -> Dict[str, Dict[str, Any]]:
+    entries = {}  # type: Dict[str, Dict[str, Any]]
+    with open(str(path)) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries[entry["input"]] = entry
+    return entries
+
+
+def merge_shards(
+    manifest: Union[Path, str], report: Union[Path, str], count: int
+) -> List[str]:
+    """Verify that all shards finished and merge their manifests and reports.
+
+    Every shard must have finished its run and have every input assigned to
+    it recorded in its manifest. Only then are the shard manifests combined
+    into `manifest` and the shard reports into `report`. The merged summary
+    uses the longest shard's wall time, as the shards ran side by side.
+
+    Args:
+        manifest (Union[Path, str]): Manifest path shared by the shards
+        report (Union[Path, str]): Report path shared by the shards
+        count (int): Number of shards
+
+    Returns:
+        List[str]: Problems found, nothing is written unless it is empty
+    """
+    problems = []
+    runs = []
+    records = []
+    walls = []
+    entries = {}  # type: Dict[str, Dict[str, Any]]
+    for index in range(1, count + 1):
+        shard_report = shard_path(report, index, count)
+        shard_manifest = shard_path(manifest, index, count)
+        if not shard_report.exists() or not shard_manifest.exists():
+            problems.append(f"shard {index}: missing {shard_report} or manifest")
+            continue
+        run, shard_records, summary = read_report(shard_report)
+        if summary is None:
+            problems.append(f"shard {index}: run did not finish")
+            continue
+        recorded = _manifest_entries(shard_manifest)
+        for input in run.get("shard", {}).get("inputs", []):
+            if input not in recorded:
+                problems.append(f"shard {index}: {input} was not converted")
+        runs.append(run)
+        records += shard_records
+        walls.append(summary["wall"])
+        entries.update(recorded)
+    if problems:
+        return problems
+
+    with open(str(manifest), "w") as f:
+        for entry in entries.values():
+            f.write(json.dumps(entry) + "\n")
+    merged = {
+        "type": "run",
+        "started": min(run["started"] for run in runs),
+        "shards": count,
+        "args": runs[0].get("args"),
+    }  # type: Dict[str, Any]
+    with open(str(report), "w") as f:
+        f.write(json.dumps(merged, default=str) + "\n")
+        for record in records:
+            f.write(json.dumps({"type": "file", **record._asdict()}) + "\n")
+        summary = summarize(records, max(walls))
+        f.write(json.dumps({"type": "summary", **summary}) + "\n")
+    logger.info(format_summary(summary))
+    return []
+
+
+def get_args(argv: Optional[List[str]] = None) -> Namespace:
+    parser = ArgumentParser(description="Merge the results of sharded runs")
+    parser.add_argument(
+        "-o", "--output", help="output directory of the runs (for default paths)"
+    )
+    parser.add_argument("--manifest", metavar="JSONL", help="manifest of the runs")
+    parser.add_argument("--report", metavar="JSONL", help="report of the runs")
+    parser.add_argument("--shards", type=int, required=True, help="number of shards")
+    args = parser.parse_args(argv)
+    if not args.output and not (args.manifest and args.report):
+        parser.error("-o is required unless --manifest and --report are given")
+    return args
+
+
+def main(args: Namespace) -> int:
+    manifest = args.manifest or Path(args.output) / DEFAULT_MANIFEST
+    report = args.report or Path(args.output) / DEFAULT_REPORT
+    problems = merge_shards(manifest, report, args.shards)
+    for problem in problems:
+        logger.error(problem)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main(get_args()))
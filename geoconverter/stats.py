@@ -0,0 +1,888 @@
+"""Streaming band statistics for geoconverter"""
+
+import struct
+import zlib
+from functools import partial
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+import numpy as np
+from osgeo import gdal
+
+from geoconverter.defaults import DEFAULT_MAX_MEMORY, DEFAULT_SAMPLE_BLOCKS, STATS_MODES
+
+# Integer types whose whole value range can be histogrammed exactly up front
+SMALL_INT_RANGE = {
+    "Byte": (0, 255),
+    "Int8": (-128, 127),
+    "UInt16": (0, 65535),
+    "Int16": (-32768, 32767),
+}  # type: Dict[str, Tuple[int, int]]
+
+INT_TYPES = {"Byte", "Int8", "UInt16", "Int16", "UInt32", "Int32", "UInt64", "Int64"}
+
+# Largest unit-width histogram built for wide integer types
+MAX_EXACT_BINS = 1 << 20
+
+# Number of bins used for float (and very wide integer) histograms
+FLOAT_BINS = 1 << 16
+
+# Upper bound on refinement passes before falling back to interpolation
+MAX_REFINE_PASSES = 4
+
+# Smallest overview (in pixels) considered in overview mode
+MIN_OVERVIEW_PIXELS = 512 * 512
+
+# Two-sided 95% quantile of the standard normal distribution
+Z_95 = 1.96
+
+_RankFn = Callable[[int], float]
+
+# Serialised histogram header: vmin, vmax, nbins, exact
+_HEADER = "<ddq?"
+
+# Bounds of a bracket: lower edge, upper edge and whether the upper is included
+BracketBounds = Tuple[float, float, bool]
+
+# Histogram of the values in a bracket, with the smallest and largest of them
+BracketHistogram = Tuple["Histogram", float, float]
+
+
+class Histogram:
+    """Fixed-width histogram over the closed interval [vmin, vmax].
+
+    Integer histograms use unit-width bins and yield exact percentiles. Float
+    histograms only locate a value to within a bin; see `band_percentiles` for
+    how those bins are refined to get exact results.
+    """
+
+    def __init__(
+        self,
+        vmin: float,
+        vmax: float,
+        nbins: int,
+        exact: bool = False,
+        counts: Optional[np.ndarray] = None,
+    ) -> None:
+        if vmax <= vmin:
+            vmax, nbins = vmin, 1
+        elif not exact:
+            nbins = min(nbins, _max_bins(vmin, vmax))
+        self.vmin = float(vmin)
+        self.vmax = float(vmax)
+        self.nbins = int(nbins)
+        self.exact = exact
+        self.counts = np.zeros(self.nbins, dtype=np.int64) if counts is None else counts
+
+    @classmethod
+    def for_integers(cls, vmin: int, vmax: int) -> "Histogram":
+        return cls(vmin, vmax, int(vmax) - int(vmin) + 1, exact=True)
+
+    def empty_like(self) -> "Histogram":
+        """Histogram with the same bins and no counts."""
+        return Histogram(self.vmin, self.vmax, self.nbins, self.exact)
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def edges(self, index: int) -> Tuple[float, float]:
+        """Lower and upper edge of bin `index`, as used by `np.histogram`."""
+        if self.exact:
+            return self.vmin + index, self.vmin + index
+        if self.nbins == 1:
+            return self.vmin, self.vmax
+        edges = np.linspace(self.vmin, self.vmax, self.nbins + 1)
+        return float(edges[index]), float(edges[index + 1])
+
+    def update(self, values: np.ndarray) -> None:
+        values = values.ravel()
+        if self.exact:
+            if values.dtype.kind not in "iu":
+                values = values[np.isfinite(values)]
+            values = values[(values >= self.vmin) & (values <= self.vmax)]
+            idx = values.astype(np.int64) - int(self.vmin)
+            self.counts += np.bincount(idx, minlength=self.nbins)
+        elif self.vmin == self.vmax:
+            self.counts[0] += np.count_nonzero(values == self.vmin)
+        else:
+            # Bins are sized from float64 spacing, which narrower types
+            # cannot resolve
+            counts, _ = np.histogram(
+                values.astype(np.float64, copy=False),
+                bins=self.nbins,
+                range=(self.vmin, self.vmax),
+            )
+            self.counts += counts
+
+    def merge(self, other: "Histogram") -> "Histogram":
+        if (self.vmin, self.vmax, self.nbins, self.exact) != (
+            other.vmin,
+            other.vmax,
+            other.nbins,
+            other.exact,
+        ):
+            raise ValueError("Cannot merge histograms with different bins")
+        return Histogram(
+            self.vmin, self.vmax, self.nbins, self.exact, self.counts + other.counts
+        )
+
+    def locate(self, rank: int) -> Tuple[int, int]:
+        """Find the bin holding the value of 0-based `rank`.
+
+        Returns:
+            Tuple[int, int]: Bin index and number of values in preceding bins
+        """
+        cum = np.cumsum(self.counts)
+        index = int(np.searchsorted(cum, rank, side="right"))
+        return index, int(cum[index] - self.counts[index])
+
+    def value_at(self, rank: int) -> float:
+        """Value of the 0-based `rank` (interpolated within a bin for floats)."""
+        index, below = self.locate(rank)
+        lo, hi = self.edges(index)
+        if self.exact or lo == hi:
+            return lo
+        return lo + (rank - below + 0.5) / int(self.counts[index]) * (hi - lo)
+
+    def percentile(self, q: float) -> float:
+        return _interpolate(self.value_at, self.total, q)
+
+    def to_bytes(self) -> bytes:
+        header = struct.pack(_HEADER, self.vmin, self.vmax, self.nbins, self.exact)
+        return header + zlib.compress(self.counts.astype("<i8").tobytes())
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Histogram":
+        size = struct.calcsize(_HEADER)
+        vmin, vmax, nbins, exact = struct.unpack(_HEADER, data[:size])
+        counts = np.frombuffer(zlib.decompress(data[size:]), dtype="<i8")
+        return cls(vmin, vmax, nbins, exact, counts.astype(np.int64))
+
+
+class BandStats(NamedTuple):
+    """Statistics of a single band. Missing values are None."""
+
+    min: Optional[float] = None
+    max: Optional[float] = None
+    mean: Optional[float] = None
+    std: Optional[float] = None
+    percentiles: Dict[float, float] = {}
+    histogram: Optional[Histogram] = None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Cached percentile, or one derived from an exact histogram."""
+        if q in self.percentiles:
+            return self.percentiles[q]
+        if self.histogram is not None and self.histogram.exact:
+            return self.histogram.percentile(q)
+        return None
+
+
+def _max_bins(vmin: float, vmax: float) -> int:
+    """Number of distinct float bins that fit between vmin and vmax."""
+    spacing = float(np.spacing(max(abs(vmin), abs(vmax))))
+    return max(int((vmax - vmin) / spacing) // 2, 1)
+
+
+def _interpolate(value_at: _RankFn, n: int, q: float) -> float:
+    """Linear percentile interpolation, mirroring `np.percentile`."""
+    if n == 0:
+        return float("nan")
+    position = (n - 1) * (q / 100)
+    k = int(np.floor(position))
+    gamma = position - k
+    a = value_at(k)
+    if gamma == 0 or k + 1 >= n:
+        return a
+    b = value_at(k + 1)
+    diff = b - a
+    return b - diff * (1 - gamma) if gamma >= 0.5 else a + diff * gamma
+
+
+def _windows(
+    bands: Sequence[gdal.Band], max_memory: int
+) -> Iterator[Tuple[int, int, int, int]]:
+    band = bands[0]
+    bx, by = band.GetBlockSize()
+    # A window is read from every band at once
+    pixel_bytes = sum(max(gdal.GetDataTypeSize(b.DataType) // 8, 1) for b in bands)
+    max_pixels = max(max_memory // pixel_bytes, bx * by)
+    width, height = band.XSize, band.YSize
+
+    if width * by <= max_pixels:
+        win_w, win_h = width, max(by, (max_pixels // width) // by * by)
+    else:
+        win_w, win_h = max(bx, (max_pixels // by) // bx * bx), by
+
+    for yoff in range(0, height, win_h):
+        ysize = min(win_h, height - yoff)
+        for xoff in range(0, width, win_w):
+            yield xoff, yoff, min(win_w, width - xoff), ysize
+
+
+def iter_windows(
+    ds: gdal.Dataset, bands: Sequence[int], max_memory: int = DEFAULT_MAX_MEMORY
+) -> Iterator[Tuple[int, int, int, int]]:
+    """Yield block-aligned (xoff, yoff, xsize, ysize) windows covering `ds`.
+
+    Windows span whole block rows where possible and hold at most
+    `max_memory` bytes across all of `bands`.
+
+    Args:
+        ds (gdal.Dataset): Raster dataset
+        bands (Sequence[int]): 1-based band indices to be read
+        max_memory (int, optional): Memory budget for a window in bytes.
+
+    Yields:
+        Tuple[int, int, int, int]: Window offsets and sizes
+    """
+    return _windows([ds.GetRasterBand(b) for b in bands], max_memory)
+
+
+class BlockSource:
+    """Re-iterable reader of the same windows from a set of bands.
+
+    Every statistics pass iterates over a source, which decides what is read:
+    the full raster, one of its overviews or a sample of its blocks.
+
+    Args:
+        bands (List[gdal.Band]): Bands (or overview bands) to be read
+        max_memory (int, optional): Memory budget for a window of all bands in
+            bytes.
+        windows (Optional[List[Tuple[int, int, int, int]]]): Windows to be
+            read. Defaults to block-aligned windows covering the bands.
+        skip_nodata (bool, optional): Leave out the nodata pixels of each
+            band, which turns every window into a flat array of valid pixels.
+    """
+
+    def __init__(
+        self,
+        bands: List[gdal.Band],
+        max_memory: int = DEFAULT_MAX_MEMORY,
+        windows: Optional[List[Tuple[int, int, int, int]]] = None,
+        skip_nodata: bool = False,
+    ) -> None:
+        self.bands = bands
+        self.windows = list(_windows(bands, max_memory)) if windows is None else windows
+        self.skip_nodata = skip_nodata
+        self.nodata = [
+            b.GetNoDataValue() if skip_nodata else None for b in bands
+        ]  # type: List[Optional[float]]
+
+    @property
+    def pixels(self) -> int:
+        """Number of pixels read per band in a pass."""
+        return sum(xsize * ysize for _, _, xsize, ysize in self.windows)
+
+    def subset(self, indices: Sequence[int]) -> "BlockSource":
+        return BlockSource(
+            [self.bands[i] for i in indices],
+            windows=self.windows,
+            skip_nodata=self.skip_nodata,
+        )
+
+    def __iter__(self) -> Iterator[List[np.ndarray]]:
+        for xoff, yoff, xsize, ysize in self.windows:
+            arrays = [b.ReadAsArray(xoff, yoff, xsize, ysize) for b in self.bands]
+            if self.skip_nodata:
+                arrays = [_valid(a, nd) for a, nd in zip(arrays, self.nodata)]
+            yield arrays
+
+
+def _valid(arr: np.ndarray, nodata: Optional[float]) -> np.ndarray:
+    """Pixels of `arr` that are not nodata."""
+    if nodata is None:
+        return arr
+    keep = ~np.isnan(arr) if np.isnan(nodata) else arr != nodata
+    valid = arr[keep]  # type: np.ndarray
+    return valid
+
+
+def _raster_bands(ds: gdal.Dataset, bands: Optional[Sequence[int]]) -> List[gdal.Band]:
+    return [ds.GetRasterBand(b) for b in bands or range(1, ds.RasterCount + 1)]
+
+
+def iter_blocks(
+    ds: gdal.Dataset, bands: Sequence[int], max_memory: int = DEFAULT_MAX_MEMORY
+) -> Iterator[List[np.ndarray]]:
+    """Yield one array per band for every window of `iter_windows`."""
+    return iter(BlockSource(_raster_bands(ds, bands), max_memory))
+
+
+def _min_max(source: BlockSource) -> List[Tuple[float, float]]:
+    """Min/max of every pixel read (including nodata), ignoring NaNs."""
+    vmin = [np.inf] * len(source.bands)
+    vmax = [-np.inf] * len(source.bands)
+    for arrays in source:
+        for i, arr in enumerate(arrays):
+            if arr.dtype.kind == "f":
+                arr = arr[np.isfinite(arr)]
+            if arr.size == 0:
+                continue
+            vmin[i] = min(vmin[i], float(arr.min()))
+            vmax[i] = max(vmax[i], float(arr.max()))
+    return list(zip(vmin, vmax))
+
+
+def empty_histogram(
+    name: str, vmin: Optional[float] = None, vmax: Optional[float] = None
+) -> Histogram:
+    """Empty histogram suited to values of a data type within [vmin, vmax].
+
+    Args:
+        name (str): GDAL data type name
+        vmin (Optional[float]): Smallest value. Not needed for small integer
+            types, whose whole range is covered.
+        vmax (Optional[float]): Largest value
+
+    Returns:
+        Histogram: Exact for integers when the range allows it
+    """
+    if name in SMALL_INT_RANGE:
+        return Histogram.for_integers(*SMALL_INT_RANGE[name])
+    if vmin is None or vmax is None or not np.isfinite(vmin):
+        return Histogram(0.0, 0.0, 1)
+    if name in INT_TYPES and vmax - vmin < MAX_EXACT_BINS:
+        return Histogram.for_integers(int(vmin), int(vmax))
+    return Histogram(vmin, vmax, FLOAT_BINS)
+
+
+def common_histogram(names: Sequence[str], vmin: float, vmax: float) -> Histogram:
+    """Empty histogram covering bands of several rasters, so they can be merged.
+
+    Args:
+        names (Sequence[str]): GDAL data type names of the bands
+        vmin (float): Smallest value over all bands
+        vmax (float): Largest value over all bands
+
+    Returns:
+        Histogram: Exact if all bands are integers and the range allows it
+    """
+    types = set(names)
+    if len(types) == 1:
+        return empty_histogram(types.pop(), vmin, vmax)
+    return empty_histogram("Int64" if types <= INT_TYPES else "Float64", vmin, vmax)
+
+
+def value_range(
+    ds: gdal.Dataset, band: int, max_memory: int, skip_nodata: bool = False
+) -> Tuple[float, float]:
+    """Range of values a histogram of `band` has to cover.
+
+    Small integer types cover their whole range without reading the band.
+    Nodata pixels count unless `skip_nodata` is set.
+    """
+    rb = ds.GetRasterBand(band)
+    name = gdal.GetDataTypeName(rb.DataType)
+    if name in SMALL_INT_RANGE:
+        lo, hi = SMALL_INT_RANGE[name]
+        return float(lo), float(hi)
+    return _min_max(BlockSource([rb], max_memory, skip_nodata=skip_nodata))[0]
+
+
+def band_histograms(
+    ds: gdal.Dataset,
+    bands: Optional[Sequence[int]] = None,
+    max_memory: int = DEFAULT_MAX_MEMORY,
+    source: Optional[BlockSource] = None,
+    templates: Optional[Sequence[Histogram]] = None,
+) -> List[Histogram]:
+    """Build a histogram for each band in a single streaming pass.
+
+    Small integer types get exact histograms over the full dtype range. Wider
+    integer types get exact histograms over their actual range when it fits in
+    `MAX_EXACT_BINS`, anything else gets `FLOAT_BINS` bins. Both of those need
+    an extra min/max pass.
+
+    Args:
+        ds (gdal.Dataset): Raster dataset
+        bands (Optional[Sequence[int]]): 1-based band indices. Defaults to all bands.
+        max_memory (int, optional): Memory budget for a window in bytes.
+        source (Optional[BlockSource]): What to read, overrides `bands` and
+            `max_memory`. Defaults to every pixel of `bands`.
+        templates (Optional[Sequence[Histogram]]): Bins to use for each band,
+            e.g. common bins of several rasters so that their histograms can
+            be merged. Skips the min/max pass.
+
+    Returns:
+        List[Histogram]: One histogram per band
+    """
+    if source is None:
+        source = BlockSource(_raster_bands(ds, bands), max_memory)
+    names = [gdal.GetDataTypeName(b.DataType) for b in source.bands]
+
+    if templates is not None:
+        result = [t.empty_like() for t in templates]
+    else:
+        hists = [None] * len(names)  # type: List[Optional[Histogram]]
+        pending = []
+        for i, name in enumerate(names):
+            if name in SMALL_INT_RANGE:
+                hists[i] = empty_histogram(name)
+            else:
+                pending.append(i)
+
+        if pending:
+            ranges = _min_max(source.subset(pending))
+            for i, (vmin, vmax) in zip(pending, ranges):
+                hists[i] = empty_histogram(names[i], vmin, vmax)
+
+        result = [h for h in hists if h is not None]
+    for arrays in source:
+        for hist, arr in zip(result, arrays):
+            hist.update(arr)
+    return result
+
+
+class _Bracket:
+    """Value interval known to contain the value of some ranks."""
+
+    def __init__(self, lo: float, hi: float, last: bool, below: int, count: int):
+        self.lo = lo
+        self.hi = hi
+        self.last = last  # whether `hi` is included
+        self.below = below
+        self.count = count
+        self.hist = None  # type: Optional[Histogram]
+        self.values = []  # type: List[np.ndarray]
+        self.seen = (np.inf, -np.inf)
+
+    def observe(self, values: np.ndarray) -> None:
+        if values.size:
+            lo, hi = self.seen
+            self.seen = (min(lo, float(values.min())), max(hi, float(values.max())))
+
+    def select(self, arr: np.ndarray) -> np.ndarray:
+        arr = arr.ravel()
+        if arr.dtype.kind == "f":
+            # Edges are float64, narrower types would round them
+            arr = arr.astype(np.float64, copy=False)
+        upper = arr <= self.hi if self.last else arr < self.hi
+        return arr[(arr >= self.lo) & upper]
+
+
+def _bracket(hist: Histogram, rank: int, last: bool = True) -> _Bracket:
+    index, below = hist.locate(rank)
+    lo, hi = hist.edges(index)
+    return _Bracket(
+        lo, hi, last and index == hist.nbins - 1, below, int(hist.counts[index])
+    )
+
+
+def _rank_brackets(
+    hists: Sequence[Histogram], percentiles: Sequence[float]
+) -> List[Dict[int, _Bracket]]:
+    """Ranks each percentile needs, mapped to the bracket that holds them.
+
+    Exact histograms resolve every rank themselves and get no brackets.
+    """
+    ranks = []  # type: List[Dict[int, _Bracket]]
+    for hist in hists:
+        n = hist.total
+        needed: Set[int] = set()
+        for q in percentiles:
+            position = (n - 1) * (q / 100)
+            k = int(np.floor(position))
+            needed.update(r for r in (k, k + 1) if 0 <= r < n)
+        unique = {}  # type: Dict[Tuple[float, float], _Bracket]
+        mapping = {}  # type: Dict[int, _Bracket]
+        for r in sorted(needed):
+            if hist.exact:
+                continue
+            b = _bracket(hist, r)
+            mapping[r] = unique.setdefault((b.lo, b.hi), b)
+        ranks.append(mapping)
+    return ranks
+
+
+def _descend(
+    todo: Sequence[Sequence[_Bracket]], ranks: List[Dict[int, _Bracket]]
+) -> None:
+    """Map ranks from refined brackets to the bins of their histograms."""
+    for brackets, mapping in zip(todo, ranks):
+        for r, b in list(mapping.items()):
+            if b in brackets and b.hist is not None:
+                child = _bracket(b.hist, r - b.below, b.last)
+                child.below += b.below
+                mapping[r] = child
+        # Deduplicate children that landed in the same bin
+        seen = {}  # type: Dict[Tuple[float, float], _Bracket]
+        for r, b in list(mapping.items()):
+            mapping[r] = seen.setdefault((b.lo, b.hi), b)
+
+
+def band_percentiles(
+    ds: gdal.Dataset,
+    percentiles: Sequence[float],
+    bands: Optional[Sequence[int]] = None,
+    max_memory: int = DEFAULT_MAX_MEMORY,
+    histograms: Optional[List[Histogram]] = None,
+    source: Optional[BlockSource] = None,
+) -> List[List[float]]:
+    """Compute band percentiles without loading the raster into memory.
+
+    Matches `np.percentile(ds.ReadAsArray(), q, axis=(1, 2))` (NaNs aside).
+    Integer bands are resolved straight from exact histograms. For float bands
+    the bins holding the required ranks are re-histogrammed until they are
+    small enough to fit in the memory budget, at which point their values are
+    collected and sorted.
+
+    Args:
+        ds (gdal.Dataset): Raster dataset
+        percentiles (Sequence[float]): Percentiles to compute, in [0, 100]
+        bands (Optional[Sequence[int]]): 1-based band indices. Defaults to all bands.
+        max_memory (int, optional): Memory budget in bytes. Half of it is used
+            for reading windows and half for collecting values.
+        histograms (Optional[List[Histogram]]): Histograms of `bands` from
+            `band_histograms`, if already computed.
+        source (Optional[BlockSource]): What to read, overrides `bands`.
+            Defaults to every pixel of `bands`.
+
+    Returns:
+        List[List[float]]: For each band, the value of each percentile
+    """
+    window_memory = max_memory // 2
+    if source is None:
+        source = BlockSource(_raster_bands(ds, bands), window_memory)
+    hists = histograms or band_histograms(ds, source=source)
+
+    ranks = _rank_brackets(hists, percentiles)
+
+    def unresolved(limit: int) -> List[List[_Bracket]]:
+        return [
+            [
+                b
+                for b in set(m.values())
+                if b.count > limit and b.lo < b.hi and _max_bins(b.lo, b.hi) > 1
+            ]
+            for m in ranks
+        ]
+
+    def open_brackets() -> int:
+        return max(sum(len(set(m.values())) for m in ranks), 1)
+
+    # Refine brackets that hold too many values to collect
+    for _ in range(MAX_REFINE_PASSES):
+        limit = max(window_memory // (8 * open_brackets()), 1)
+        todo = unresolved(limit)
+        if not any(todo):
+            break
+        for brackets in todo:
+            for b in brackets:
+                b.hist = Histogram(b.lo, b.hi, FLOAT_BINS)
+        for arrays in source:
+            for brackets, arr in zip(todo, arrays):
+                for b in brackets:
+                    assert b.hist is not None
+                    b.hist.update(b.select(arr))
+        _descend(todo, ranks)
+
+    # Collect the actual values of brackets small enough to fit in memory,
+    # the rest only get their observed range
+    limit = max(window_memory // (8 * open_brackets()), 1)
+    final = [[b for b in set(m.values()) if b.lo < b.hi] for m in ranks]
+    if any(final):
+        for arrays in source:
+            for brackets, arr in zip(final, arrays):
+                for b in brackets:
+                    selected = b.select(arr)
+                    if b.count <= limit:
+                        b.values.append(selected)
+                    else:
+                        b.observe(selected)
+        for brackets in final:
+            for b in brackets:
+                if b.values:
+                    values = np.concatenate(b.values).astype(np.float64)
+                    b.values = [np.sort(values)]
+
+    result = []
+    for hist, mapping in zip(hists, ranks):
+        value_at = partial(_resolve, hist, mapping)
+        result.append([_interpolate(value_at, hist.total, q) for q in percentiles])
+    return result
+
+
+def _resolve(hist: Histogram, mapping: Dict[int, _Bracket], rank: int) -> float:
+    if rank not in mapping:
+        return hist.value_at(rank)
+    b = mapping[rank]
+    if b.values:
+        return float(b.values[0][rank - b.below])
+    if b.lo == b.hi:
+        return b.lo
+    if b.seen[0] == b.seen[1]:
+        return b.seen[0]
+    # Refinement limit reached, interpolate within the bracket
+    return b.lo + (rank - b.below + 0.5) / b.count * (b.hi - b.lo)
+
+
+def bracket_histograms(
+    source: BlockSource, brackets: Sequence[Sequence[BracketBounds]]
+) -> List[List[BracketHistogram]]:
+    """Histogram the values of each band that fall within each of its brackets.
+
+    One raster's share of a refinement pass of `merged_percentiles`.
+
+    Args:
+        source (BlockSource): What to read
+        brackets (Sequence[Sequence[BracketBounds]]): Brackets of each band of
+            `source`
+
+    Returns:
+        List[List[BracketHistogram]]: For each band, the histogram of each
+            bracket over `FLOAT_BINS` bins and the range of values in it
+    """
+    found = [[_Bracket(lo, hi, last, 0, 0) for lo, hi, last in bs] for bs in brackets]
+    hists = [[Histogram(b.lo, b.hi, FLOAT_BINS) for b in bs] for bs in found]
+    for arrays in source:
+        for bs, band_hists, arr in zip(found, hists, arrays):
+            for b, hist in zip(bs, band_hists):
+                selected = b.select(arr)
+                hist.update(selected)
+                b.observe(selected)
+    return [
+        [(hist, b.seen[0], b.seen[1]) for b, hist in zip(bs, band_hists)]
+        for bs, band_hists in zip(found, hists)
+    ]
+
+
+def merge_bracket_histograms(
+    a: BracketHistogram, b: BracketHistogram
+) -> BracketHistogram:
+    """Combine the histograms of a bracket from two rasters."""
+    return a[0].merge(b[0]), min(a[1], b[1]), max(a[2], b[2])
+
+
+def merged_percentiles(
+    hists: Sequence[Histogram],
+    percentiles: Sequence[float],
+    refine: Callable[[List[List[BracketBounds]]], List[List[BracketHistogram]]],
+) -> List[List[float]]:
+    """Compute percentiles from histograms merged over several rasters.
+
+    Float histograms are refined like in `band_percentiles`, except that each
+    pass is delegated to `refine`, which histograms the brackets over every
+    raster (see `bracket_histograms`) and merges the results. A bracket is
+    resolved once all its values are equal or it cannot be split further,
+    which usually takes two passes. Percentiles are interpolated within the
+    last bins otherwise.
+
+    Args:
+        hists (Sequence[Histogram]): Merged histogram of each band
+        percentiles (Sequence[float]): Percentiles to compute, in [0, 100]
+        refine (Callable): Refinement pass, given the brackets of each band
+
+    Returns:
+        List[List[float]]: For each band, the value of each percentile
+    """
+    ranks = _rank_brackets(hists, percentiles)
+    for _ in range(MAX_REFINE_PASSES):
+        todo = [
+            sorted(
+                (
+                    b
+                    for b in set(m.values())
+                    if b.lo < b.hi
+                    and b.seen[0] != b.seen[1]
+                    and _max_bins(b.lo, b.hi) > 1
+                ),
+                key=lambda b: (b.lo, b.hi),
+            )
+            for m in ranks
+        ]
+        if not any(todo):
+            break
+        found = refine([[(b.lo, b.hi, b.last) for b in bs] for bs in todo])
+        for brackets, results in zip(todo, found):
+            for b, (hist, lo, hi) in zip(brackets, results):
+                b.seen = (lo, hi)
+                # Brackets of a single value are resolved by their range
+                b.hist = hist if lo < hi else None
+        _descend(todo, ranks)
+
+    result = []
+    for hist, mapping in zip(hists, ranks):
+        value_at = partial(_resolve, hist, mapping)
+        result.append([_interpolate(value_at, hist.total, q) for q in percentiles])
+    return result
+
+
+class StatsEstimate(NamedTuple):
+    """Accuracy of statistics computed from part of a raster.
+
+    `errors` holds, per band, the estimated absolute error of the lower and
+    upper scale bound. For percentiles this is the half-width of a 95%
+    confidence interval on the sampled ranks. For min/max it is the gap
+    between the two most extreme values read, which approximates how far the
+    true extremes lie beyond them. Overviews are resampled rather than randomly
+    sampled, so their estimates tend to be optimistic for min/max.
+    """
+
+    mode: str
+    fraction: float
+    errors: List[Tuple[float, float]]
+
+
+def open_source(
+    ds: gdal.Dataset,
+    bands: Sequence[int],
+    mode: str = "exact",
+    max_memory: int = DEFAULT_MAX_MEMORY,
+    sample_blocks: int = DEFAULT_SAMPLE_BLOCKS,
+    seed: int = 0,
+    skip_nodata: bool = False,
+) -> BlockSource:
+    """Pick what to read from `ds` for the given statistics mode.
+
+    - `exact` reads every pixel.
+    - `overview` reads the coarsest overview with at least
+      `MIN_OVERVIEW_PIXELS` pixels, falling back to every pixel.
+    - `sample` reads `sample_blocks` randomly placed blocks.
+
+    Args:
+        ds (gdal.Dataset): Raster dataset
+        bands (Sequence[int]): 1-based band indices
+        mode (str, optional): One of `STATS_MODES`. Defaults to "exact".
+        max_memory (int, optional): Memory budget for a window in bytes.
+        sample_blocks (int, optional): Number of blocks read in `sample` mode.
+        seed (int, optional): Seed for placing the sampled blocks.
+        skip_nodata (bool, optional): Leave nodata pixels out of the source.
+
+    Raises:
+        ValueError: if `mode` is not a valid statistics mode
+
+    Returns:
+        BlockSource: Source to compute statistics from
+    """
+    if mode not in STATS_MODES:
+        raise ValueError(f"Invalid stats mode {mode}. Choose from {STATS_MODES}")
+    full = _raster_bands(ds, bands)
+
+    if mode == "overview":
+        sizes = [
+            (ov.XSize * ov.YSize, i)
+            for i, ov in enumerate(
+                full[0].GetOverview(i) for i in range(full[0].GetOverviewCount())
+            )
+            if ov.XSize * ov.YSize >= MIN_OVERVIEW_PIXELS
+        ]
+        if sizes:
+            level = min(sizes)[1]
+            return BlockSource(
+                [b.GetOverview(level) for b in full],
+                max_memory,
+                skip_nodata=skip_nodata,
+            )
+
+    if mode == "sample":
+        bx, by = full[0].GetBlockSize()
+        width, height = full[0].XSize, full[0].YSize
+        nx, ny = -(-width // bx), -(-height // by)
+        if sample_blocks < nx * ny:
+            rng = np.random.RandomState(seed)
+            picks = np.sort(rng.choice(nx * ny, sample_blocks, replace=False))
+            windows = []
+            for pick in picks:
+                xoff, yoff = int(pick % nx) * bx, int(pick // nx) * by
+                windows.append(
+                    (xoff, yoff, min(bx, width - xoff), min(by, height - yoff))
+                )
+            return BlockSource(full, windows=windows, skip_nodata=skip_nodata)
+
+    return BlockSource(full, max_memory, skip_nodata=skip_nodata)
+
+
+def _rank_error(hist: Histogram, q: float) -> float:
+    n = hist.total
+    if n < 2:
+        return 0.0
+    p = q / 100
+    # Normal approximation of the binomial spread of the sampled rank
+    spread = max(Z_95 * np.sqrt(n * p * (1 - p)), 1.0)
+    position = (n - 1) * p
+    lo = hist.value_at(max(int(np.floor(position - spread)), 0))
+    hi = hist.value_at(min(int(np.ceil(position + spread)), n - 1))
+    value = hist.percentile(q)
+    return max(value - lo, hi - value)
+
+
+def _extremes(source: BlockSource) -> List[Tuple[float, float, float, float]]:
+    """Two smallest and two largest valid values of each band."""
+    result = []
+    for i, band in enumerate(source.bands):
+        nodata = band.GetNoDataValue()
+        low = np.array([], dtype=np.float64)
+        high = np.array([], dtype=np.float64)
+        for (arr,) in source.subset([i]):
+            arr = arr.ravel().astype(np.float64)
+            arr = arr[np.isfinite(arr)]
+            if nodata is not None:
+                arr = arr[arr != nodata]
+            low = np.sort(np.concatenate([low, np.sort(arr)[:2]]))[:2]
+            high = np.sort(np.concatenate([high, np.sort(arr)[-2:]]))[-2:]
+        if low.size == 0:
+            result.append((np.nan,) * 4)
+            continue
+        result.append((low[0], low[-1], high[0], high[-1]))
+    return result
+
+
+def approximate_bounds(
+    ds: gdal.Dataset,
+    bands: Sequence[int],
+    stretch: Optional[bool],
+    lower: float,
+    upper: float,
+    mode: str,
+    max_memory: int = DEFAULT_MAX_MEMORY,
+    sample_blocks: int = DEFAULT_SAMPLE_BLOCKS,
+    skip_nodata: bool = False,
+) -> Tuple[List[List[float]], StatsEstimate]:
+    """Compute scale bounds from an overview or a sample of blocks.
+
+    Args:
+        ds (gdal.Dataset): Raster dataset
+        bands (Sequence[int]): 1-based band indices
+        stretch (Optional[bool]): Whether to compute percentiles, not min/max
+        lower (float): Lower percentile
+        upper (float): Upper percentile
+        mode (str): One of `STATS_MODES`
+        max_memory (int, optional): Memory budget in bytes.
+        sample_blocks (int, optional): Number of blocks read in `sample` mode.
+        skip_nodata (bool, optional): Leave nodata pixels out of percentiles.
+            Min/max always leave them out.
+
+    Returns:
+        Tuple[List[List[float]], StatsEstimate]: Lower and upper bound of
+            each band, along with their estimated accuracy
+    """
+    source = open_source(
+        ds, bands, mode, max_memory // 2, sample_blocks, skip_nodata=skip_nodata
+    )
+    fraction = source.pixels / float(ds.RasterXSize * ds.RasterYSize)
+
+    if stretch:
+        hists = band_histograms(ds, source=source)
+        bounds = band_percentiles(
+            ds, [lower, upper], max_memory=max_memory, histograms=hists, source=source
+        )
+        errors = [(_rank_error(h, lower), _rank_error(h, upper)) for h in hists]
+    else:
+        extremes = _extremes(source)
+        bounds = [[lo, hi] for lo, _, _, hi in extremes]
+        errors = [(lo2 - lo, hi - hi2) for lo, lo2, hi2, hi in extremes]
+
+    if fraction >= 1:
+        errors = [(0.0, 0.0) for _ in errors]
+    return bounds, StatsEstimate(mode, fraction, errors)
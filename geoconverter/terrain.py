@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+"""
+Generates Cesium terrain tiles (heightmap or quantized mesh) from DEMs with
+ctb-tile.
+
+Several DEMs are tiled concurrently, sharing a CPU budget: each ctb-tile run
+gets an equal share of the cores as its thread count.
+
+Usage:
+
+```console
+python geoconverter/terrain.py -i ./data/dem.tif -o ./data/tiles/
+python geoconverter/terrain.py -i ./data/dems/ -o ./data/tiles/ -f Mesh --cpus 16 -j 4
+python geoconverter/terrain.py -i ./data/dem.tif -o ./data/tiles/ --zoom 12 14 --resume
+```
+"""
+
+import logging
+import os
+import re
+import subprocess
+import threading
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from geoconverter.utils import discover_files
+
+# ctb-tile reports progress GDAL style: 0...10...20...
+CTB_PROGRESS = re.compile(r"(\d+)(?:\.\.\.| - done)")
+
+TERRAIN_FORMATS = ("Terrain", "Mesh")
+
+# Share of a DEM's progress taken by its tiles, layer.json is quick
+TILES_SHARE = 0.95
+
+logger = logging.getLogger(__name__)
+
+
+def ctb_command(
+    input: Union[Path, str],
+    output: Union[Path, str],
+    format: str = "Terrain",
+    threads: Optional[int] = None,
+    zoom: Optional[Tuple[int, int]] = None,
+    resume: bool = False,
+    layer: bool = False,
+) -> List[str]:
+    """Build a ctb-tile command line.
+
+    Args:
+        input (Union[Path, str]): Path to DEM
+        output (Union[Path, str]): Tileset directory
+        format (str, optional): "Terrain" (heightmap) or "Mesh". Defaults to
+            "Terrain".
+        threads (Optional[int]): Threads used by ctb-tile. Defaults to all
+            cores.
+        zoom (Optional[Tuple[int, int]]): Lowest and highest zoom level to
+            tile. Defaults to all levels.
+        resume (bool, optional): Keep existing tiles. Defaults to False.
+        layer (bool, optional): Only write layer.json. Defaults to False.
+
+    Returns:
+        List[str]: Command line
+    """
+    cmd = ["ctb-tile", "-C", "-f", format, "-o", str(output)]
+    if threads:
+        cmd += ["-c", str(threads)]
+    if zoom is not None:
+        # ctb-tile works from the start (highest) zoom down to the end zoom
+        cmd += ["-s", str(zoom[1])]
+        if not layer:
+            # layer.json always describes every level up to the highest
+            cmd += ["-e", str(zoom[0])]
+    if resume and not layer:
+        cmd.append("-R")
+    if layer:
+        cmd.append("-l")
+    return cmd + [str(input)]
+
+
+def run_ctb_tile(
+    cmd: List[str],
+    progress: Optional[Callable[[float], None]] = None,
+    cancelled: Optional[Callable[[], bool]] = None,
+    start: float = 0.0,
+    end: float = 1.0,
+) -> bool:
+    """Run ctb-tile, mapping its progress output onto [start, end].
+
+    Args:
+        cmd (List[str]): ctb-tile command line
+        progress (Optional[Callable[[float], None]]): Called with the progress
+            as ctb-tile reports it
+        cancelled (Optional[Callable[[], bool]]): Polled while ctb-tile runs.
+            ctb-tile is terminated once it returns True.
+        start (float, optional): Progress at start of the command
+        end (float, optional): Progress at end of the command
+
+    Raises:
+        subprocess.CalledProcessError: if ctb-tile fails
+
+    Returns:
+        bool: False if ctb-tile was cancelled
+    """
+    proc = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0
+    )
+    assert proc.stdout is not None
+    output = ""
+    stopped = False
+    while True:
+        if cancelled is not None and cancelled():
+            proc.terminate()
+            stopped = True
+            break
+        chunk = proc.stdout.read(64)
+        if not chunk:
+            break
+        output = (output + chunk.decode(errors="replace"))[-256:]
+        matches = CTB_PROGRESS.findall(output)
+        if matches and progress is not None:
+            progress(start + (end - start) * int(matches[-1]) / 100)
+    if proc.wait() and not stopped:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output)
+    return not stopped
+
+
+def tile_dem(
+    input: Union[Path, str],
+    output: Union[Path, str],
+    format: str = "Terrain",
+    threads: Optional[int] = None,
+    zoom: Optional[Tuple[int, int]] = None,
+    resume: bool = False,
+    progress: Optional[Callable[[float], None]] = None,
+    cancelled: Optional[Callable[[], bool]] = None,
+) -> bool:
+    """Tile a DEM and write the layer.json of its tileset.
+
+    Args:
+        input (Union[Path, str]): Path to DEM
+        output (Union[Path, str]): Tileset directory
+        format (str, optional): "Terrain" or "Mesh". Defaults to "Terrain".
+        threads (Optional[int]): Threads used by ctb-tile
+        zoom (Optional[Tuple[int, int]]): Lowest and highest zoom level to
+            (re-)tile
+        resume (bool, optional): Keep existing tiles
+        progress (Optional[Callable[[float], None]]): Progress callback
+        cancelled (Optional[Callable[[], bool]]): Cancellation check
+
+    Raises:
+        subprocess.CalledProcessError: if ctb-tile fails
+
+    Returns:
+        bool: False if tiling was cancelled
+    """
+    tiles = ctb_command(input, output, format, threads, zoom, resume)
+    if not run_ctb_tile(tiles, progress, cancelled, 0.0, TILES_SHARE):
+        return False
+    layer = ctb_command(input, output, format, threads, zoom, layer=True)
+    return run_ctb_tile(layer, progress, cancelled, TILES_SHARE, 1.0)
+
+
+def tileset_path(dem: Path, output: Path, root: Optional[Path] = None) -> Path:
+    """Directory of the tileset of a DEM.
+
+    Args:
+        dem (Path): Path to DEM
+        output (Path): Directory of the tilesets
+        root (Optional[Path]): Directory the DEM was found in
+
+    Returns:
+        Path: e.g. `output/north/a` for `root/north/a.tif`, or `output/a`
+            without `root`
+    """
+    relative = dem.relative_to(root) if root is not None else Path(dem.name)
+    return output / relative.with_suffix("")
+
+
+def tile_dems(
+    inputs: Sequence[Union[Path, str]],
+    output: Union[Path, str],
+    format: str = "Terrain",
+    cpus: Optional[int] = None,
+    jobs: Optional[int] = None,
+    zoom: Optional[Tuple[int, int]] = None,
+    resume: bool = False,
+    progress: Optional[Callable[[float], None]] = None,
+    cancelled: Optional[Callable[[], bool]] = None,
+    root: Optional[Union[Path, str]] = None,
+) -> List[Path]:
+    """Tile several DEMs concurrently within a CPU budget.
+
+    Each DEM gets its own tileset under `output`, named by `tileset_path`.
+
+    Args:
+        inputs (Sequence[Union[Path, str]]): Paths to DEMs
+        output (Union[Path, str]): Directory of the tilesets
+        format (str, optional): "Terrain" or "Mesh". Defaults to "Terrain".
+        cpus (Optional[int]): Cores shared by all ctb-tile runs. Defaults to
+            all cores.
+        jobs (Optional[int]): DEMs tiled at once. Defaults to as many as
+            there are cores, up to the number of DEMs.
+        zoom (Optional[Tuple[int, int]]): Lowest and highest zoom level
+        resume (bool, optional): Keep existing tiles
+        progress (Optional[Callable[[float], None]]): Called with the overall
+            progress
+        cancelled (Optional[Callable[[], bool]]): Cancellation check
+        root (Optional[Union[Path, str]]): Directory the DEMs were found in
+
+    Raises:
+        ValueError: if two DEMs would share a tileset
+
+    Returns:
+        List[Path]: DEMs that failed to tile
+    """
+    tilesets = [
+        tileset_path(Path(dem), Path(output), Path(root) if root else None)
+        for dem in inputs
+    ]
+    named: Dict[Path, Union[Path, str]] = {}
+    for dem, tileset in zip(inputs, tilesets):
+        if tileset in named:
+            raise ValueError(f"{named[tileset]} and {dem} would share {tileset}")
+        named[tileset] = dem
+    cpus = cpus or os.cpu_count() or 1
+    jobs = max(1, min(jobs or cpus, cpus, len(inputs)))
+    threads = max(1, cpus // jobs)
+    fractions = [0.0] * len(inputs)
+    lock = threading.Lock()
+
+    def run(i: int) -> None:
+        def report(fraction: float) -> None:
+            with lock:
+                fractions[i] = fraction
+                overall = sum(fractions) / len(fractions)
+            if progress is not None:
+                progress(overall)
+
+        finished = tile_dem(
+            inputs[i], tilesets[i], format, threads, zoom, resume, report, cancelled
+        )
+        if finished:
+            report(1.0)
+
+    logger.info(
+        "Tiling %d DEMs, %d at a time with %d threads each", len(inputs), jobs, threads
+    )
+    failed = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run, i) for i in range(len(inputs))]
+        for dem, future in zip(inputs, futures):
+            try:
+                future.result()
+            except (OSError, subprocess.CalledProcessError) as exc:
+                logger.error("%s failed: %s", dem, exc)
+                failed.append(Path(dem))
+    return failed
+
+
+def get_args() -> Namespace:
+    parser = ArgumentParser(description="Terrain tiler")
+    parser.add_argument("-i", "--input", required=True, help="DEM or directory")
+    parser.add_argument("-o", "--output", required=True, help="tileset directory")
+    parser.add_argument(
+        "-f", "--format", choices=TERRAIN_FORMATS, default="Terrain", help="tiles"
+    )
+    parser.add_argument(
+        "--cpus", type=int, help="cores shared by all DEMs (defaults to all)"
+    )
+    parser.add_argument("-j", "--jobs", type=int, help="DEMs tiled at once")
+    parser.add_argument(
+        "--zoom",
+        type=int,
+        nargs=2,
+        metavar=("MIN", "MAX"),
+        help="only (re-)tile these zoom levels",
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="keep tiles that already exist"
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        metavar="GLOB",
+        help="only tile DEMs matching this pattern (repeatable)",
+    )
+    return parser.parse_args()
+
+
+def main(args: Namespace) -> None:
+    zoom = tuple(args.zoom) if args.zoom else None  # type: Optional[Tuple[int, int]]
+    last = [-1]
+
+    def log_progress(fraction: float) -> None:
+        percent = int(fraction * 100)
+        if percent // 10 > last[0] // 10:
+            logger.info("%d%%", percent)
+        last[0] = max(last[0], percent)
+
+    if Path(args.input).is_dir():
+        dems = list(discover_files(args.input, args.include))
+        failed = tile_dems(
+            dems,
+            args.output,
+            args.format,
+            args.cpus,
+            args.jobs,
+            zoom,
+            args.resume,
+            log_progress,
+            root=args.input,
+        )
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(dems)} DEMs failed to tile")
+    else:
+        tile_dem(
+            args.input,
+            args.output,
+            args.format,
+            args.cpus,
+            zoom,
+            args.resume,
+            log_progress,
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main(get_args())
@@ -1,9 +1,161 @@
 """Utilities for geoconverter"""
 
+import os
+from collections import OrderedDict
+from fnmatch import fnmatch
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
-from osgeo import gdal
+# GDAL is only loaded by the functions opening rasters
+if TYPE_CHECKING:
+    from osgeo import gdal
+
+# Number of probed rasters whose metadata is kept around
+PROBE_CACHE_SIZE = 256
+
+# GDAL virtual filesystems for reading archives without extracting them
+ARCHIVE_FILESYSTEMS = {
+    ".zip": "/vsizip/",
+    ".tar": "/vsitar/",
+    ".tgz": "/vsitar/",
+    ".tar.gz": "/vsitar/",
+}
+
+# Companion files that never hold rasters of their own
+SIDECAR_SUFFIXES = {
+    # Metadata, overviews and masks (incl. .aux.xml)
+    ".xml",
+    ".aux",
+    ".ovr",
+    ".rrd",
+    ".msk",
+    ".hdr",
+    ".prj",
+    ".qml",
+    # World files
+    ".wld",
+    ".tfw",
+    ".tifw",
+    ".tiffw",
+    ".jgw",
+    ".j2w",
+    ".pgw",
+    # Checksums and documents
+    ".md5",
+    ".sha1",
+    ".sha256",
+    ".txt",
+    ".log",
+    ".json",
+    ".jsonl",
+    ".html",
+    ".pdf",
+    # Files still being written or downloaded under a temporary name
+    ".part",
+    ".partial",
+    ".tmp",
+}
+
+
+class RasterInfo(NamedTuple):
+    """Raster metadata gathered from a single open."""
+
+    driver: str
+    dtype: str
+    band_count: int
+    xsize: int
+    ysize: int
+    nodata: Optional[float]
+    overview_count: int
+    block_size: Tuple[int, int]
+
+
+_probe_cache = OrderedDict()  # type: OrderedDict[Tuple[Any, ...], RasterInfo]
+
+
+def file_identity(input: Union[Path, str]) -> Optional[Tuple[str, int, int]]:
+    """Identify a file by its resolved path, size and modification time.
+
+    Args:
+        input (Union[Path, str]): Path to file
+
+    Returns:
+        Optional[Tuple[str, int, int]]: Path, size in bytes and mtime in
+            nanoseconds, or None if `input` is not a local file or a file on
+            a GDAL virtual filesystem (e.g. in an archive)
+    """
+    if str(input).startswith("/vsi"):
+        from osgeo import gdal
+
+        stat = gdal.VSIStatL(str(input))
+        if stat is None:
+            return None
+        return str(input), stat.size, stat.mtime * 10**9
+    try:
+        st = os.stat(str(input))
+    except OSError:
+        return None
+    return str(Path(input).resolve()), st.st_size, st.st_mtime_ns
+
+
+def _probe_key(input: Union[Path, str]) -> Tuple[Any, ...]:
+    # Include size and mtime so a rewritten file is probed again
+    return file_identity(input) or (str(input),)
+
+
+def probe(input: Union[Path, str], ds: Optional["gdal.Dataset"] = None) -> RasterInfo:
+    """Get raster metadata, opening the raster at most once.
+
+    Results are cached, so later calls for the same unchanged file are free.
+
+    Args:
+        input (Union[Path, str]): Path to raster
+        ds (Optional[gdal.Dataset]): Already opened dataset for `input`.
+            Avoids opening it again if it has not been probed yet.
+
+    Raises:
+        RuntimeError: if the raster cannot be opened
+
+    Returns:
+        RasterInfo: Raster metadata
+    """
+    from osgeo import gdal
+
+    key = _probe_key(input)
+    if key in _probe_cache:
+        _probe_cache.move_to_end(key)
+        return _probe_cache[key]
+
+    if ds is None:
+        ds = gdal.Open(str(input))
+        if ds is None:
+            raise RuntimeError(f"Unable to open {input}")
+    band = ds.GetRasterBand(1)
+    info = RasterInfo(
+        driver=ds.GetDriver().GetDescription(),
+        dtype=gdal.GetDataTypeName(band.DataType),
+        band_count=ds.RasterCount,
+        xsize=ds.RasterXSize,
+        ysize=ds.RasterYSize,
+        nodata=band.GetNoDataValue(),
+        overview_count=band.GetOverviewCount(),
+        block_size=tuple(band.GetBlockSize()),
+    )
+    ds = None
+
+    _probe_cache[key] = info
+    if len(_probe_cache) > PROBE_CACHE_SIZE:
+        _probe_cache.popitem(last=False)
+    return info
 
 
 def get_dtype(input: Union[Path, str]) -> str:
@@ -15,11 +167,7 @@ def get_dtype(input: Union[Path, str]) -> str:
     Returns:
         str: Raster dtype
     """
-    ds = gdal.Open(str(input))
-    DataType = ds.GetRasterBand(1).DataType
-    dtype: str = gdal.GetDataTypeName(DataType)
-    ds = None
-    return dtype
+    return probe(input).dtype
 
 
 def get_extension(input: Union[Path, str], format: str) -> str:
@@ -36,13 +184,12 @@ def get_extension(input: Union[Path, str], format: str) -> str:
     Returns:
         str: File extension
     """
+    from osgeo import gdal
 
     if format.lower() != "native":
         drv = gdal.GetDriverByName(format)
     else:
-        ds = gdal.Open(str(input))
-        drv = ds.GetDriver()
-        del ds
+        drv = gdal.GetDriverByName(probe(input).driver)
     if not drv:
         raise AssertionError(
             "Invalid Driver. Refer GDAL documentation "
@@ -58,44 +205,248 @@ def get_extension(input: Union[Path, str], format: str) -> str:
     return ext
 
 
+def output_path(
+    input: Path, directory: Path, format: str, output_stub: str = "converted"
+) -> Path:
+    """Path of a raster converted into an output directory.
+
+    Args:
+        input (Path): Path to input raster
+        directory (Path): Output directory
+        format (str): Raster format
+        output_stub (str, optional): String added to output filename.
+
+    Returns:
+        Path: e.g. `directory/a_converted.tif` for `a.jp2`
+    """
+    return directory / f"{input.stem}_{output_stub}.{get_extension(input, format)}"
+
+
+def partial_path(output: Union[Path, str]) -> Path:
+    """Temporary path an output is written to before being renamed into place.
+
+    The file is hidden and next to `output`, so the rename is atomic and the
+    file is never picked up as an input.
+
+    Args:
+        output (Union[Path, str]): Path to output raster
+
+    Returns:
+        Path: Temporary path
+    """
+    output = Path(output)
+    return output.with_name(f".{output.name}.partial")
+
+
+def replace_output(
+    partial: Union[Path, str], output: Union[Path, str], files: Sequence[str] = ()
+) -> None:
+    """Atomically move a finished partial output (and its sidecars) into place.
+
+    Sidecars are moved first, so a crash never leaves an output behind
+    without them. Those named after the whole partial path (e.g. `.aux.xml`)
+    keep their suffix on the output name, those named by replacing its
+    extension (e.g. ENVI `.hdr`, HFA `.ige`) replace the output's extension.
+
+    Args:
+        partial (Union[Path, str]): Path the output was written to
+        output (Union[Path, str]): Final path of the output
+        files (Sequence[str]): Files making up the dataset, as reported by
+            `GetFileList`. The main file and an .aux.xml are always included.
+    """
+    partial, output = Path(partial), Path(output)
+    sidecars = {Path(f) for f in files} | {Path(f"{partial}.aux.xml")}
+    sidecars.discard(partial)
+    for f in sidecars:
+        if not f.exists():
+            continue
+        if f.name.startswith(partial.name):
+            name = output.name + f.name[len(partial.name) :]
+        elif f.name.startswith(partial.stem + "."):
+            name = output.stem + f.name[len(partial.stem) :]
+        else:
+            continue
+        os.replace(str(f), str(output.with_name(name)))
+    os.replace(str(partial), str(output))
+
+
+def is_sidecar(path: Path) -> bool:
+    """Check whether a file is a GDAL sidecar or other non-raster companion.
+
+    Args:
+        path (Path): Path to file
+
+    Returns:
+        bool: True if the file should not be converted
+    """
+    return path.name.startswith(".") or path.suffix.lower() in SIDECAR_SUFFIXES
+
+
+def _matches(path: Path, root: Path, patterns: Sequence[str]) -> bool:
+    return _matches_relpath(path.relative_to(root).as_posix(), patterns)
+
+
+def is_selected(
+    path: Path,
+    root: Path,
+    include: Optional[Sequence[str]] = None,
+    exclude: Optional[Sequence[str]] = None,
+) -> bool:
+    """Check a file under `root` against include and exclude glob patterns."""
+    if include and not _matches(path, root, include):
+        return False
+    return not (exclude and _matches(path, root, exclude))
+
+
+def _matches_relpath(relpath: str, patterns: Sequence[str]) -> bool:
+    name = relpath.rsplit("/", 1)[-1]
+    return any(fnmatch(relpath, p) or fnmatch(name, p) for p in patterns)
+
+
+def archive_root(input: Union[Path, str]) -> Optional[str]:
+    """GDAL virtual path of an archive's root, None if `input` is no archive.
+
+    Args:
+        input (Union[Path, str]): Path to a file
+
+    Returns:
+        Optional[str]: e.g. `/vsizip/{/data/bundle.zip}`
+    """
+    path = Path(input)
+    if not path.is_file():
+        return None
+    name = path.name.lower()
+    for suffix, prefix in ARCHIVE_FILESYSTEMS.items():
+        if name.endswith(suffix):
+            # Braces keep the archive path intact when joined with members
+            return f"{prefix}{{{path.resolve()}}}"
+    return None
+
+
+def discover_archive(
+    input: Union[Path, str],
+    include: Optional[Sequence[str]] = None,
+    exclude: Optional[Sequence[str]] = None,
+) -> Iterator[Path]:
+    """Find rasters in a zip or tar archive without extracting it.
+
+    Members are filtered like the files of a directory, see `discover_files`.
+
+    Args:
+        input (Union[Path, str]): Path to archive
+        include (Optional[Sequence[str]]): Only yield members matching one of these
+        exclude (Optional[Sequence[str]]): Skip members matching any of these
+
+    Raises:
+        ValueError: if `input` is not a supported archive
+
+    Yields:
+        Path: GDAL virtual path to raster, e.g.
+            `/vsizip/{/data/bundle.zip}/scenes/a.tif`
+    """
+    from osgeo import gdal
+
+    root = archive_root(input)
+    if root is None:
+        raise ValueError(f"{input} is not a zip or tar archive")
+    for name in gdal.ReadDirRecursive(root) or []:
+        # Directories end with a slash
+        if name.endswith("/") or is_sidecar(Path(name)):
+            continue
+        if include and not _matches_relpath(name, include):
+            continue
+        if exclude and _matches_relpath(name, exclude):
+            continue
+        yield Path(f"{root}/{name}")
+
+
+def _scandir(root: Path) -> Iterator[Path]:
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    yield Path(entry.path)
+
+
+def discover_files(
+    root: Union[Path, str],
+    include: Optional[Sequence[str]] = None,
+    exclude: Optional[Sequence[str]] = None,
+    use_scandir: bool = False,
+) -> Iterator[Path]:
+    """Lazily find rasters under a directory.
+
+    Sidecar files (see `SIDECAR_SUFFIXES`) and hidden files are skipped.
+    Glob patterns are matched against both the path relative to `root` and
+    the file name.
+
+    Args:
+        root (Union[Path, str]): Directory to search
+        include (Optional[Sequence[str]]): Only yield files matching one of these
+        exclude (Optional[Sequence[str]]): Skip files matching any of these
+        use_scandir (bool, optional): Walk the tree with `os.scandir` instead of
+            `Path.rglob`. Faster on large trees. Defaults to False.
+
+    Yields:
+        Path: Path to raster
+    """
+    root = Path(root)
+    paths = _scandir(root) if use_scandir else root.rglob("*")
+    for f in paths:
+        # Skip auxiliary files and subdirectories
+        if is_sidecar(f) or (not use_scandir and f.is_dir()):
+            continue
+        if is_selected(f, root, include, exclude):
+            yield f
+
+
 def parse_files(
-    input: str, output: str, format: str, output_stub: str = "converted"
-) -> Tuple[List[Path], List[Path]]:
-    """Parse specified input (file/dir) and output (file/dir)
+    input: str,
+    output: str,
+    format: str,
+    output_stub: str = "converted",
+    include: Optional[Sequence[str]] = None,
+    exclude: Optional[Sequence[str]] = None,
+    use_scandir: bool = False,
+) -> Iterator[Tuple[Path, Path]]:
+    """Parse specified input (file/dir/archive) and output (file/dir)
+
+    Directories are searched lazily, so pairs are yielded as soon as each file
+    is found. Zip and tar archives are read in place through GDAL's virtual
+    filesystems, and their rasters are named as if they had been extracted.
 
     Args:
-        input (str): Path to raster or directory of rasters
+        input (str): Path to raster, directory of rasters or archive of rasters
         output (str): Path to output raster or directory
         format (str): Raster format
-        output_stub (str, optional): String added to output filename. Defaults to "converted".
+        output_stub (str, optional): String added to output filename.
+            Defaults to "converted".
+        include (Optional[Sequence[str]]): Glob patterns of files to convert
+        exclude (Optional[Sequence[str]]): Glob patterns of files to skip
+        use_scandir (bool, optional): Walk directories with `os.scandir`.
 
     Returns:
-        Tuple[List[Path], List[Path]]: List of input and output paths
+        Iterator[Tuple[Path, Path]]: Pairs of input and output paths
     """
     assert Path(input).exists() and input != ""
 
     inpath = Path(input)
     outpath = Path(output) if output else None
 
-    if inpath.is_dir():
+    archive = archive_root(inpath)
+    if inpath.is_dir() or archive:
         # If input is a dir, then output dir must be specified
         outpath = Path(output)
         assert outpath.is_dir()
-        files = []
-        outpaths = []
-        for f in inpath.rglob("*"):
-            # Skip auxiliary files and subdirectories
-            if f.suffix.lower() == ".xml" or f.is_dir():
-                continue
-            files.append(f)
-            ext = get_extension(f, format)
-            outpaths.append(outpath / f"{f.stem}_{output_stub}.{ext}")
-    elif inpath.is_file():
-        ext = get_extension(inpath, format)
-        outpaths = (
-            [outpath] if outpath else [inpath.parent / Path(f"{output_stub}.{ext}")]
-        )
-        assert inpath.suffix.lower() != ".xml"
-        files = [inpath]
+        if archive:
+            files = discover_archive(inpath, include, exclude)
+        else:
+            files = discover_files(inpath, include, exclude, use_scandir)
+        return ((f, output_path(f, outpath, format, output_stub)) for f in files)
 
-    return files, outpaths
+    ext = get_extension(inpath, format)
+    assert inpath.suffix.lower() != ".xml"
+    return iter([(inpath, outpath or inpath.parent / Path(f"{output_stub}.{ext}"))])
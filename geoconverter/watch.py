@@ -0,0 +1,281 @@
+"""Watch-folder ingest: convert rasters as they land in a directory"""
+
+import logging
+import os
+import threading
+import time
+from argparse import Namespace
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from geoconverter.defaults import DEFAULT_WATCH_INTERVAL, DEFAULT_WATCH_SETTLE
+from geoconverter.gdal_convert import MAX_INFLIGHT_PER_JOB, convert_file
+from geoconverter.profiles import cache_max, config_for
+from geoconverter.report import FileRecord, RunReport, failed_record
+from geoconverter.utils import is_selected, is_sidecar
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    from geoconverter.manifest import Manifest
+
+Pairs = Iterable[Tuple[Path, Path]]
+
+logger = logging.getLogger(__name__)
+
+
+class FolderWatcher:
+    """Finds rasters added to a directory tree once they are completely written.
+
+    Each poll only stats the known directories and the files not yet
+    settled. A directory is only listed again when its mtime changes, i.e.
+    when entries were added, removed or renamed in it, and only the entries
+    that are new (by name and inode) are looked at. Files already reported
+    are never stat'ed again, so the cost of a poll follows the new data,
+    not the size of the tree. A file replaced by a rename gets a new inode
+    and is reported again; one rewritten in place is not.
+
+    A new file is reported once its size and mtime have not changed for
+    `settle` seconds, so files still being written are left alone.
+
+    Args:
+        root (Union[Path, str]): Directory to watch
+        include (Optional[Sequence[str]]): Only report files matching one of
+            these glob patterns
+        exclude (Optional[Sequence[str]]): Skip files matching any of these
+        settle (float, optional): Seconds a file must stay unchanged
+        skip (Sequence[Union[Path, str]]): Directories not to watch, e.g. an
+            output directory inside `root`
+    """
+
+    def __init__(
+        self,
+        root: Union[Path, str],
+        include: Optional[Sequence[str]] = None,
+        exclude: Optional[Sequence[str]] = None,
+        settle: float = DEFAULT_WATCH_SETTLE,
+        skip: Sequence[Union[Path, str]] = (),
+    ) -> None:
+        self.root = Path(root)
+        self.include = include
+        self.exclude = exclude
+        self.settle = settle
+        self.skip = {os.path.abspath(str(d)) for d in skip}
+        # mtime of every known directory, None until it has been listed
+        self.dirs = {str(self.root): None}  # type: Dict[str, Optional[int]]
+        # Inode of every known file of every directory
+        self.files = {}  # type: Dict[str, Dict[str, int]]
+        # Size, mtime and since when unchanged of files not yet settled
+        self.pending = {}  # type: Dict[str, Optional[Tuple[int, int, float]]]
+
+    def _list(self, directory: str) -> None:
+        try:
+            it = os.scandir(directory)
+        except OSError:
+            # Removed since, forget it and everything below it
+            for d in [
+                d
+                for d in self.dirs
+                if d == directory or d.startswith(directory + os.sep)
+            ]:
+                del self.dirs[d]
+                self.files.pop(d, None)
+            return
+        known = self.files.get(directory, {})
+        current = {}  # type: Dict[str, int]
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if os.path.abspath(entry.path) not in self.skip:
+                        self.dirs.setdefault(entry.path, None)
+                    continue
+                path = Path(entry.path)
+                if not entry.is_file() or is_sidecar(path):
+                    continue
+                if not is_selected(path, self.root, self.include, self.exclude):
+                    continue
+                inode = entry.inode()
+                current[entry.name] = inode
+                if known.get(entry.name) != inode:
+                    self.pending[entry.path] = None
+        self.files[directory] = current
+
+    def poll(self) -> List[Path]:
+        """Look for changes and get the files that have settled since last time.
+
+        Returns:
+            List[Path]: Completely written new files, sorted by path
+        """
+        # Directories found while listing are listed in the same poll
+        listed = set()
+        while True:
+            changed = []
+            for directory, mtime in list(self.dirs.items()):
+                if directory in listed:
+                    continue
+                try:
+                    current = os.stat(directory).st_mtime_ns
+                except OSError:
+                    current = None
+                if current is None or current != mtime:
+                    changed.append((directory, current))
+            if not changed:
+                break
+            for directory, current in changed:
+                listed.add(directory)
+                if current is not None:
+                    # Recorded first, so changes made while listing are seen
+                    # by the next poll
+                    self.dirs[directory] = current
+                self._list(directory)
+
+        now = time.monotonic()
+        ready = []
+        for path, seen in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Gone again, e.g. a temporary file
+                del self.pending[path]
+                continue
+            if seen is None or seen[:2] != (st.st_size, st.st_mtime_ns):
+                self.pending[path] = (st.st_size, st.st_mtime_ns, now)
+            elif now - seen[2] >= self.settle:
+                del self.pending[path]
+                ready.append(Path(path))
+        return sorted(ready)
+
+
+def watch_folder(
+    args: Namespace,
+    target: Callable[[Path], Path],
+    jobs: int,
+    report: Optional[RunReport] = None,
+    manifest: Optional["Manifest"] = None,
+    select: Optional[Callable[[Pairs], Pairs]] = None,
+    stop: Optional[threading.Event] = None,
+) -> None:
+    """Convert rasters as they are added to the input directory, until stopped.
+
+    Rasters already in the directory are converted first. New ones are
+    queued as soon as `FolderWatcher` finds them completely written and
+    converted across a pool of worker processes, with a bounded number in
+    flight and the memory budget of `convert_parallel`. A failing file is
+    logged and does not stop the watch.
+
+    Args:
+        args (Namespace): Parsed CLI arguments, `args.input` is watched
+        target (Callable[[Path], Path]): Output path of an input raster
+        jobs (int): Number of worker processes
+        report (Optional[RunReport]): Report to add file records to
+        manifest (Optional[Manifest]): Manifest to record converted files in
+        select (Optional[Callable[[Pairs], Pairs]]): Filters the input and
+            output pairs to convert, e.g. those not up to date
+        stop (Optional[threading.Event]): Stops watching once set. Runs until
+            interrupted otherwise.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    from geoconverter.scheduler import MemoryBudget, estimate_memory
+    from geoconverter.utils import probe
+
+    interval = getattr(args, "watch_interval", DEFAULT_WATCH_INTERVAL)
+    watcher = FolderWatcher(
+        args.input,
+        getattr(args, "include", None),
+        getattr(args, "exclude", None),
+        getattr(args, "watch_settle", DEFAULT_WATCH_SETTLE),
+        skip=[args.output],
+    )
+    # Estimates need every file probed, so only with a budget
+    limit = getattr(args, "memory_budget", None)
+    budget = MemoryBudget(limit * 2**20) if limit else None
+    worker_cache = cache_max(config_for(args))
+
+    queued: Deque[Tuple[Path, Path, int]] = deque()
+    pending: Dict["Future[FileRecord]", Tuple[Path, Path, int]] = {}
+    done = 0
+
+    def collect(futures: Iterable["Future[FileRecord]"]) -> None:
+        nonlocal done
+        for future in futures:
+            entry, out, need = pending.pop(future)
+            if budget is not None:
+                budget.release(need)
+            done += 1
+            try:
+                record = future.result()
+            except Exception as exc:
+                record = failed_record(entry, out, exc)
+                logger.error("[%d] %s failed: %s", done, entry, exc)
+            else:
+                logger.info("[%d] %s -> %s", done, entry, out)
+                if manifest is not None:
+                    manifest.record(entry, out)
+            if report is not None:
+                report.add(record)
+
+    def admit(entry: Path) -> List[Tuple[Path, Path, int]]:
+        """Output and memory estimate of a new file, unless it is skipped."""
+        pairs = [(entry, target(entry))]  # type: Pairs
+        if select is not None:
+            pairs = select(pairs)
+        admitted = []
+        for path, out in pairs:
+            need = 0
+            if budget is not None:
+                try:
+                    need = estimate_memory(probe(path), args, worker_cache)
+                except RuntimeError:
+                    # Unreadable, the worker reports the failure
+                    pass
+            admitted.append((path, out, need))
+        return admitted
+
+    logger.info("Watching %s every %.1f s", args.input, interval)
+    next_poll = 0.0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while stop is None or not stop.is_set():
+            now = time.monotonic()
+            if now >= next_poll:
+                next_poll = now + interval
+                for entry in watcher.poll():
+                    try:
+                        queued.extend(admit(entry))
+                    except Exception as exc:
+                        # A bad file must not stop the watch
+                        logger.error("%s skipped: %s", entry, exc)
+
+            while queued and len(pending) < MAX_INFLIGHT_PER_JOB * jobs:
+                entry, out, need = queued[0]
+                if budget is not None and pending and not budget.fits(need):
+                    break
+                queued.popleft()
+                future = executor.submit(convert_file, entry, out, args)
+                pending[future] = (entry, out, need)
+                if budget is not None:
+                    budget.acquire(need)
+
+            # Until the next poll, collecting files as they finish
+            timeout = max(0.0, next_poll - time.monotonic())
+            if pending:
+                finished, _ = wait(pending, timeout, return_when=FIRST_COMPLETED)
+                collect(finished)
+            elif stop is not None:
+                stop.wait(timeout)
+            else:
+                time.sleep(timeout)
+        collect(list(pending))
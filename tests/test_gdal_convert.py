@@ -0,0 +1,164 @@
+from argparse import ArgumentTypeError
+from pathlib import Path
+from typing import Any, List
+
+import numpy as np
+import pytest
+
+from geoconverter.gdal_convert import OutputSpec, get_args, parse_emit
+
+
+def test_parse_emit() -> None:
+    spec = parse_emit("PNG:dtype=Byte:bands=3,2,1:range=0,255:scale=0.1:suffix=_q")
+
+    assert spec == OutputSpec("PNG", "Byte", [3, 2, 1], [0.0, 255.0], 0.1, "_q")
+
+
+@pytest.mark.parametrize("scale", ["0", "-1", "1.5"])
+def test_parse_emit_rejects_scale_outside_unit_interval(scale: str) -> None:
+    with pytest.raises(ArgumentTypeError, match="scale"):
+        parse_emit(f"PNG:scale={scale}")
+
+
+def test_cache_flags_leave_subcommand() -> None:
+    args = get_args(
+        ["-i", "a.tif", "--stats-cache", "--preview-cache", "stretch", "-s", "2", "98"]
+    )
+
+    assert args.stats_cache and args.preview_cache
+    assert args.subcommands == "stretch"
+    assert args.stretch == [2.0, 98.0]
+
+
+@pytest.mark.parametrize("input", ["a.tif", "missing/"])
+def test_watch_needs_input_directory(tmp_path: Path, input: str) -> None:
+    with pytest.raises(SystemExit):
+        get_args(["-i", str(tmp_path / input), "--watch"])
+
+    assert get_args(["-i", str(tmp_path), "--watch"]).watch
+
+
+@pytest.fixture
+def raster(tmp_path: Path) -> Path:
+    """Three-band Int16 GeoTIFF with a nodata value."""
+    gdal = pytest.importorskip("osgeo.gdal")
+    path = tmp_path / "in.tif"
+    ds = gdal.GetDriverByName("GTiff").Create(str(path), 97, 61, 3, gdal.GDT_Int16)
+    ds.SetGeoTransform([0, 1, 0, 0, 0, -1])
+    rng = np.random.default_rng(0)
+    for i in range(1, 4):
+        band = ds.GetRasterBand(i)
+        band.WriteArray(rng.integers(-1000, 4000, (61, 97)).astype(np.int16))
+        band.SetNoDataValue(-1000)
+    ds = None
+    return path
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        ["-ot", "Byte"],
+        ["-ot", "UInt16", "-b", "3,1"],
+        ["-ot", "Float32", "-b", "2", "stretch", "-s", "2", "98"],
+        ["-ot", "Byte", "-b", "3,2,1", "stretch", "-s", "0.5", "99.5"],
+    ],
+)
+def test_vrt_chain_matches_direct_translate(
+    raster: Path, tmp_path: Path, options: List[str]
+) -> None:
+    from osgeo import gdal
+
+    from geoconverter.gdal_convert import convert_file
+
+    outputs: List[Any] = []
+    for chain in ([], ["--vrt-chain"]):
+        out = tmp_path / f"out{len(outputs)}.tif"
+        args = get_args(
+            ["-i", str(raster), "-o", str(out), "-of", "GTiff"] + chain + options
+        )
+        convert_file(raster, out, args)
+        outputs.append(gdal.Open(str(out)))
+
+    direct, chained = outputs
+    assert chained.RasterCount == direct.RasterCount
+    for i in range(1, direct.RasterCount + 1):
+        a, b = direct.GetRasterBand(i), chained.GetRasterBand(i)
+        assert a.DataType == b.DataType
+        assert (a.ReadAsArray() == b.ReadAsArray()).all()
+
+
+@pytest.mark.parametrize("bands", [[], ["-b", "3"]])
+def test_global_stretch_names_file_missing_bands(
+    tmp_path: Path, bands: List[str]
+) -> None:
+    gdal = pytest.importorskip("osgeo.gdal")
+    from geoconverter.gdal_convert import global_scale_params
+
+    entries = []
+    for name, count in (("three.tif", 3), ("two.tif", 2)):
+        path = tmp_path / name
+        ds = gdal.GetDriverByName("GTiff").Create(str(path), 8, 8, count, gdal.GDT_Byte)
+        for i in range(1, count + 1):
+            ds.GetRasterBand(i).WriteArray(np.full((8, 8), i, dtype=np.uint8))
+        ds = None
+        entries.append(path)
+    args = get_args(["-i", str(tmp_path)] + bands + ["stretch", "-s", "2", "98"])
+
+    with pytest.raises(RuntimeError, match="two.tif has 2 bands, band 3"):
+        global_scale_params(entries, args)
+
+
+@pytest.fixture(params=["Byte", "UInt16", "Float32"])
+def plain_raster(tmp_path: Path, request: Any) -> Path:
+    """Three-band GeoTIFF of each input type, without nodata."""
+    gdal = pytest.importorskip("osgeo.gdal")
+    path = tmp_path / f"plain_{request.param}.tif"
+    ds = gdal.GetDriverByName("GTiff").Create(
+        str(path), 97, 61, 3, gdal.GetDataTypeByName(request.param)
+    )
+    ds.SetGeoTransform([0, 1, 0, 0, 0, -1])
+    rng = np.random.default_rng(1)
+    for i in range(1, 4):
+        if request.param == "Float32":
+            values = rng.normal(100, 50, (61, 97)).astype(np.float32)
+        else:
+            high = 256 if request.param == "Byte" else 4000
+            values = rng.integers(0, high, (61, 97)).astype(np.uint16)
+        ds.GetRasterBand(i).WriteArray(values)
+    ds = None
+    return path
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        ["-ot", "Byte"],
+        ["-ot", "UInt16", "-b", "3,1"],
+        ["-ot", "Byte", "-b", "2", "stretch", "-s", "2", "98"],
+        ["-ot", "Float32", "-b", "3,2,1", "stretch", "-s", "0.5", "99.5"],
+    ],
+)
+def test_numpy_engine_matches_gdal_translate(
+    plain_raster: Path, tmp_path: Path, options: List[str]
+) -> None:
+    from osgeo import gdal
+
+    from geoconverter.gdal_convert import convert_file
+
+    outputs: List[Any] = []
+    for engine in ("gdal", "numpy"):
+        out = tmp_path / f"{engine}.tif"
+        args = get_args(
+            ["-i", str(plain_raster), "-o", str(out), "-of", "GTiff"]
+            + ["--engine", engine]
+            + options
+        )
+        convert_file(plain_raster, out, args)
+        outputs.append(gdal.Open(str(out)))
+
+    translated, rescaled = outputs
+    assert rescaled.RasterCount == translated.RasterCount
+    for i in range(1, translated.RasterCount + 1):
+        a, b = translated.GetRasterBand(i), rescaled.GetRasterBand(i)
+        assert a.DataType == b.DataType
+        assert (a.ReadAsArray() == b.ReadAsArray()).all()
@@ -0,0 +1,61 @@
+import zipfile
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("osgeo")
+
+from geoconverter.service import job_argv  # noqa: E402
+
+
+def test_job_argv() -> None:
+    job = {"input": "a.tif", "format": "COG", "bands": [3, 2, 1], "stretch": [2, 98]}
+
+    argv = job_argv(job, ["--stats-cache", "--stats-cache-dir", "stats"])
+
+    assert argv == [
+        "--stats-cache",
+        "--stats-cache-dir",
+        "stats",
+        "-i",
+        "a.tif",
+        "-of",
+        "COG",
+        "-b",
+        "3,2,1",
+        "stretch",
+        "-s",
+        "2.0",
+        "98.0",
+    ]
+
+
+def test_job_argv_rejects_batches(tmp_path: Path) -> None:
+    archive = tmp_path / "bundle.zip"
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("a.tif", b"")
+
+    for input in (tmp_path, archive):
+        with pytest.raises(ValueError, match="single raster"):
+            job_argv({"input": str(input)}, [])
+
+
+def test_jobs_without_output_write_next_to_their_input(tmp_path: Path) -> None:
+    import numpy as np
+    from osgeo import gdal
+
+    from geoconverter.service import run_job
+
+    for name in ("a.tif", "b.tif"):
+        ds = gdal.GetDriverByName("GTiff").Create(
+            str(tmp_path / name), 8, 8, 1, gdal.GDT_UInt16
+        )
+        ds.GetRasterBand(1).WriteArray(np.full((8, 8), ord(name[0]), np.uint16))
+        ds = None
+
+    for name in ("a.tif", "b.tif"):
+        run_job(job_argv({"input": str(tmp_path / name), "format": "GTiff"}, []))
+
+    for name in ("a", "b"):
+        ds = gdal.Open(str(tmp_path / f"{name}_converted.tif"))
+        assert ds.GetRasterBand(1).ReadAsArray()[0, 0] == ord(name)
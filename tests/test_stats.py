@@ -0,0 +1,115 @@
+import functools
+from typing import Any, List
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("osgeo.gdal")
+
+from geoconverter.stats import (  # noqa: E402
+    BracketBounds,
+    BracketHistogram,
+    band_histograms,
+    band_percentiles,
+    bracket_histograms,
+    common_histogram,
+    iter_windows,
+    merge_bracket_histograms,
+    merged_percentiles,
+    open_source,
+)
+
+PERCENTILES = [0, 2, 25, 50, 75, 98, 100]
+
+
+def mem_dataset(arr: np.ndarray, dtype: int) -> Any:
+    """In-memory dataset holding `arr` of shape (bands, rows, cols)."""
+    count, ny, nx = arr.shape
+    ds = gdal.GetDriverByName("MEM").Create("", nx, ny, count, dtype)
+    for i in range(count):
+        ds.GetRasterBand(i + 1).WriteArray(arr[i])
+    return ds
+
+
+def test_float32_percentiles_match_numpy() -> None:
+    # A tall spike of equal values forces refinement below float32 spacing
+    rng = np.random.default_rng(0)
+    arr = rng.random((1024, 1024), dtype=np.float32)
+    arr[rng.random(arr.shape) < 0.2] = 1.0
+    ds = mem_dataset(arr[None], gdal.GDT_Float32)
+
+    result = band_percentiles(ds, PERCENTILES, [1], max_memory=2**22)[0]
+
+    expected = np.percentile(arr.astype(np.float64), PERCENTILES)
+    np.testing.assert_allclose(result, expected, rtol=0, atol=0)
+
+
+def test_float32_percentiles_with_little_memory() -> None:
+    # Refined brackets end up narrower than float32 spacing
+    rng = np.random.default_rng(2)
+    arr = rng.normal(0, 1000, (600, 300)).astype(np.float32)
+    ds = mem_dataset(arr[None], gdal.GDT_Float32)
+
+    result = band_percentiles(ds, PERCENTILES, [1], max_memory=2**10)[0]
+
+    expected = np.percentile(arr.astype(np.float64), PERCENTILES)
+    np.testing.assert_allclose(result, expected, rtol=0, atol=0)
+
+
+def test_integer_percentiles_match_numpy() -> None:
+    rng = np.random.default_rng(1)
+    arr = rng.integers(-5000, 5000, (2, 300, 200)).astype(np.int32)
+    ds = mem_dataset(arr, gdal.GDT_Int32)
+
+    result = band_percentiles(ds, PERCENTILES, max_memory=2**16)
+
+    for band, values in zip(arr, result):
+        np.testing.assert_allclose(values, np.percentile(band, PERCENTILES))
+
+
+def test_merged_percentiles_match_numpy() -> None:
+    rng = np.random.default_rng(2)
+    parts = [rng.normal(0, 1000, (1, 200, 300)).astype(np.float32) for _ in range(3)]
+    parts[1][0, :50] = 3.0
+    sources = [
+        open_source(mem_dataset(p, gdal.GDT_Float32), [1], max_memory=2**16)
+        for p in parts
+    ]
+    everything = np.concatenate([p.ravel() for p in parts])
+    template = common_histogram(
+        ["Float32"], float(everything.min()), float(everything.max())
+    )
+    merged = template.empty_like()
+    for source in sources:
+        merged = merged.merge(
+            band_histograms(None, source=source, templates=[template])[0]
+        )
+    passes = []  # type: List[List[List[BracketBounds]]]
+
+    def refine(brackets: List[List[BracketBounds]]) -> List[List[BracketHistogram]]:
+        passes.append(brackets)
+        found = [bracket_histograms(source, brackets) for source in sources]
+        return [
+            [
+                functools.reduce(merge_bracket_histograms, per_file)
+                for per_file in zip(*per_band)
+            ]
+            for per_band in zip(*found)
+        ]
+
+    result = merged_percentiles([merged], PERCENTILES, refine)[0]
+
+    expected = np.percentile(everything.astype(np.float64), PERCENTILES)
+    np.testing.assert_allclose(result, expected, rtol=0, atol=0)
+    assert len(passes) <= 3
+
+
+def test_windows_budget_covers_all_bands() -> None:
+    arr = np.zeros((3, 512, 256), dtype=np.float32)
+    ds = mem_dataset(arr, gdal.GDT_Float32)
+    budget = 3 * 4 * 256 * 16
+
+    windows = list(iter_windows(ds, [1, 2, 3], budget))
+
+    assert sum(w * h for _, _, w, h in windows) == 512 * 256
+    assert all(3 * 4 * w * h <= budget for _, _, w, h in windows)
@@ -0,0 +1,21 @@
+from pathlib import Path
+
+import pytest
+
+from geoconverter.terrain import tile_dems, tileset_path
+
+
+def test_tileset_path_keeps_subdirectories() -> None:
+    root, out = Path("dems"), Path("out")
+
+    assert tileset_path(root / "north" / "a.tif", out, root) == out / "north" / "a"
+    assert tileset_path(root / "a.tif", out) == out / "a"
+
+
+def test_tile_dems_rejects_shared_tilesets(tmp_path: Path) -> None:
+    dems = [tmp_path / "north" / "a.tif", tmp_path / "south" / "a.tif"]
+
+    # Without the root both DEMs are named a, nothing is tiled
+    with pytest.raises(ValueError, match="would share"):
+        tile_dems(dems, tmp_path / "out")
+    assert not (tmp_path / "out").exists()
@@ -0,0 +1,23 @@
+from pathlib import Path
+
+from geoconverter.utils import partial_path, replace_output
+
+
+def test_replace_output_moves_sidecars(tmp_path: Path) -> None:
+    out = tmp_path / "a.dat"
+    partial = partial_path(out)
+    partial.write_bytes(b"raster")
+    # Named after the whole path, and by replacing its extension (ENVI)
+    aux = tmp_path / f"{partial.name}.aux.xml"
+    hdr = tmp_path / ".a.dat.hdr"
+    aux.write_bytes(b"<aux/>")
+    hdr.write_bytes(b"ENVI")
+
+    replace_output(partial, out, [str(partial), str(hdr)])
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "a.dat",
+        "a.dat.aux.xml",
+        "a.hdr",
+    ]
+    assert (tmp_path / "a.hdr").read_bytes() == b"ENVI"
@@ -0,0 +1,53 @@
+import logging
+import threading
+from argparse import Namespace
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from geoconverter.watch import FolderWatcher, watch_folder
+
+
+def test_folder_watcher_reports_settled_files(tmp_path: Path) -> None:
+    watcher = FolderWatcher(tmp_path, settle=0)
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "a.tif").write_bytes(b"a")
+    (tmp_path / "a.tif.aux.xml").write_bytes(b"<x/>")
+
+    assert watcher.poll() == []
+    assert watcher.poll() == [tmp_path / "sub" / "a.tif"]
+    assert watcher.poll() == []
+
+
+def test_watch_folder_skips_files_it_cannot_queue(
+    tmp_path: Path, caplog: pytest.LogCaptureFixture
+) -> None:
+    # Budgeting imports the statistics module
+    pytest.importorskip("osgeo")
+    inputs = tmp_path / "in"
+    inputs.mkdir()
+    (inputs / "bad.tif").write_bytes(b"not a raster")
+    (inputs / "good.tif").write_bytes(b"not a raster either")
+    args = Namespace(
+        input=str(inputs),
+        output=str(tmp_path / "out"),
+        watch_interval=0.01,
+        watch_settle=0,
+        memory_budget=0,
+        config=[("GDAL_CACHEMAX", "64MB")],
+    )
+    stop = threading.Event()
+    seen: List[str] = []
+
+    def target(entry: Path) -> Path:
+        seen.append(entry.name)
+        if len(seen) == 2:
+            stop.set()
+        raise RuntimeError(f"Unable to open {entry}")
+
+    with caplog.at_level(logging.ERROR, logger="geoconverter.watch"):
+        watch_folder(args, target, jobs=1, stop=stop)
+
+    assert seen == ["bad.tif", "good.tif"]
+    assert caplog.text.count("skipped: Unable to open") == 2